@@ -1,27 +1,28 @@
 import os
+import re
+import json
 import time
+import hashlib
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import google.generativeai as genai
 from dotenv import load_dotenv
+from domain_logic import compute_warranty_frame
+from storage import load_cached_report, save_cached_report
+from rate_limiter import RateLimiter
 
-# 환경 변수 로드 (API 키)
-load_dotenv(override=True)
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# API 키 로드와 SDK 설정(genai.configure)은 임포트 시점이 아니라 첫 AI 요청(또는 워밍업) 때 MODEL_CLIENTS에서 한 번만 수행
 
-# 모델은 초기화 시도 전에는 None으로 설정
-if GOOGLE_API_KEY:
-    # print(f"DEBUG: API Key Loaded: {GOOGLE_API_KEY[:10]}... (Length: {len(GOOGLE_API_KEY)})")
-    genai.configure(api_key=GOOGLE_API_KEY)
-else:
-    print("Warning: GOOGLE_API_KEY not found in .env file. AI features will be disabled.")
-
-def create_engineer_prompt(df, user_preference):
+def build_prompt_table(df, current_date, units=True):
     """
-    Gemini API에 전송할 엔지니어 관점의 분석 리포트 프롬프트를 생성합니다.
+    프롬프트에 넣을 매물 요약 표(DataFrame)를 만듭니다.
+    잔여 보증을 계산하고 단위를 붙인 뒤 컬럼명을 영문으로 바꾸며, 인덱스는 매물 번호([N번])로 사용됩니다.
+    units=False이면 값에 단위를 붙이지 않고 컬럼명에 단위를 표기합니다. (예: 'Price(만원)', compact 인코딩용)
     """
-    current_date = datetime.now()
-
     # 프롬프트에 넣을 데이터 요약 (옵션, 특수용도이력, 색상, 1인소유 컬럼 추가)
     # 필요한 컬럼이 있는지 확인하고 가져오기
     cols_to_use = [
@@ -32,74 +33,20 @@ def create_engineer_prompt(df, user_preference):
     # 실제 존재하는 컬럼만 필터링
     cols_to_use = [c for c in cols_to_use if c in df.columns]
     
-    summary_df = df[cols_to_use].copy()
+    summary_df = df[cols_to_use] # 컬럼 선택 결과는 Copy-on-Write로 원본과 분리되므로 별도 copy() 불필요
     
-    # 차량 경과 개월 수 계산
-    def calculate_months(reg_date_str):
-        try:
-            reg_date = pd.to_datetime(reg_date_str)
-            # 날짜 형식이 잘못되었거나 NaT인 경우 처리
-            if pd.isna(reg_date):
-                return None
-            return (current_date.year - reg_date.year) * 12 + (current_date.month - reg_date.month)
-        except:
-            return None
+    # 경과 개월 수와 잔여 보증 기간/거리 계산 (보증 만료 정책 포함, 전체 행을 한 번에 계산)
+    warranty_df = compute_warranty_frame(df, as_of=current_date)
+    for col in warranty_df.columns:
+        values = warranty_df[col]
+        if isinstance(values.dtype, pd.Int64Dtype):
+            # 날짜 정보가 없어 계산할 수 없는 개월 수는 Unknown으로 표기
+            values = values.astype(object).where(values.notna(), "Unknown")
+        summary_df[col] = values
 
-    if '최초 등록일' in summary_df.columns:
-        summary_df['경과개월수'] = summary_df['최초 등록일'].apply(calculate_months)
-    else:
-        summary_df['경과개월수'] = None
-
-    # 잔여 보증 기간/거리 계산
-    # 일반부품
-    if '일반부품보증기간(개월)' in summary_df.columns and '경과개월수' in summary_df.columns:
-        summary_df['잔여일반보증(개월)'] = summary_df.apply(
-            lambda x: max(0, x['일반부품보증기간(개월)'] - x['경과개월수']) if x['경과개월수'] is not None else "Unknown", axis=1
-        )
-    if '일반부품보증거리(km)' in summary_df.columns and '주행거리(km)' in summary_df.columns:
-        summary_df['잔여일반보증(km)'] = summary_df.apply(
-            lambda x: max(0, x['일반부품보증거리(km)'] - x['주행거리(km)']), axis=1
-        )
-        
-    # 주요부품
-    if '주요부품보증기간(개월)' in summary_df.columns and '경과개월수' in summary_df.columns:
-        summary_df['잔여주요보증(개월)'] = summary_df.apply(
-            lambda x: max(0, x['주요부품보증기간(개월)'] - x['경과개월수']) if x['경과개월수'] is not None else "Unknown", axis=1
-        )
-    if '주요부품보증거리(km)' in summary_df.columns and '주행거리(km)' in summary_df.columns:
-        summary_df['잔여주요보증(km)'] = summary_df.apply(
-            lambda x: max(0, x['주요부품보증거리(km)'] - x['주행거리(km)']), axis=1
-        )
-
-    # 보증 만료 정책 적용: 기간이나 거리 중 하나라도 만료(0)되면 둘 다 만료 처리
-    def sync_warranty_expiration(row, mon_col, km_col):
-        rem_mon = row.get(mon_col)
-        rem_km = row.get(km_col)
-        
-        # 날짜 정보가 없는 경우(Unknown) 처리
-        if rem_mon == "Unknown":
-            if rem_km == 0: # 거리가 만료되었으면 전체 만료
-                return 0, 0
-            return rem_mon, rem_km # 기간은 모르지만 거리는 남음 -> 유지
-            
-        # 둘 다 숫자인 경우
-        try:
-            if rem_mon <= 0 or rem_km <= 0:
-                return 0, 0
-        except:
-            pass # 비교 불가능한 경우 패스
-            
-        return rem_mon, rem_km
-
-    if '잔여일반보증(개월)' in summary_df.columns and '잔여일반보증(km)' in summary_df.columns:
-        gen_res = summary_df.apply(lambda x: sync_warranty_expiration(x, '잔여일반보증(개월)', '잔여일반보증(km)'), axis=1, result_type='expand')
-        summary_df['잔여일반보증(개월)'] = gen_res[0]
-        summary_df['잔여일반보증(km)'] = gen_res[1]
-
-    if '잔여주요보증(개월)' in summary_df.columns and '잔여주요보증(km)' in summary_df.columns:
-        maj_res = summary_df.apply(lambda x: sync_warranty_expiration(x, '잔여주요보증(개월)', '잔여주요보증(km)'), axis=1, result_type='expand')
-        summary_df['잔여주요보증(개월)'] = maj_res[0]
-        summary_df['잔여주요보증(km)'] = maj_res[1]
+    # 등록일은 날짜(datetime64)로 보관하므로 프롬프트에는 'YYYY-MM-DD' 문자열로 표기
+    if '최초 등록일' in summary_df.columns and pd.api.types.is_datetime64_any_dtype(summary_df['최초 등록일']):
+        summary_df['최초 등록일'] = summary_df['최초 등록일'].dt.strftime('%Y-%m-%d').fillna('')
 
     # 입력용 보증 컬럼은 LLM에게 혼동을 줄 수 있으므로 삭제하고 잔여량만 제공 (또는 둘 다 제공)
     # 리포트 작성에는 잔여량이 중요하므로 잔여량 위주로 컬럼 정리
@@ -107,13 +54,14 @@ def create_engineer_prompt(df, user_preference):
     drop_cols = ['일반부품보증기간(개월)', '일반부품보증거리(km)', '주요부품보증기간(개월)', '주요부품보증거리(km)']
     summary_df = summary_df.drop(columns=[c for c in drop_cols if c in summary_df.columns])
 
-    # 숫자만 있으면 LLM이 혼동할 수 있으므로 단위를 붙여 문자열로 변환
-    if '차량가격(만원)' in summary_df.columns:
-        summary_df['차량가격(만원)'] = summary_df['차량가격(만원)'].astype(str) + "만원"
-    if '주행거리(km)' in summary_df.columns:
-        summary_df['주행거리(km)'] = summary_df['주행거리(km)'].astype(str) + "km"
-    if '내차피해액' in summary_df.columns:
-        summary_df['내차피해액'] = summary_df['내차피해액'].astype(str) + "원"
+    # 숫자만 있으면 LLM이 혼동할 수 있으므로 단위를 붙여 문자열로 변환 (units=False이면 컬럼명에 단위 표기)
+    if units:
+        if '차량가격(만원)' in summary_df.columns:
+            summary_df['차량가격(만원)'] = summary_df['차량가격(만원)'].astype(str) + "만원"
+        if '주행거리(km)' in summary_df.columns:
+            summary_df['주행거리(km)'] = summary_df['주행거리(km)'].astype(str) + "km"
+        if '내차피해액' in summary_df.columns:
+            summary_df['내차피해액'] = summary_df['내차피해액'].astype(str) + "원"
     
     # 컬럼명 영문 변환 (LLM 인식 용이성)
     col_map = {
@@ -125,11 +73,138 @@ def create_engineer_prompt(df, user_preference):
         '잔여일반보증(개월)': 'Rem. Gen Warranty(Mon)', '잔여일반보증(km)': 'Rem. Gen Warranty(Km)',
         '잔여주요보증(개월)': 'Rem. Major Warranty(Mon)', '잔여주요보증(km)': 'Rem. Major Warranty(Km)'
     }
+    if not units:
+        col_map.update({'차량가격(만원)': 'Price(만원)', '주행거리(km)': 'Mileage(km)', '내차피해액': 'Own Damage Amount(원)'})
     summary_df = summary_df.rename(columns=col_map)
-    
-    data_str = summary_df.to_markdown()
+    return summary_df
+
+# 프롬프트 데이터 표 인코딩: 'compact'(TSV, 단위는 컬럼명에 표기, 반복되는 수리 항목은 범례 약어로, 옵션 길이 제한. 기본값)
+# 또는 'markdown'(기존 마크다운 표)
+PROMPT_ENCODING = os.getenv("AUTOSCAN_PROMPT_ENCODING", "compact")
+# compact 인코딩에서 매물 1대의 옵션 목록에 허용하는 최대 글자 수 (넘는 옵션은 '외 N개'로 표기)
+OPTION_CHAR_BUDGET = int(os.getenv("AUTOSCAN_OPTION_CHARS", "60"))
+
+_COMPACT_TABLE_NOTE = ("(매물 데이터: 탭으로 구분된 표(TSV). 첫 열 No는 매물 번호이며 단위는 컬럼명 괄호 안에 표기. "
+                       "Repair History의 R숫자는 아래 '수리 항목 범례'의 약어이고, ' / '는 서로 다른 사고 건을 구분합니다.)")
+_MARKDOWN_PADDING = re.compile(r' {2,}|-{4,}')
+_INCIDENT_SPLIT = re.compile(r'\n\s*\n')
+_INCIDENT_NUMBER = re.compile(r'^\s*\d+\.\s*')
+_OPTION_PRICE = re.compile(r'([\d,]+)\s*만원')
+_CELL_WHITESPACE = re.compile(r'\s*[\t\r\n]+\s*')
+
+def _split_repair_items(incident):
+    """사고 1건의 수리내역을 항목 단위로 나눕니다. (괄호 안의 쉼표는 항목 구분으로 보지 않음)"""
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(incident):
+        if ch in '(（':
+            depth += 1
+        elif ch in ')）':
+            depth = max(0, depth - 1)
+        elif ch == ',' and depth == 0:
+            items.append(incident[start:i])
+            start = i + 1
+    items.append(incident[start:])
+    return [item.strip() for item in items if item.strip()]
+
+def _parse_repair_history(text):
+    """수리내역 텍스트를 [사고 건별 항목 목록]으로 나눕니다. ('1.', '2.' 번호는 제거)"""
+    return [_split_repair_items(_INCIDENT_NUMBER.sub('', incident)) for incident in _INCIDENT_SPLIT.split(text) if incident.strip()]
+
+def _compact_options(text, budget):
+    """옵션 목록에서 개별 가격을 빼고 이름만 budget 글자까지 남긴 뒤, 남은 개수와 옵션가 합계를 덧붙입니다."""
+    names, total = [], 0
+    for part in _INCIDENT_SPLIT.split(text):
+        part = part.strip()
+        price = _OPTION_PRICE.fullmatch(part)
+        if price:
+            total += int(price.group(1).replace(',', ''))
+        elif part:
+            names.append(part)
+    kept, used = [], 0
+    for name in names:
+        if kept and used + len(name) + 1 > budget:
+            break
+        kept.append(name)
+        used += len(name) + 1
+    compact = ','.join(kept)
+    if len(kept) < len(names):
+        compact += f" 외 {len(names) - len(kept)}개"
+    if total:
+        compact += f" (옵션가 합계 {total}만원)"
+    return compact
+
+def _build_repair_legend(texts):
+    """
+    여러 매물에 반복되는 수리 항목에 약어(R1, R2, ...)를 붙입니다. {항목: 약어}
+    (반복 횟수 x 절약되는 토큰이 범례 한 줄의 비용보다 큰 항목만, 많이 나온 순서로 번호를 붙임)
+    """
+    counts = {}
+    for text, rows in texts.value_counts().items():
+        for incident in _parse_repair_history(text):
+            for item in incident:
+                counts[item] = counts.get(item, 0) + rows
+    legend = {}
+    for item, count in sorted(counts.items(), key=lambda kv: -kv[1]):
+        code = f"R{len(legend) + 1}"
+        item_cost, code_cost = estimate_tokens(item), estimate_tokens(code)
+        if count * (item_cost - code_cost) > item_cost + code_cost + 2:
+            legend[item] = code
+    return legend
+
+def encode_prompt_table(table_df, encoding=None):
+    """
+    build_prompt_table 결과를 프롬프트용 텍스트로 인코딩합니다.
+    반환값은 {'text': 전체 텍스트, 'header': 헤더 줄, 'rows': 행별 줄, 'row_codes': 행별 사용 약어, 'legend': {약어: 수리 항목}}이며,
+    분할(map-reduce) 분석은 이 구조로 행을 나누고 청크마다 필요한 범례만 붙입니다.
+    """
+    encoding = encoding or PROMPT_ENCODING
+    if encoding != 'compact':
+        text = table_df.to_markdown()
+        # 열 너비를 맞추느라 들어간 공백/구분선 패딩은 토큰만 차지하므로 청크에서는 줄임
+        lines = [_MARKDOWN_PADDING.sub(lambda m: '---' if m.group(0).startswith('-') else ' ', line) for line in text.split('\n')]
+        return {'text': text, 'header': lines[:2], 'rows': lines[2:], 'row_codes': [()] * (len(lines) - 2), 'legend': {}}
+
+    compact_df = table_df.copy()
+    if 'Option' in compact_df.columns:
+        options = compact_df['Option'].astype(object).where(compact_df['Option'].notna(), '')
+        compact_options = {text: _compact_options(str(text), OPTION_CHAR_BUDGET) for text in options.unique()}
+        compact_df['Option'] = options.map(compact_options)
+
+    legend, row_codes = {}, [()] * len(compact_df)
+    if 'Repair History' in compact_df.columns:
+        texts = compact_df['Repair History'].astype(object).where(compact_df['Repair History'].notna(), '').astype(str)
+        legend = _build_repair_legend(texts)
+        encoded_texts = {}
+        for text in texts.unique(): # 고유 수리내역만 한 번씩 인코딩
+            incidents = _parse_repair_history(text)
+            encoded_texts[text] = (
+                ' / '.join(','.join(legend.get(item, item) for item in incident) for incident in incidents),
+                tuple(legend[item] for incident in incidents for item in incident if item in legend),
+            )
+        compact_df['Repair History'] = texts.map(lambda text: encoded_texts[text][0])
+        row_codes = [encoded_texts[text][1] for text in texts]
+
+    for col in compact_df.columns:
+        if not pd.api.types.is_numeric_dtype(compact_df[col]):
+            values = compact_df[col].astype(object)
+            compact_df[col] = values.where(values.notna(), '').astype(str).str.replace(_CELL_WHITESPACE, ' ', regex=True)
+    lines = compact_df.to_csv(sep='\t', index_label='No', lineterminator='\n').rstrip('\n').split('\n')
+
+    header, rows = [_COMPACT_TABLE_NOTE, lines[0]], lines[1:]
+    code_legend = {code: item for item, code in legend.items()}
+    return {'text': _render_encoded_rows(header, rows, row_codes, code_legend), 'header': header, 'rows': rows, 'row_codes': row_codes, 'legend': code_legend}
 
-    prompt = f"""
+def _render_encoded_rows(header, rows, row_codes, legend):
+    """헤더, 행, 그리고 행에서 사용한 약어의 범례만 모아 텍스트로 만듭니다."""
+    lines = header + rows
+    used_codes = sorted({code for codes in row_codes for code in codes}, key=lambda code: int(code[1:]))
+    if used_codes:
+        lines += ['', '수리 항목 범례:'] + [f"{code}={legend[code]}" for code in used_codes]
+    return '\n'.join(lines)
+
+def _prompt_preamble(current_date, user_preference):
+    """프롬프트 공통 머리말 (역할, 평가 가이드, 사용자 성향, 분석 기준)"""
+    return f"""
     당신은 보수적이고 깐깐한 기계 공학자 출신의 중고차 전문가입니다. 
     다음 제공된 중고차 목록 데이터를 분석하여 구매자에게 리포트를 작성해 주세요.
 
@@ -158,13 +233,10 @@ def create_engineer_prompt(df, user_preference):
     3. **사용자 성향 반영**: "{user_preference}"에 맞춰 Top 3와 Worst 3를 선정하십시오.
     4. **정중한 태도**: 기계 공학적 지식을 바탕으로 하되, **모든 문장은 반드시 정중한 경어체(하십시오체 또는 해요체)를 사용하십시오.**
 
-    **요청 사항:**
-    - **Top 3 추천 차량**: 가성비 및 보증 혜택이 훌륭한 차량 3대 선정. 추천 이유 상세 기술.
-    - **Worst 3 경고 차량**: 위험하고 가성비 나쁜 차량 3대 선정. 비추천 이유 상세 기술.
-    - 데이터:
-    {data_str}
+"""
 
-    **출력 형식:**
+# 최종 리포트 출력 형식 (단일 프롬프트와 map-reduce 병합 단계 공통)
+REPORT_FORMAT = """    **출력 형식:**
     # 🛠️ 엔지니어의 픽: Top 3 가성비 매물
     1. **[N번] 차종 (가격 / 주행거리 / 색상)**
        - 💡 선정 이유: ...
@@ -176,39 +248,921 @@ def create_engineer_prompt(df, user_preference):
     # 📝 총평
     ...
     """
-    return prompt
 
-def generate_engineer_report(df, user_preference):
+# 구조화(JSON) 출력 형식: 모델은 매물 번호와 짧은 이유만 반환하고, 마크다운 리포트는 render_structured_report가 매물 데이터로 직접 작성
+STRUCTURED_REPORT_FORMAT = """    **출력 형식 (JSON):**
+    아래 형식의 JSON 객체만 출력하십시오. 차종, 가격, 주행거리, 색상 등 데이터에 이미 있는 정보는 다시 쓰지 말고 매물 번호만 id로 적으십시오.
+    (매물 번호는 데이터 표 맨 왼쪽 번호 또는 후보 목록의 [N번] 번호입니다.)
+    {"top": [{"id": 매물 번호, "reason": "선정 이유"}], "worst": [{"id": 매물 번호, "reason": "위험 요소"}], "summary": "총평"}
+    - top과 worst는 각각 최대 3개이며, 'Safety Tier'가 1인 매물은 top에 넣지 마십시오.
+    - reason과 summary는 위의 '상세 기술' 요청보다 이 지침을 우선하여, 핵심 근거만 1~2문장의 정중한 경어체로 간결하게 작성하십시오.
     """
-    Gemini API를 사용하여 엔지니어 관점의 분석 리포트를 생성합니다.
-    모델 폴백 메커니즘을 적용하여 API 오류 시 다음 모델을 시도합니다.
+
+# 구조화 출력 모드에서 모델에 전달하는 생성 설정 (JSON 응답 강제)
+_PICK_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"id": {"type": "integer"}, "reason": {"type": "string"}},
+        "required": ["id", "reason"],
+    },
+}
+STRUCTURED_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {"top": _PICK_SCHEMA, "worst": _PICK_SCHEMA, "summary": {"type": "string"}},
+        "required": ["top", "worst", "summary"],
+    },
+}
+
+# 리포트 출력 모드: 'markdown'(모델이 마크다운 리포트를 직접 작성, 스트리밍 표시. 기본값) 또는
+# 'json'(구조화 출력 후 로컬 렌더링. 출력 토큰은 줄지만 완성된 응답만 표시)
+REPORT_OUTPUT_MODE = os.getenv("AUTOSCAN_REPORT_OUTPUT", "markdown")
+
+def _report_prompt(preamble, data_str, output_format=REPORT_FORMAT):
+    """단일 요청용 리포트 프롬프트 (머리말 + 요청 사항 + 데이터 표 + 출력 형식)"""
+    return preamble + f"""    **요청 사항:**
+    - **Top 3 추천 차량**: 가성비 및 보증 혜택이 훌륭한 차량 3대 선정. 추천 이유 상세 기술.
+    - **Worst 3 경고 차량**: 위험하고 가성비 나쁜 차량 3대 선정. 비추천 이유 상세 기술.
+    - 데이터:
+    {data_str}
+
+""" + output_format
+
+def create_engineer_prompt(df, user_preference, structured=None, encoding=None):
+    """
+    Gemini API에 전송할 엔지니어 관점의 분석 리포트 프롬프트를 생성합니다.
+    structured가 None이면 REPORT_OUTPUT_MODE 설정을 따릅니다. (True: JSON 출력 형식, False: 마크다운 출력 형식)
+    encoding이 None이면 PROMPT_ENCODING 설정을 따릅니다. ('compact' 또는 'markdown')
+    """
+    if structured is None:
+        structured = REPORT_OUTPUT_MODE == 'json'
+    encoding = encoding or PROMPT_ENCODING
+    current_date = datetime.now()
+    data_str = encode_prompt_table(build_prompt_table(df, current_date, units=encoding != 'compact'), encoding)['text']
+    return _report_prompt(_prompt_preamble(current_date, user_preference), data_str, STRUCTURED_REPORT_FORMAT if structured else REPORT_FORMAT)
+
+def parse_structured_report(text):
+    """
+    구조화 출력(JSON) 응답을 {'top': [(id, reason)], 'worst': [(id, reason)], 'summary': str}로 변환합니다.
+    형식이 맞지 않으면 ValueError를 발생시킵니다.
     """
-    if GOOGLE_API_KEY is None:
-        return "API 키가 설정되지 않아 AI 분석을 수행할 수 없습니다.", None
+    text = text.strip()
+    if text.startswith("```"): # 코드 블록으로 감싼 응답 허용
+        text = text.strip("`").removeprefix("json").strip()
+    data = json.loads(text) # json.JSONDecodeError는 ValueError의 하위 클래스
+    if not isinstance(data, dict):
+        raise ValueError("JSON 객체가 아닙니다.")
+    report = {'summary': str(data.get('summary', '')).strip()}
+    for key in ('top', 'worst'):
+        picks = data.get(key, [])
+        if not isinstance(picks, list):
+            raise ValueError(f"'{key}'가 목록이 아닙니다.")
+        report[key] = [(int(pick['id']), str(pick.get('reason', '')).strip()) for pick in picks if isinstance(pick, dict) and 'id' in pick]
+    return report
+
+def _listing_title(row, listing_id):
+    """리포트 항목 제목: [N번] 차종 (가격 / 주행거리 / 색상)"""
+    price = f"{int(row['차량가격(만원)']):,}만원" if pd.notna(row.get('차량가격(만원)')) else "-"
+    mileage = f"{int(row['주행거리(km)']):,}km" if pd.notna(row.get('주행거리(km)')) else "-"
+    color = row.get('색상') if pd.notna(row.get('색상')) and row.get('색상') != '' else "-"
+    return f"**[{listing_id}번] {row.get('차량명', '')} ({price} / {mileage} / {color})**"
 
-    # 사용 가능한 모델 리스트 (우선순위 순)
-    # models.txt 기반
-    model_candidates = [
-        'gemini-2.5-pro',
-        'gemini-2.5-flash',
-        'gemini-2.0-flash',
-        'gemini-2.0-flash-lite'
+def render_structured_report(report, df):
+    """
+    parse_structured_report 결과를 매물 데이터(df)로 채워 기존과 같은 형식의 마크다운 리포트를 작성합니다.
+    데이터에 없는 매물 번호는 제외하고, Tier 1 매물이 Top 3에 들어 있으면 추천 목록에서 빼고 경고 문구를 남깁니다.
+    """
+    notes = []
+    top_lines, worst_lines = [], []
+    for key, lines, label, limit in (('top', top_lines, "💡 선정 이유", 3), ('worst', worst_lines, "⚠️ 위험 요소", 3)):
+        seen = set()
+        for listing_id, reason in report[key]:
+            if listing_id in seen:
+                continue
+            seen.add(listing_id)
+            if listing_id not in df.index:
+                notes.append(f"AI가 존재하지 않는 매물 번호({listing_id}번)를 선택하여 제외했습니다.")
+                continue
+            row = df.loc[listing_id]
+            if key == 'top' and 'Tier' in df.columns and row['Tier'] == 1:
+                notes.append(f"AI가 Top 3로 선택한 [{listing_id}번] {row.get('차량명', '')}은(는) Tier 1(골격 손상) 매물이므로 추천 목록에서 제외했습니다.")
+                continue
+            if len(lines) >= limit:
+                continue
+            lines.append(f"{len(lines) + 1}. {_listing_title(row, listing_id)}\n   - {label}: {reason}")
+
+    sections = [
+        "# 🛠️ 엔지니어의 픽: Top 3 가성비 매물",
+        "\n".join(top_lines) if top_lines else "추천할 만한 매물이 없습니다.",
+        "# 🚨 엔지니어의 경고: 절대 사면 안 되는 매물 (Worst 3)",
+        "\n".join(worst_lines) if worst_lines else "특별히 경고할 매물이 없습니다.",
+        "# 📝 총평",
+        report['summary'] or "-",
     ]
+    if notes:
+        sections.append("\n\n".join(f"> ⚠️ {note}" for note in notes))
+    return "\n\n".join(sections)
+
+# 요청 1건에 허용하는 최대 입력 토큰 수 (로컬 추정치 기준). 전체 프롬프트가 이를 넘으면 map-reduce 리포트로 전환합니다.
+PROMPT_TOKEN_BUDGET = int(os.getenv("AUTOSCAN_PROMPT_TOKEN_BUDGET", "100000"))
+
+# map 단계에서 부분 목록마다 받을 Top/Worst 후보 수
+SHORTLIST_SIZE = 3
+
+# 사용 가능한 모델 리스트 (우선순위 순)
+# models.txt 기반
+MODEL_CANDIDATES = [
+    'gemini-2.5-pro',
+    'gemini-2.5-flash',
+    'gemini-2.0-flash',
+    'gemini-2.0-flash-lite'
+]
+
+# 헤지 요청 사용 여부(opt-in, 모델 호출 수가 늘어나므로 기본은 순차 폴백)와,
+# 호출이 시작된 뒤 응답이 없을 때 다음 후보 모델을 추가로 호출하기까지 기다리는 시간(초)
+HEDGED_REQUESTS = os.getenv("AUTOSCAN_HEDGED_REQUESTS", "0") == "1"
+HEDGE_DELAY_SECONDS = float(os.getenv("AUTOSCAN_HEDGE_DELAY", "8"))
+# 헤지 요청 응답 선택 정책: 'prefer-primary'(우선순위가 높은 모델 응답을 잠시 더 기다림) 또는 'first'(먼저 도착한 응답)
+HEDGE_POLICY = os.getenv("AUTOSCAN_HEDGE_POLICY", "prefer-primary")
+HEDGE_PREFERENCE_GRACE = float(os.getenv("AUTOSCAN_HEDGE_GRACE", "5"))
+
+# 모델별 분당 요청 수(RPM) 한도. 여러 워커 프로세스가 RATE_LIMIT_DB 파일을 공유하여 합산 요청이 한도를 넘지 않도록 대기열로 조절합니다.
+# API 키 등급마다 한도가 다르므로 기본값은 제한 없음이며, AUTOSCAN_RATE_LIMITS='{"gemini-2.5-pro": 5}' 처럼 JSON으로 모델별 값을 설정합니다. (0이면 제한하지 않음)
+MODEL_RATE_LIMITS = json.loads(os.getenv("AUTOSCAN_RATE_LIMITS", "{}"))
+# 모델별 동시 요청(스트리밍 포함) 수 한도
+MODEL_MAX_CONCURRENCY = int(os.getenv("AUTOSCAN_MODEL_CONCURRENCY", "4"))
+RATE_LIMIT_DB = os.getenv("AUTOSCAN_RATE_LIMIT_DB", "rate_limit.db")
+RATE_LIMITER = RateLimiter(RATE_LIMIT_DB)
+
+def estimate_tokens(text):
+    """
+    API 호출 없이 텍스트의 토큰 수를 추정합니다. (예산 확인용, 실제보다 크게 잡는 보수적 추정)
+    ASCII 문자는 약 4자당 1토큰, 한글 등 비ASCII 문자는 1자당 1토큰으로 계산합니다.
+    """
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+def _tier1_warning_lines(df):
+    """Tier 1(골격 손상) 매물을 표 대신 한 줄짜리 경고 목록으로 요약합니다."""
+    lines = []
+    for idx, row in df.iterrows():
+        lines.append(f"- [{idx}번] {row.get('차량명', '')} ({row.get('차량가격(만원)', '')}만원 / {row.get('주행거리(km)', '')}km): {row.get('분석결과', '')}")
+    return lines
+
+def _fit_lines(lines, budget_tokens):
+    """목록을 예산 안에 들어가는 만큼만 남기고, 잘린 개수를 덧붙입니다."""
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line)
+        if kept and used + cost > budget_tokens:
+            kept.append(f"- ... 외 {len(lines) - len(kept)}대")
+            break
+        kept.append(line)
+        used += cost
+    return kept
+
+def _chunk_table(encoded, row_mask, budget_tokens):
+    """
+    encode_prompt_table로 인코딩한 표에서 row_mask에 해당하는 행만 골라,
+    헤더와 (compact 인코딩이면) 청크에서 사용한 약어의 범례를 포함해 budget_tokens 이하가 되도록 행 단위로 나눕니다.
+    (행 하나가 예산을 넘는 경우에는 그 행만 단독 청크가 됩니다.)
+    """
+    header, legend = encoded['header'], encoded['legend']
+    selected = [(row, codes) for row, codes, keep in zip(encoded['rows'], encoded['row_codes'], row_mask) if keep]
+    header_cost = estimate_tokens('\n'.join(header))
+    chunks, current, current_codes, used = [], [], set(), header_cost
+
+    def flush():
+        chunks.append(_render_encoded_rows(header, [row for row, _ in current], [codes for _, codes in current], legend))
+
+    for row, codes in selected:
+        new_codes = set(codes) - current_codes
+        cost = estimate_tokens(row) + 1 + sum(estimate_tokens(f"{code}={legend[code]}") + 1 for code in new_codes)
+        if current and used + cost > budget_tokens:
+            flush()
+            current, current_codes, used = [], set(), header_cost
+            cost = estimate_tokens(row) + 1 + sum(estimate_tokens(f"{code}={legend[code]}") + 1 for code in set(codes))
+        current.append((row, codes))
+        current_codes.update(codes)
+        used += cost
+    if current:
+        flush()
+    return chunks
+
+def _shortlist_prompt(preamble, data_str, label):
+    """map 단계 프롬프트: 일부 매물(또는 1차 후보 목록)에서 Top/Worst 후보만 짧게 추립니다."""
+    return preamble + f"""    **요청 사항 ({label}):**
+    - 전체 매물 중 일부입니다. 이 목록에서 Top 3 후보와 Worst 3 후보를 각각 최대 {SHORTLIST_SIZE}대씩 고르십시오.
+    - 각 후보는 `[N번] 차종 (가격 / 주행거리 / 색상) - 핵심 근거` 형식의 한 줄로 작성하고, N번은 데이터의 번호를 그대로 사용하십시오.
+    - 서론이나 총평 없이 아래 출력 형식만 작성하십시오.
+    - 데이터:
+    {data_str}
+
+    **출력 형식:**
+    ## Top 후보
+    - [N번] ...
+    ## Worst 후보
+    - [N번] ...
+    """
+
+def _merge_prompt(preamble, shortlists, tier1_lines, output_format=REPORT_FORMAT):
+    """reduce 단계 프롬프트: 부분별 후보와 Tier 1 경고 목록을 합쳐 최종 Top 3 / Worst 3 리포트를 작성합니다."""
+    shortlist_str = '\n\n'.join(shortlists)
+    tier1_str = '\n'.join(tier1_lines) if tier1_lines else '- 없음'
+    return preamble + f"""    **요청 사항:**
+    - 매물이 많아 여러 부분으로 나누어 1차로 추린 후보 목록입니다. 이 후보들 중에서 최종 Top 3와 Worst 3를 선정하십시오.
+    - **Tier 1 경고 목록**은 규칙 기반으로 미리 분류된 골격 손상 매물입니다. 절대 추천하지 말고 Worst 선정 시 우선 고려하십시오.
+    - **Top 3 추천 차량**: 가성비 및 보증 혜택이 훌륭한 차량 3대 선정. 추천 이유 상세 기술.
+    - **Worst 3 경고 차량**: 위험하고 가성비 나쁜 차량 3대 선정. 비추천 이유 상세 기술.
+    - 1차 후보 목록:
+    {shortlist_str}
+
+    - Tier 1 경고 목록:
+    {tier1_str}
+
+""" + output_format
+
+def report_cache_key(prompt, model_name, user_preference, generation_config=None):
+    """(프롬프트, 모델명, 사용자 성향, 생성 설정) 조합의 내용 해시 (리포트 캐시 키)"""
+    parts = [prompt, model_name, user_preference]
+    if generation_config:
+        parts.append(generation_config) # 생성 설정이 없는 요청의 키는 기존 캐시와 같게 유지
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ReportCancelledError(Exception):
+    """리포트 생성 작업이 취소되었을 때 발생합니다."""
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise ReportCancelledError()
+
+class ModelHealth:
+    """
+    모델별 호출 지연 시간/오류 통계와 서킷 브레이커.
+    같은 모델이 연속으로 failure_threshold번 실패하면 cooldown_seconds 동안 후보에서 제외(open)하고,
+    쿨다운이 지나면 다시 시도하여 성공하면 정상(closed)으로 되돌립니다. (프로세스 내 모든 세션이 공유)
+    """
+
+    def __init__(self, failure_threshold=3, cooldown_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, model_name):
+        return self._stats.setdefault(model_name, {
+            'successes': 0, 'failures': 0, 'consecutive_failures': 0,
+            'avg_latency': None, 'avg_first_chunk': None, 'open_until': 0.0,
+        })
+
+    def available(self, model_name):
+        """서킷이 열려 있지 않은(호출해도 되는) 모델이면 True"""
+        with self._lock:
+            return self._entry(model_name)['open_until'] <= time.time()
+
+    def record_success(self, model_name, latency, first_chunk_latency=None):
+        with self._lock:
+            entry = self._entry(model_name)
+            entry['successes'] += 1
+            entry['consecutive_failures'] = 0
+            entry['open_until'] = 0.0
+            # 지연 시간은 최근 값에 가중치를 둔 지수 이동 평균
+            entry['avg_latency'] = latency if entry['avg_latency'] is None else 0.7 * entry['avg_latency'] + 0.3 * latency
+            if first_chunk_latency is not None: # 스트리밍 호출의 첫 응답 조각까지 걸린 시간
+                previous = entry['avg_first_chunk']
+                entry['avg_first_chunk'] = first_chunk_latency if previous is None else 0.7 * previous + 0.3 * first_chunk_latency
+
+    def record_failure(self, model_name, latency):
+        with self._lock:
+            entry = self._entry(model_name)
+            entry['failures'] += 1
+            entry['consecutive_failures'] += 1
+            if entry['consecutive_failures'] >= self.failure_threshold:
+                entry['open_until'] = time.time() + self.cooldown_seconds
+
+    def stats(self):
+        """모델별 통계 사본 (open: 현재 후보에서 제외 중인지)"""
+        now = time.time()
+        with self._lock:
+            return {name: {**entry, 'open': entry['open_until'] > now} for name, entry in self._stats.items()}
+
+# 모델별 지연/오류 통계 및 서킷 브레이커 (프로세스 공용)
+MODEL_HEALTH = ModelHealth(
+    failure_threshold=int(os.getenv("AUTOSCAN_CIRCUIT_FAILURES", "3")),
+    cooldown_seconds=float(os.getenv("AUTOSCAN_CIRCUIT_COOLDOWN", "60")),
+)
+
+class ModelClientRegistry:
+    """
+    프로세스 공용 모델 클라이언트 레지스트리.
+    .env의 API 키 로드와 genai.configure는 처음 필요할 때 한 번만 수행하고, 모델별 GenerativeModel 핸들을 만들어 재사용합니다.
+    핸들이 내부 전송 채널(gRPC 클라이언트)을 유지하므로, 리포트마다 연결/핸드셰이크 비용이 다시 들지 않습니다.
+    api_key, model_factory를 지정하면 .env 대신 해당 키와 모델 생성 함수를 사용합니다. (테스트용)
+    """
+
+    def __init__(self, api_key=None, model_factory=None):
+        self._api_key = api_key
+        self._model_factory = model_factory
+        self._configured = False
+        self._models = {}
+        self._lock = threading.Lock()
+        self._warm_up_thread = None
+
+    def _configure(self):
+        """API 키를 읽고 SDK를 설정합니다. (self._lock을 잡은 상태에서 호출)"""
+        if self._configured:
+            return
+        if self._api_key is None:
+            load_dotenv(override=True)
+            self._api_key = os.getenv("GOOGLE_API_KEY")
+        if not self._api_key:
+            print("Warning: GOOGLE_API_KEY not found in .env file. AI features will be disabled.")
+        elif self._model_factory is None:
+            genai.configure(api_key=self._api_key)
+        self._configured = True
 
-    prompt = create_engineer_prompt(df, user_preference)
+    def available(self):
+        """API 키가 설정되어 AI 기능을 사용할 수 있으면 True"""
+        with self._lock:
+            self._configure()
+            return bool(self._api_key)
 
+    def get(self, model_name):
+        """모델 핸들을 반환합니다. (모델별로 처음 한 번만 생성)"""
+        with self._lock:
+            self._configure()
+            model = self._models.get(model_name)
+            if model is None:
+                factory = self._model_factory or genai.GenerativeModel
+                model = self._models[model_name] = factory(model_name)
+            return model
+
+    def warm_up(self, model_names=None, ping=True):
+        """
+        SDK 설정과 모델 핸들 생성을 백그라운드 스레드에서 미리 수행합니다. (프로세스당 한 번만 실행)
+        ping=True이면 1순위 모델에 count_tokens를 보내 전송 채널 연결까지 미리 맺어 둡니다. (생성 요청이 아니므로 출력 토큰 비용 없음)
+        """
+        with self._lock:
+            if self._warm_up_thread is not None:
+                return self._warm_up_thread
+            self._warm_up_thread = threading.Thread(target=self._warm_up, args=(model_names or MODEL_CANDIDATES, ping), name="model-warm-up", daemon=True)
+        self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    def _warm_up(self, model_names, ping):
+        try:
+            if not self.available():
+                return
+            models = [self.get(model_name) for model_name in model_names]
+            if ping:
+                models[0].count_tokens("ping")
+        except Exception as e:
+            print(f"Warning: Model warm-up failed. Error: {e}")
+
+# 모델 클라이언트 레지스트리 (프로세스 공용)
+MODEL_CLIENTS = ModelClientRegistry()
+# 서버 시작 시 워밍업에서 연결까지 미리 맺을지 여부
+WARM_UP_PING = os.getenv("AUTOSCAN_WARM_UP_PING", "1") != "0"
+
+def warm_up_model_clients():
+    """앱 시작 시 호출하는 워밍업 훅. 첫 리포트 요청 전에 SDK 설정과 연결을 백그라운드로 준비합니다."""
+    return MODEL_CLIENTS.warm_up(ping=WARM_UP_PING)
+
+# 모델 호출을 실행하는 스레드 풀 (헤지 요청은 여러 모델을 동시에 호출하므로 리포트 작업 풀과 분리)
+_model_executor = ThreadPoolExecutor(max_workers=max(8, len(MODEL_CANDIDATES) * 2), thread_name_prefix="model-call")
+
+def _stream_text(response, on_chunk, stop_event):
+    """스트리밍 응답을 조각 단위로 읽으며 지금까지 받은 전체 텍스트로 on_chunk를 호출하고, (전체 텍스트, 첫 조각 도착 시각)을 반환합니다."""
+    parts = []
+    first_chunk_at = None
+    for chunk in response:
+        _check_cancelled(stop_event) # 취소되거나 다른 모델이 이기면 남은 스트림을 더 읽지 않음
+        try:
+            piece = chunk.text
+        except ValueError:
+            continue # 텍스트가 없는 조각(종료 사유만 담긴 마지막 조각 등)은 건너뜀
+        if not piece:
+            continue
+        if first_chunk_at is None:
+            first_chunk_at = time.perf_counter()
+        parts.append(piece)
+        on_chunk(''.join(parts))
+    if not parts:
+        raise ValueError("모델 응답에 텍스트가 없습니다.")
+    return ''.join(parts), first_chunk_at
+
+def _is_rate_limit_error(error):
+    """할당량 초과(HTTP 429 / ResourceExhausted) 오류인지 확인"""
+    return type(error).__name__ in ('ResourceExhausted', 'TooManyRequests') or '429' in str(error)
+
+def _acquire_model_lease(model_name, stop_event=None, on_queue=None):
+    """
+    RATE_LIMITER에서 모델별 요청 한도(토큰 버킷, 동시 요청 수)를 확인하고, 한도가 찼으면 대기열에서 순서를 기다린 뒤 lease ID를 반환합니다.
+    (대기 중에는 on_queue(대기 순번)으로 순번을 알리며, 통과하면 on_queue(0)을 호출)
+    stop_event가 설정되면 대기를 멈추고 ReportCancelledError를 발생시킵니다.
+    """
+    lease_id = RATE_LIMITER.acquire(model_name, MODEL_RATE_LIMITS.get(model_name, 0), max_concurrency=MODEL_MAX_CONCURRENCY, cancel_event=stop_event, on_wait=on_queue)
+    if lease_id is None:
+        raise ReportCancelledError()
+    return lease_id
+
+def _call_model(model_name, prompt, on_chunk=None, stop_event=None, on_queue=None, generation_config=None):
+    """
+    모델 하나를 호출하고 결과(성공/실패, 지연 시간)를 MODEL_HEALTH에 기록합니다.
+    호출 전에 _acquire_model_lease로 요청 한도 대기열을 통과합니다.
+    on_chunk가 주어지면 스트리밍 모드(stream=True)로 호출하여, 응답 조각이 도착할 때마다 지금까지의 전체 텍스트로 on_chunk를 호출합니다.
+    stop_event가 설정되면 대기/스트림 읽기를 멈추고 ReportCancelledError를 발생시킵니다. (실패로 집계하지 않음)
+    generation_config가 주어지면 그대로 generate_content에 전달합니다. (구조화 출력 등)
+    """
+    lease_id = _acquire_model_lease(model_name, stop_event, on_queue)
+    try:
+        return _call_model_with_lease(model_name, prompt, on_chunk, stop_event, generation_config)
+    finally:
+        RATE_LIMITER.release(lease_id)
+
+def _submit_model_call(model_name, prompt, on_chunk=None, stop_event=None, on_queue=None, generation_config=None, on_start=None):
+    """
+    _call_model과 같은 호출을 비동기로 보내고 Future를 반환합니다. (헤지 요청용)
+    요청 한도 대기열은 전용 스레드에서 기다리고, lease를 받은 뒤에만 _model_executor 스레드에서 모델을 호출하므로
+    대기 중인 요청이 모델 호출 스레드 풀을 차지하지 않습니다. on_start가 주어지면 모델 호출 직전에 on_start()를 호출합니다.
+    대기 중에 Future가 취소되면 lease를 받는 즉시 반환하고 모델을 호출하지 않습니다.
+    """
+    future = Future()
+
+    def call_with_lease(lease_id):
+        try:
+            if on_start is not None:
+                on_start()
+            future.set_result(_call_model_with_lease(model_name, prompt, on_chunk, stop_event, generation_config))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            RATE_LIMITER.release(lease_id)
+
+    def wait_for_lease():
+        try:
+            lease_id = _acquire_model_lease(model_name, stop_event, on_queue)
+        except BaseException as e:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(e)
+            return
+        if not future.set_running_or_notify_cancel():
+            RATE_LIMITER.release(lease_id)
+            return
+        try:
+            _model_executor.submit(call_with_lease, lease_id)
+        except RuntimeError as e: # 인터프리터 종료 중(스레드 풀 종료)
+            RATE_LIMITER.release(lease_id)
+            future.set_exception(e)
+
+    threading.Thread(target=wait_for_lease, name=f"model-lease-{model_name}", daemon=True).start()
+    return future
+
+def _call_model_with_lease(model_name, prompt, on_chunk, stop_event, generation_config=None):
+    # 대기열에서 기다린 시간은 모델 지연 시간 통계에서 제외
+    start = time.perf_counter()
+    first_chunk_latency = None
+    try:
+        model_instance = MODEL_CLIENTS.get(model_name) # 프로세스 공용 핸들 재사용
+        options = {'generation_config': generation_config} if generation_config else {}
+        if on_chunk is None:
+            text = model_instance.generate_content(prompt, **options).text
+        else:
+            text, first_chunk_at = _stream_text(model_instance.generate_content(prompt, stream=True, **options), on_chunk, stop_event)
+            first_chunk_latency = first_chunk_at - start
+    except ReportCancelledError:
+        raise
+    except Exception as e:
+        MODEL_HEALTH.record_failure(model_name, time.perf_counter() - start)
+        if _is_rate_limit_error(e):
+            RATE_LIMITER.drain(model_name) # 한도 초과 응답을 받으면 토큰이 다시 채워질 때까지 같은 모델로 보내지 않음
+        print(f"Warning: Failed with {model_name}. Error: {e}")
+        raise
+    MODEL_HEALTH.record_success(model_name, time.perf_counter() - start, first_chunk_latency)
+    return text
+
+def _available_candidates():
+    """서킷이 열린 모델을 제외한 후보 목록 (모두 제외된 경우에는 전체 목록으로 재시도)"""
+    return [m for m in MODEL_CANDIDATES if MODEL_HEALTH.available(m)] or list(MODEL_CANDIDATES)
+
+def _generate_sequential(prompt, cancel_event=None, on_chunk=None, on_queue=None, generation_config=None):
+    """후보 모델을 우선순위대로 하나씩 시도합니다. (헤지 요청을 끈 경우)"""
     last_error = None
-    for model_name in model_candidates:
+    for model_name in _available_candidates():
+        _check_cancelled(cancel_event)
         try:
-            # 모델 초기화 시 오류 발생 방지를 위해 여기에 모델 생성 로직을 넣음
-            model_instance = genai.GenerativeModel(model_name)
-            response = model_instance.generate_content(prompt)
-            return response.text, model_name # 성공 시 리포트와 모델명 반환
+            return _call_model(model_name, prompt, on_chunk, cancel_event, on_queue, generation_config), model_name # 성공 시 리포트와 모델명 반환
+        except ReportCancelledError:
+            raise
         except Exception as e:
-            print(f"Warning: Failed with {model_name}. Error: {e}")
             last_error = e
-            time.sleep(1) # 잠시 대기 후 재시도
+            if cancel_event is not None:
+                cancel_event.wait(1) # 대기 중에도 취소되면 바로 깨어남
+            else:
+                time.sleep(1) # 잠시 대기 후 재시도
             continue
-    
-    # 모든 모델 실패 시 (항상 튜플을 반환하도록 수정)
-    return f"AI 분석 중 모든 모델에서 오류가 발생했습니다. 마지막 오류: {str(last_error)}", None
+    raise last_error
+
+def _generate_hedged(prompt, cancel_event=None, hedge_delay=None, policy=None, on_chunk=None, on_queue=None, generation_config=None):
+    """
+    헤지(hedged) 요청: 1순위 모델을 먼저 호출하고, 호출이 시작된 뒤 hedge_delay초 안에 응답이 없거나 오류가 나면
+    다음 후보를 추가로 동시에 호출합니다. (요청 한도 대기열에서 기다리는 시간은 hedge_delay에 포함하지 않음) 성공한 응답 중 정책(policy)에 따라 하나를 반환하고 나머지 요청은 취소합니다.
+
+    - policy='first': 가장 먼저 도착한 성공 응답을 반환
+    - policy='prefer-primary': 더 높은 우선순위 모델이 아직 응답 중이면 HEDGE_PREFERENCE_GRACE초까지 기다렸다가 우선순위가 높은 응답을 반환
+    (이미 전송된 HTTP 요청 자체는 중단할 수 없으므로, 진 요청은 결과를 버리고 아직 시작하지 않은 요청은 취소합니다.)
+
+    on_chunk가 주어지면 스트리밍으로 호출하며, 가장 먼저 응답 조각을 보낸 모델(leader)의 텍스트만 on_chunk로 전달합니다.
+    응답이 흘러나오기 시작하면 추가 헤지 요청은 보내지 않고(오류 시 제외), 진 스트림은 다음 조각에서 읽기를 멈춥니다.
+    """
+    hedge_delay = HEDGE_DELAY_SECONDS if hedge_delay is None else hedge_delay
+    policy = HEDGE_POLICY if policy is None else policy
+    candidates = _available_candidates()
+    priority = {model_name: i for i, model_name in enumerate(candidates)}
+    in_flight = {} # future -> model_name
+    successes = {} # model_name -> text
+    last_error = None
+    next_index = 0
+    last_start = None # 마지막으로 보낸 요청이 대기열을 통과한 시각 (통과 전에는 None)
+    first_success_at = None
+    stop_events = [] # 요청별 중단 신호 (반환 시 모두 설정하여 진 스트림을 멈춤)
+    stream_lock = threading.Lock()
+    stream_leader = None # 화면에 부분 응답을 보여주고 있는 모델
+
+    def forward_chunk(model_name):
+        def forward(text):
+            nonlocal stream_leader
+            with stream_lock:
+                if stream_leader is None:
+                    stream_leader = model_name
+                if stream_leader == model_name:
+                    on_chunk(text)
+        return forward
+
+    def launch_next():
+        nonlocal next_index, last_start
+        model_name = candidates[next_index]
+        next_index += 1
+        launch_index = next_index
+        last_start = None
+
+        def started():
+            nonlocal last_start
+            if next_index == launch_index: # 이후에 보낸 요청이 있으면 이전 요청의 시작 시각은 무시
+                last_start = time.monotonic()
+
+        stop_event = threading.Event()
+        stop_events.append(stop_event)
+        chunk_callback = forward_chunk(model_name) if on_chunk is not None else None
+        in_flight[_submit_model_call(model_name, prompt, chunk_callback, stop_event, on_queue, generation_config, started)] = model_name
+
+    def may_hedge():
+        # 마지막 요청이 대기열을 통과해 호출이 시작되었고, 아직 성공한 응답도 흘러나오는 스트림도 없을 때만 다음 후보를 추가로 호출
+        return next_index < len(candidates) and last_start is not None and not successes and stream_leader is None
+
+    launch_next()
+    try:
+        while True:
+            _check_cancelled(cancel_event)
+            if successes:
+                best = min(successes, key=priority.get)
+                waiting_for_better = any(priority[m] < priority[best] for m in in_flight.values())
+                if policy != 'prefer-primary' or not waiting_for_better or time.monotonic() - first_success_at >= HEDGE_PREFERENCE_GRACE:
+                    return successes[best], best
+            elif not in_flight and next_index >= len(candidates):
+                raise last_error
+
+            # 다음 헤지 요청 시각까지(또는 취소 확인 주기까지) 응답을 기다림
+            timeout = 0.5
+            if may_hedge():
+                timeout = min(timeout, max(0.0, last_start + hedge_delay - time.monotonic()))
+            done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                model_name = in_flight.pop(future)
+                try:
+                    successes[model_name] = future.result()
+                    first_success_at = first_success_at or time.monotonic()
+                except Exception as e:
+                    last_error = e
+                    with stream_lock:
+                        if stream_leader == model_name:
+                            stream_leader = None # 스트리밍 중 실패하면 다음으로 응답하는 모델이 이어서 표시
+                    if next_index < len(candidates) and not successes:
+                        launch_next() # 오류가 나면 지연 시간을 기다리지 않고 바로 다음 후보 호출
+
+            if may_hedge() and time.monotonic() - last_start >= hedge_delay:
+                launch_next()
+    finally:
+        for stop_event in stop_events:
+            stop_event.set()
+        for future in in_flight:
+            future.cancel() # 아직 시작하지 않은 요청은 취소, 실행 중인 스트림은 다음 조각에서 중단
+
+# 진행 중인 동일 요청 (프롬프트, 사용자 성향) -> 공유 결과. 같은 요청이 동시에 들어오면 모델 호출은 한 번만 보냄
+_inflight_requests = {}
+_inflight_lock = threading.Lock()
+
+def _generate_uncached(prompt, user_preference, cancel_event, on_chunk, on_queue, generation_config, validate=None):
+    if HEDGED_REQUESTS:
+        text, model_name = _generate_hedged(prompt, cancel_event, on_chunk=on_chunk, on_queue=on_queue, generation_config=generation_config)
+    else:
+        text, model_name = _generate_sequential(prompt, cancel_event, on_chunk, on_queue, generation_config)
+    if validate is not None:
+        try:
+            validate(text)
+        except (ValueError, KeyError, TypeError):
+            return text, model_name # 형식이 맞지 않는 응답은 캐시하지 않음 (호출자가 처리)
+    save_cached_report(report_cache_key(prompt, model_name, user_preference, generation_config), {'text': text, 'model': model_name})
+    return text, model_name
+
+def _generate_coalesced(prompt, user_preference=None, cancel_event=None, on_chunk=None, on_queue=None, generation_config=None, validate=None):
+    """
+    같은 (프롬프트, 사용자 성향, 생성 설정) 요청이 이미 진행 중이면 새로 보내지 않고 그 결과를 함께 기다립니다.
+    먼저 들어온 요청(leader)의 스트리밍 부분 응답과 요청 한도 대기 순번(on_queue)도 함께 전달받으며,
+    leader가 취소되면 대기하던 요청이 직접 다시 요청합니다.
+    """
+    key = report_cache_key(prompt, '', user_preference, generation_config)
+    while True:
+        with _inflight_lock:
+            entry = _inflight_requests.get(key)
+            is_leader = entry is None
+            if is_leader:
+                entry = _inflight_requests[key] = {'future': Future(), 'subscribers': [], 'partial': '', 'queue_subscribers': [], 'queue_position': None}
+            else:
+                if on_chunk is not None:
+                    entry['subscribers'].append(on_chunk)
+                if on_queue is not None:
+                    entry['queue_subscribers'].append(on_queue)
+            partial = entry['partial']
+            queue_position = entry['queue_position']
+
+        if is_leader:
+            def broadcast(text):
+                with _inflight_lock:
+                    entry['partial'] = text
+                    subscribers = list(entry['subscribers'])
+                on_chunk(text)
+                for subscriber in subscribers:
+                    subscriber(text)
+
+            def broadcast_queue(position):
+                # leader가 on_queue를 받지 않았더라도 함께 기다리는 요청에는 대기 순번을 전달
+                with _inflight_lock:
+                    entry['queue_position'] = position
+                    queue_subscribers = list(entry['queue_subscribers'])
+                if on_queue is not None:
+                    on_queue(position)
+                for subscriber in queue_subscribers:
+                    subscriber(position)
+
+            try:
+                result = _generate_uncached(prompt, user_preference, cancel_event, broadcast if on_chunk is not None else None, broadcast_queue, generation_config, validate)
+            except BaseException as e:
+                entry['future'].set_exception(e)
+                raise
+            else:
+                entry['future'].set_result(result)
+                return result
+            finally:
+                with _inflight_lock:
+                    _inflight_requests.pop(key, None)
+
+        try:
+            if partial and on_chunk is not None:
+                on_chunk(partial)
+            if queue_position is not None and on_queue is not None:
+                on_queue(queue_position)
+            while True:
+                _check_cancelled(cancel_event)
+                done, _ = wait([entry['future']], timeout=0.5)
+                if done:
+                    return entry['future'].result()
+        except ReportCancelledError:
+            if cancel_event is not None and cancel_event.is_set():
+                raise
+            # leader만 취소된 경우에는 직접 다시 요청
+        finally:
+            with _inflight_lock:
+                if on_chunk is not None and on_chunk in entry['subscribers']:
+                    entry['subscribers'].remove(on_chunk)
+                if on_queue is not None and on_queue in entry['queue_subscribers']:
+                    entry['queue_subscribers'].remove(on_queue)
+
+def _generate_with_fallback(prompt, user_preference=None, use_cache=True, cancel_event=None, on_chunk=None, on_queue=None, generation_config=None, validate=None):
+    """
+    후보 모델들로 generate_content를 호출하여 (응답 텍스트, 모델명, 캐시 사용 여부)를 반환합니다.
+    HEDGED_REQUESTS가 켜져 있으면 헤지 요청(_generate_hedged), 아니면 우선순위대로 순차 시도하며,
+    서킷이 열린(최근 연속 실패한) 모델은 건너뜁니다.
+    use_cache=True이면 같은 프롬프트로 이전에 받은 응답이 디스크 캐시에 있는지 먼저 확인하고,
+    새로 받은 응답은 항상 캐시에 저장합니다. (validate가 주어지면 validate(응답 텍스트)가 ValueError/KeyError/TypeError 없이 통과한 응답만 저장)
+    모든 모델이 실패하면 마지막 오류를 다시 발생시킵니다.
+    cancel_event(threading.Event)가 설정되면 남은 요청을 보내지 않고 ReportCancelledError를 발생시킵니다.
+    on_chunk가 주어지면 스트리밍으로 호출하여 부분 응답(지금까지의 전체 텍스트)을 전달합니다. (캐시 적중 시에는 호출되지 않음)
+    같은 요청이 이미 진행 중이면 모델을 다시 호출하지 않고 그 결과를 함께 사용하며, 요청 한도 대기 중에는 on_queue(대기 순번)를 호출합니다.
+    """
+    if use_cache:
+        for model_name in MODEL_CANDIDATES:
+            cached = load_cached_report(report_cache_key(prompt, model_name, user_preference, generation_config))
+            if cached is not None:
+                return cached['text'], model_name, True
+
+    text, model_name = _generate_coalesced(prompt, user_preference, cancel_event, on_chunk, on_queue, generation_config, validate)
+    return text, model_name, False
+
+def _generate_map_reduce_report(df, table_df, encoded, preamble, token_budget, user_preference=None, use_cache=True, cancel_event=None, on_partial=None, on_queue=None, structured=False):
+    """
+    전체 프롬프트가 토큰 예산을 넘을 때 사용하는 분할(map-reduce) 리포트 생성.
+    1) Tier 1 매물은 규칙 기반으로 미리 걸러 한 줄 경고 목록으로 요약
+    2) 나머지 매물 표를 예산 이하의 청크로 나누어 청크별 Top/Worst 후보를 요청 (map)
+    3) 후보가 많아 병합 프롬프트가 예산을 넘으면 후보 목록끼리 다시 추림
+    4) 후보와 Tier 1 목록으로 최종 Top 3 / Worst 3 리포트를 작성 (reduce)
+    부분 응답(on_partial)은 최종 리포트를 작성하는 reduce 요청에서만 전달되며, structured=True이면 reduce 요청만 JSON으로 받습니다.
+    """
+    # 머리말과 요청 문구가 차지하는 토큰을 제외한 나머지를 데이터에 배정
+    data_budget = max(token_budget - estimate_tokens(_shortlist_prompt(preamble, '', '')), token_budget // 4)
+
+    if 'Safety Tier' in table_df.columns:
+        tier1_mask = (table_df['Safety Tier'] == 1).to_numpy()
+    else:
+        tier1_mask = np.zeros(len(table_df), dtype=bool)
+    tier1_lines = _fit_lines(_tier1_warning_lines(df[tier1_mask]), data_budget // 4)
+
+    calls = 0
+    all_cached = True # 모든 호출이 캐시에서 나온 경우에만 캐시된 리포트로 표시
+    data_chunks = _chunk_table(encoded, ~tier1_mask, data_budget) if (~tier1_mask).any() else []
+    shortlists = []
+    for i, chunk in enumerate(data_chunks, start=1):
+        text, _, from_cache = _generate_with_fallback(_shortlist_prompt(preamble, chunk, f"부분 분석 {i}/{len(data_chunks)}"), user_preference, use_cache, cancel_event, on_queue=on_queue)
+        shortlists.append(text.strip())
+        calls += 1
+        all_cached = all_cached and from_cache
+
+    # 병합 프롬프트가 예산을 넘으면 후보 목록을 묶어서 다시 추림 (계층적 reduce)
+    while len(shortlists) > 1 and estimate_tokens(_merge_prompt(preamble, shortlists, tier1_lines)) > token_budget:
+        groups, current, used = [], [], 0
+        for shortlist in shortlists:
+            cost = estimate_tokens(shortlist)
+            if current and used + cost > data_budget:
+                groups.append(current)
+                current, used = [], 0
+            current.append(shortlist)
+            used += cost
+        groups.append(current)
+        if len(groups) == len(shortlists):
+            break # 더 묶을 수 없으면 그대로 병합
+        shortlists = []
+        for i, group in enumerate(groups, start=1):
+            text, _, from_cache = _generate_with_fallback(_shortlist_prompt(preamble, '\n\n'.join(group), f"후보 병합 {i}/{len(groups)}"), user_preference, use_cache, cancel_event, on_queue=on_queue)
+            shortlists.append(text.strip())
+            calls += 1
+            all_cached = all_cached and from_cache
+
+    merge_prompt = _merge_prompt(preamble, shortlists, tier1_lines, STRUCTURED_REPORT_FORMAT if structured else REPORT_FORMAT)
+    report_text, model_name, from_cache = _generate_with_fallback(merge_prompt, user_preference, use_cache, cancel_event, on_partial, on_queue, STRUCTURED_GENERATION_CONFIG if structured else None, parse_structured_report if structured else None)
+    calls += 1
+    return report_text, f"{model_name} (분할 분석 {calls}회 호출)", all_cached and from_cache
+
+def generate_engineer_report(df, user_preference, token_budget=PROMPT_TOKEN_BUDGET, use_cache=True, cancel_event=None, on_partial=None, on_queue=None, structured=None):
+    """
+    Gemini API를 사용하여 엔지니어 관점의 분석 리포트를 생성합니다.
+    모델 폴백 메커니즘을 적용하여 API 오류 시 다음 모델을 시도합니다.
+    프롬프트가 token_budget(추정 토큰 수)을 넘으면 매물을 나누어 분석한 뒤 병합하는 map-reduce 방식으로 생성합니다.
+    같은 (프롬프트, 모델, 사용자 성향)으로 생성한 리포트는 디스크 캐시에서 바로 반환하며, use_cache=False이면 캐시를 무시하고 새로 생성합니다.
+    cancel_event가 설정되면 남은 요청을 보내지 않고 ReportCancelledError를 발생시킵니다. (백그라운드 작업 취소용)
+    on_partial이 주어지면 리포트를 스트리밍으로 받아, 응답 조각이 도착할 때마다 지금까지 생성된 리포트 텍스트로 on_partial을 호출합니다.
+    모델별 요청 한도 때문에 대기하는 동안에는 on_queue(대기 순번, 통과 시 0)를 호출합니다.
+    structured=True(기본값은 REPORT_OUTPUT_MODE 설정)이면 모델에게 매물 번호와 짧은 이유만 JSON으로 받아 리포트를 로컬에서 작성합니다.
+    (출력 토큰이 크게 줄어드는 대신 스트리밍 부분 응답은 표시하지 않으며, JSON을 해석할 수 없으면 그 응답은 캐시하지 않고 마크다운 모드로 다시 요청합니다.)
+
+    Returns:
+        (리포트 텍스트, 모델명, 캐시 사용 여부)
+    """
+    if not MODEL_CLIENTS.available():
+        return "API 키가 설정되지 않아 AI 분석을 수행할 수 없습니다.", None, False
+    if structured is None:
+        structured = REPORT_OUTPUT_MODE == 'json'
+
+    # 표는 한 번만 렌더링하여 단일 프롬프트와 분할 분석에서 함께 사용
+    current_date = datetime.now()
+    preamble = _prompt_preamble(current_date, user_preference)
+    table_df = build_prompt_table(df, current_date, units=PROMPT_ENCODING != 'compact')
+    encoded = encode_prompt_table(table_df)
+    prompt = _report_prompt(preamble, encoded['text'], STRUCTURED_REPORT_FORMAT if structured else REPORT_FORMAT)
+    # JSON 조각은 화면에 보여줄 수 없으므로 구조화 출력에서는 완성된 응답만 사용
+    partial_callback = None if structured else on_partial
+
+    try:
+        if estimate_tokens(prompt) <= token_budget:
+            text, model_name, from_cache = _generate_with_fallback(prompt, user_preference, use_cache, cancel_event, partial_callback, on_queue, STRUCTURED_GENERATION_CONFIG if structured else None, parse_structured_report if structured else None)
+        else:
+            text, model_name, from_cache = _generate_map_reduce_report(df, table_df, encoded, preamble, token_budget, user_preference, use_cache, cancel_event, partial_callback, on_queue, structured)
+    except ReportCancelledError:
+        raise
+    except Exception as last_error:
+        # 모든 모델 실패 시 (항상 튜플을 반환하도록 수정)
+        return f"AI 분석 중 모든 모델에서 오류가 발생했습니다. 마지막 오류: {str(last_error)}", None, False
+
+    if not structured:
+        return text, model_name, from_cache
+    try:
+        return render_structured_report(parse_structured_report(text), df), model_name, from_cache
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Warning: Failed to parse structured report. Error: {e}")
+        return generate_engineer_report(df, user_preference, token_budget, use_cache, cancel_event, on_partial, on_queue, structured=False)
+
+# 백그라운드 리포트 작업을 처리하는 스레드 수 (프로세스 내 모든 세션이 공유)
+REPORT_WORKERS = int(os.getenv("AUTOSCAN_REPORT_WORKERS", "4"))
+# 끝난 작업 기록을 보관하는 시간(초)
+REPORT_JOB_RETENTION_SECONDS = 3600
+
+_report_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report-job")
+_report_jobs = {}
+_report_jobs_lock = threading.Lock()
+
+def _prune_report_jobs():
+    """보관 시간이 지난 끝난 작업 기록을 정리합니다."""
+    cutoff = time.time() - REPORT_JOB_RETENTION_SECONDS
+    with _report_jobs_lock:
+        for job_id in [job_id for job_id, job in _report_jobs.items() if job['finished'] and job['finished'] < cutoff]:
+            del _report_jobs[job_id]
+
+def _run_report_job(job_id, df, user_preference, use_cache):
+    """작업 스레드에서 리포트를 생성하고 결과를 작업 기록에 저장합니다."""
+    with _report_jobs_lock:
+        job = _report_jobs.get(job_id)
+        if job is None or job['status'] != 'pending':
+            return
+        job['status'] = 'running'
+    def update_partial(text):
+        with _report_jobs_lock:
+            if job['status'] == 'running':
+                job['partial'] = text
+
+    def update_queue_position(position):
+        with _report_jobs_lock:
+            job['queue_position'] = position
+
+    try:
+        result = generate_engineer_report(df, user_preference, use_cache=use_cache, cancel_event=job['cancel_event'], on_partial=update_partial, on_queue=update_queue_position)
+    except ReportCancelledError:
+        return
+    except Exception as e:
+        result = (f"AI 분석 중 오류가 발생했습니다: {e}", None, False)
+    with _report_jobs_lock:
+        if job['status'] == 'running': # 실행 중에 취소된 작업의 결과는 버림
+            job.update(status='done', result=result, finished=time.time())
+
+def submit_report_job(df, user_preference, use_cache=True):
+    """
+    리포트 생성을 백그라운드 작업으로 등록하고 작업 ID를 반환합니다.
+    Streamlit 스크립트 스레드를 막지 않으므로, 생성 중에도 다른 화면을 계속 사용할 수 있습니다.
+    """
+    _prune_report_jobs()
+    job_id = uuid.uuid4().hex
+    with _report_jobs_lock:
+        _report_jobs[job_id] = {
+            'status': 'pending', 'result': None, 'partial': '', 'queue_position': 0, 'created': time.time(), 'finished': None,
+            'cancel_event': threading.Event(), 'future': None,
+        }
+    future = _report_executor.submit(_run_report_job, job_id, df, user_preference, use_cache)
+    with _report_jobs_lock:
+        _report_jobs[job_id]['future'] = future
+    return job_id
+
+def get_report_job(job_id):
+    """
+    작업 상태를 반환합니다. (없는 작업이면 None)
+    status: 'pending'(대기) / 'running'(생성 중) / 'done'(완료, result에 (리포트, 모델명, 캐시 사용 여부)) / 'cancelled'(취소)
+    partial: 생성 중인 리포트의 지금까지 받은 부분 텍스트 (스트리밍)
+    queue_position: 모델 요청 한도 대기열에서의 순번 (대기 중이 아니면 0)
+    """
+    with _report_jobs_lock:
+        job = _report_jobs.get(job_id)
+        if job is None:
+            return None
+        return {
+            'status': job['status'],
+            'result': job['result'],
+            'partial': job['partial'],
+            'queue_position': job['queue_position'],
+            'elapsed': (job['finished'] or time.time()) - job['created'],
+        }
+
+def cancel_report_job(job_id):
+    """
+    대기 중이거나 실행 중인 작업을 취소합니다. 취소했으면 True를 반환합니다.
+    이미 전송된 API 요청은 중단할 수 없으므로, 실행 중인 작업은 그 결과를 버리고 다음 요청부터 진행하지 않습니다.
+    """
+    with _report_jobs_lock:
+        job = _report_jobs.get(job_id)
+        if job is None or job['status'] not in ('pending', 'running'):
+            return False
+        job['cancel_event'].set()
+        job.update(status='cancelled', finished=time.time())
+        future = job['future']
+    if future is not None:
+        future.cancel()
+    return True
@@ -3,9 +3,12 @@ import pandas as pd
 import uuid
 
 # 분리된 모듈 임포트
-from storage import load_data, save_session_data, load_session_data, cleanup_old_sessions
-from domain_logic import categorize_car, get_row_signature
-from ui_components import render_sidebar, render_add_car_form, render_edit_car_form, render_delete_car_form, render_analysis_results
+from storage import (stream_csv_files, record_session_change, load_session_data, cleanup_old_sessions, load_classification_cache, save_classification_cache,
+                     LISTING_SCHEMA, LISTING_DEFAULTS, coerce_listing_frame, empty_listing_frame, concat_listings, append_listing_rows)
+from domain_logic import analyze_incremental, filter_deleted_rows, CLASSIFICATION_CACHE
+from price_model import value_listings
+from ai_service import warm_up_model_clients
+from ui_components import render_sidebar, render_add_car_form, render_edit_car_form, render_delete_car_form, render_analysis_results, cancel_report_generation
 
 # 페이지 설정
 st.set_page_config(
@@ -17,6 +20,12 @@ st.set_page_config(
 # 앱 시작 시 오래된 세션 파일 정리
 cleanup_old_sessions()
 
+# 수리내역 분류 캐시 복원 (프로세스 내 모든 세션이 공유, 서버 시작 후 최초 1회만 디스크에서 읽음)
+load_classification_cache(CLASSIFICATION_CACHE)
+
+# AI 모델 클라이언트 워밍업 (서버 시작 후 최초 1회만 백그라운드로 SDK 설정 및 연결 준비)
+warm_up_model_clients()
+
 # --- 메인 타이틀 ---
 st.title("🚗 오토 스캔 (Auto Scan AI)")
 st.markdown("""
@@ -25,45 +34,6 @@ st.markdown("""
 절대 사면 안 되는 차(Tier 1)와 가성비 좋은 차(Tier 3)를 가려드립니다.
 """)
 
-# 기본 컬럼 및 데이터 타입 정의
-DEFAULT_COLUMNS = {
-    '차량명': str,
-    '엔진': str,
-    '트림': str,
-    '색상': str,
-    '차량가격(만원)': int,
-    '연식': int,
-    '최초 등록일': str,
-    '주행거리(km)': int,
-    '옵션': str,
-    '수리내역': str,
-    '특수용도이력': str,
-    '1인소유': str,
-    '내차피해액': int,
-    '내차피해횟수': int,
-    '상대차피해횟수': int,
-    '일반부품보증기간(개월)': int,
-    '일반부품보증거리(km)': int,
-    '주요부품보증기간(개월)': int,
-    '주요부품보증거리(km)': int,
-    '_source': str
-}
-
-DEFAULT_DATA = {
-    '옵션': '',
-    '특수용도이력': 'X',
-    '1인소유': 'O',
-    '내차피해액': 0,
-    '내차피해횟수': 0,
-    '상대차피해횟수': 0,
-    '수리내역': '',
-    '일반부품보증기간(개월)': 36,
-    '일반부품보증거리(km)': 60000,
-    '주요부품보증기간(개월)': 60,
-    '주요부품보증거리(km)': 100000,
-    '_source': 'manual'
-}
-
 def get_session_id():
     """
     현재 사용자의 고유 세션 ID를 생성하거나 가져옵니다.
@@ -82,20 +52,23 @@ session_id = get_session_id()
 if 'session_id' not in st.session_state or st.session_state.session_id != session_id:
     st.session_state.session_id = session_id
 
-saved_data = load_session_data(st.session_state.session_id)
+# 저장된 세션 복원은 세션 상태가 비어있을 때(새로고침, 최초 접속)만 수행
+saved_data = None
+if 'df' not in st.session_state or 'deleted_csv_rows' not in st.session_state:
+    saved_data = load_session_data(st.session_state.session_id)
 
 if 'df' not in st.session_state or not isinstance(st.session_state.df, pd.DataFrame):
     if saved_data and 'df' in saved_data:
         st.session_state.df = saved_data['df']
     else:
-        st.session_state.df = pd.DataFrame(columns=DEFAULT_COLUMNS.keys())
+        st.session_state.df = empty_listing_frame()
 else:
-    for col in DEFAULT_COLUMNS.keys():
+    for col in LISTING_SCHEMA.keys():
         if col not in st.session_state.df.columns:
             if col == '_source':
                 st.session_state.df[col] = 'manual'
             else:
-                st.session_state.df[col] = DEFAULT_DATA.get(col, '')
+                st.session_state.df[col] = LISTING_DEFAULTS.get(col, '')
 
 if 'analyzed_df' not in st.session_state:
     st.session_state.analyzed_df = None
@@ -143,8 +116,9 @@ if 'add_war_maj_mon' not in st.session_state: st.session_state['add_war_maj_mon'
 if 'add_war_maj_km' not in st.session_state: st.session_state['add_war_maj_km'] = 100000
 
 # 데이터 변경 시 자동 저장 함수
-def auto_save():
-    save_session_data(st.session_state.session_id, st.session_state.df, st.session_state.deleted_csv_rows)
+# op: 'bulk_load'(전체 교체, 스냅샷 저장) 또는 'add' / 'edit' / 'delete'(변경 기록만 저널에 추가)
+def auto_save(op='bulk_load', **payload):
+    record_session_change(st.session_state.session_id, op, st.session_state.df, st.session_state.deleted_csv_rows, **payload)
 
 # 콜백 함수들
 def start_generation():
@@ -163,51 +137,33 @@ def load_csv_file_callback():
     key = f"uploaded_csv_files_{st.session_state.uploader_key}"
     uploaded_file_objs = st.session_state.get(key)
     
-    current_manual_data = pd.DataFrame()
+    current_manual_data = empty_listing_frame()
     if not st.session_state.df.empty and '_source' in st.session_state.df.columns:
         current_manual_data = st.session_state.df[st.session_state.df['_source'] == 'manual'].copy()
     
-    new_csv_data = pd.DataFrame(columns=DEFAULT_COLUMNS.keys())
+    new_csv_data = empty_listing_frame()
+    coercion_failures = {} # 컬럼별 변환 실패 건수 (모든 청크 합계)
+
+    def prepare_csv_chunk(chunk):
+        """업로드된 CSV 조각(chunk)에 타입 변환과 삭제 이력 필터링을 적용합니다."""
+        chunk = chunk.loc[:, ~chunk.columns.str.contains('^Unnamed')].copy()
+        chunk['_source'] = 'csv'
+
+        chunk, failures = coerce_listing_frame(chunk)
+        for col, count in failures.items():
+            coercion_failures[col] = coercion_failures.get(col, 0) + count
+
+        return filter_deleted_rows(chunk, st.session_state.deleted_csv_rows)
     
     if uploaded_file_objs:
-        all_dfs = []
-        for uploaded_file_obj in uploaded_file_objs:
-            loaded_df = load_data(uploaded_file_obj)
-            if loaded_df is not None:
-                loaded_df = loaded_df.loc[:, ~loaded_df.columns.str.contains('^Unnamed')]
-                loaded_df['_source'] = 'csv'
-                all_dfs.append(loaded_df)
-        
-        if all_dfs:
-            combined_csv_df = pd.concat(all_dfs, ignore_index=True)
-            
-            for col in DEFAULT_COLUMNS.keys():
-                if col not in combined_csv_df.columns:
-                    combined_csv_df[col] = DEFAULT_DATA.get(col, '')
-                try:
-                    if col == '최초 등록일':
-                        combined_csv_df[col] = pd.to_datetime(combined_csv_df[col], errors='coerce').dt.strftime('%Y-%m-%d')
-                        combined_csv_df[col] = combined_csv_df[col].fillna('')
-                    elif DEFAULT_COLUMNS[col] == int:
-                        combined_csv_df[col] = pd.to_numeric(combined_csv_df[col], errors='coerce').fillna(0).astype(int)
-                    else:
-                        combined_csv_df[col] = combined_csv_df[col].astype(DEFAULT_COLUMNS[col])
-                except Exception as e:
-                    st.warning(f"경고: '{col}' 컬럼의 데이터 타입 변환 중 오류가 발생했습니다. 원인: {e} - 일부 데이터가 유실될 수 있습니다.")
-            
-            if not combined_csv_df.empty:
-                rows_to_keep = []
-                for idx, row in combined_csv_df.iterrows():
-                    sig = get_row_signature(row)
-                    if sig not in st.session_state.deleted_csv_rows:
-                        rows_to_keep.append(row)
-                
-                if rows_to_keep:
-                    new_csv_data = pd.DataFrame(rows_to_keep)
-                else:
-                    new_csv_data = pd.DataFrame(columns=DEFAULT_COLUMNS.keys())
-
-    combined_df = pd.concat([current_manual_data, new_csv_data], ignore_index=True)
+        # 업로드 파일을 청크 단위로 읽으면서 청크마다 변환/필터링 (전체를 합친 뒤 처리하지 않음)
+        loaded_csv_data = stream_csv_files(uploaded_file_objs, chunk_transform=prepare_csv_chunk)
+        if loaded_csv_data is not None:
+            new_csv_data = loaded_csv_data
+        for col, count in coercion_failures.items():
+            st.warning(f"경고: '{col}' 컬럼의 값 {count:,}건을 변환하지 못해 기본값으로 대체했습니다. 원본 데이터를 확인해주세요.")
+
+    combined_df = concat_listings([current_manual_data, new_csv_data])
     st.session_state.df = combined_df
     st.session_state.analyzed_df = None
     st.session_state.form_expanded = False
@@ -265,10 +221,9 @@ def add_car_callback():
         '_source': 'manual'
     }
     
-    new_row = pd.DataFrame([new_data])
-    st.session_state.df = pd.concat([st.session_state.df, new_row], ignore_index=True)
+    st.session_state.df = append_listing_rows(st.session_state.df, [new_data])
     
-    auto_save()
+    auto_save('add', row=new_data)
     
     st.session_state['add_success_msg'] = f"✅ 차량 추가 완료: {new_name} ({new_price}만원 / {new_km:,}km / {new_color})"
 
@@ -286,7 +241,7 @@ def add_car_callback():
     st.session_state['add_option'] = ""
 
 # UI 렌더링 호출
-render_sidebar(load_csv_file_callback, DEFAULT_COLUMNS, DEFAULT_DATA, auto_save)
+render_sidebar(load_csv_file_callback, auto_save)
 
 st.subheader("📝 매물 데이터 관리")
 
@@ -306,10 +261,18 @@ st.divider()
 if not st.session_state.df.empty:
     if st.button("🔍 현재 데이터로 정밀 분석 시작", type="primary"):
         with st.spinner("데이터를 분석 중입니다..."):
-            df_to_analyze = st.session_state.df.copy()
-            df_to_analyze['수리내역'] = df_to_analyze['수리내역'].fillna('')
-            df_to_analyze[['Tier', '분석결과']] = df_to_analyze.apply(categorize_car, axis=1)
-            st.session_state.analyzed_df = df_to_analyze
+            df_to_analyze = st.session_state.df # 수리내역 결측치는 스키마 변환 시 빈 문자열로 채워져 있음
+            # 이전 분석 결과(analyzed_df)와 내용 해시가 같은 행은 그 결과를 그대로 쓰고, 새로 추가/수정된 행만 분류
+            analysis, _ = analyze_incremental(df_to_analyze, st.session_state.analyzed_df)
+            save_classification_cache(CLASSIFICATION_CACHE)
+            # 전체 매물의 세그먼트별 적정가(예측가격)와 가격차이를 한 번에 계산
+            valuation = value_listings(df_to_analyze)
+            # assign은 기존 매물 컬럼을 복사하지 않고 공유(Copy-on-Write)하며 분석 컬럼만 추가
+            st.session_state.analyzed_df = df_to_analyze.assign(
+                Tier=analysis['Tier'], 분석결과=analysis['분석결과'],
+                예측가격=valuation['예측가격'], 가격차이=valuation['가격차이'],
+            )
+            cancel_report_generation() # 이전 데이터로 생성 중이던 리포트 작업 취소
             st.session_state.ai_report = None 
             st.session_state.ai_model_used = None
             st.session_state.generating_report = False
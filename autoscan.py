@@ -0,0 +1,206 @@
+"""
+Auto Scan AI 헤드리스 배치 분석 CLI
+
+Streamlit 없이 storage/domain_logic/price_model만으로 앱과 같은 분석 파이프라인
+(CSV 로드 -> 스키마 변환 -> Tier 분류 -> 시세 평가)을 실행합니다. 입력 파일은 프로세스 풀에 나누어
+로드/분류하므로 파일이 많을수록 코어 수에 비례해 처리량이 늘어납니다. 시세 평가는 파일 간 같은 차종을
+함께 봐야 하므로 모든 파일을 합친 뒤 한 번에 수행합니다.
+
+사용 예:
+    python -m autoscan analyze in/*.csv -o out.parquet
+    python -m autoscan analyze dumps/*.csv -o out.parquet --workers 8 --summary summary.json
+    python -m autoscan analyze in/*.csv -o out.csv --prompt prompt.txt --preference "안전 최우선"
+    python -m autoscan migrate-sessions   # 이전 버전의 pickle 세션 파일을 Arrow 스냅샷으로 변환 (1회)
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import (stream_csv_files, coerce_listing_frame, concat_listings, empty_listing_frame, legacy_session_ids, import_legacy_session,
+                     CSV_CHUNK_ROWS)
+from domain_logic import categorize_frame
+from price_model import value_listings
+
+# 저평가/고평가로 집계할 가격차이 기준 (만원, 심층 가격 분석 탭과 동일)
+PRICE_GAP_THRESHOLD = 50
+
+
+def analyze_file(file_path, chunksize=CSV_CHUNK_ROWS, categorize_workers=None):
+    """
+    CSV 파일 하나를 청크 단위로 읽어 스키마 변환과 Tier 분류를 수행합니다. (프로세스 풀 작업 단위)
+    categorize_workers가 주어지면 파일 전체를 읽은 뒤 Tier 분류를 그 수만큼의 프로세스로 나누어 수행합니다.
+
+    Returns:
+        (DataFrame 또는 None, {컬럼: 변환 실패 건수})
+    """
+    failures = {}
+
+    def prepare_chunk(chunk):
+        chunk = chunk.loc[:, ~chunk.columns.str.contains('^Unnamed')].copy()
+        chunk['_source'] = 'csv'
+        chunk, chunk_failures = coerce_listing_frame(chunk)
+        for col, count in chunk_failures.items():
+            failures[col] = failures.get(col, 0) + count
+        return chunk
+
+    if not categorize_workers:
+        return stream_csv_files([file_path], chunk_transform=prepare_chunk, chunksize=chunksize, categorize=True), failures
+    df = stream_csv_files([file_path], chunk_transform=prepare_chunk, chunksize=chunksize)
+    if df is not None:
+        df[['Tier', '분석결과']] = categorize_frame(df, workers=categorize_workers)
+    return df, failures
+
+
+def expand_inputs(patterns):
+    """입력 경로/글롭 패턴 목록을 중복 없는 파일 목록으로 펼칩니다. (셸이 글롭을 펼치지 않는 환경 대비)"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def run_analysis(file_paths, workers=None, chunksize=CSV_CHUNK_ROWS):
+    """
+    입력 파일들을 분석하여 (분류·시세 평가가 끝난 DataFrame, 요약 통계)를 반환합니다.
+    파일이 여러 개이면 파일 단위로 프로세스 풀에 나누고, 파일이 하나뿐이면 그 파일의 Tier 분류를 나누어 처리합니다.
+    workers가 1이면 현재 프로세스에서 순서대로 처리합니다.
+    """
+    workers = workers or os.cpu_count() or 1
+    timings = {}
+    start = time.perf_counter()
+    if workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+            results = list(executor.map(analyze_file, file_paths, [chunksize] * len(file_paths)))
+    else:
+        categorize_workers = workers if workers > 1 else None
+        results = [analyze_file(path, chunksize, categorize_workers) for path in file_paths]
+    timings['load_classify_s'] = time.perf_counter() - start
+
+    coercion_failures = {}
+    failed_files = []
+    frames = []
+    for path, (df, failures) in zip(file_paths, results):
+        for col, count in failures.items():
+            coercion_failures[col] = coercion_failures.get(col, 0) + count
+        if df is None:
+            failed_files.append(path)
+        else:
+            frames.append(df)
+    df = concat_listings(frames) if frames else empty_listing_frame()
+
+    start = time.perf_counter()
+    if not df.empty:
+        valuation = value_listings(df)
+        df = df.assign(예측가격=valuation['예측가격'], 가격차이=valuation['가격차이'])
+    timings['valuation_s'] = time.perf_counter() - start
+
+    summary = summarize(df)
+    summary.update({
+        'files': len(file_paths),
+        'failed_files': failed_files,
+        'coercion_failures': coercion_failures,
+        'workers': min(workers, len(file_paths)) if len(file_paths) > 1 else workers,
+        'timings': timings,
+    })
+    return df, summary
+
+
+def summarize(df):
+    """분석 결과의 요약 통계 (Tier별 매물 수, 시세 평가 결과)"""
+    summary = {'rows': len(df)}
+    if 'Tier' in df.columns:
+        summary['tiers'] = {str(tier): int(count) for tier, count in df['Tier'].value_counts().sort_index().items()}
+    if '가격차이' in df.columns:
+        gap = df['가격차이']
+        summary['valued_rows'] = int(gap.notna().sum())
+        summary['underpriced'] = int((gap < -PRICE_GAP_THRESHOLD).sum())
+        summary['overpriced'] = int((gap > PRICE_GAP_THRESHOLD).sum())
+    return summary
+
+
+def write_output(df, output_path):
+    """분석 결과를 저장합니다. 확장자가 .csv이면 CSV, 그 외에는 Parquet 형식"""
+    if output_path.lower().endswith('.csv'):
+        df.to_csv(output_path, index=False, encoding='utf-8-sig')
+    else:
+        df.to_parquet(output_path, index=False)
+
+
+def command_analyze(args):
+    file_paths = expand_inputs(args.inputs)
+    if not file_paths:
+        print("Error: 입력 CSV 파일이 없습니다.", file=sys.stderr)
+        return 1
+
+    df, summary = run_analysis(file_paths, workers=args.workers, chunksize=args.chunksize)
+    if df.empty:
+        print("Error: 분석할 매물이 없습니다.", file=sys.stderr)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 1
+
+    start = time.perf_counter()
+    write_output(df, args.output)
+    summary['timings']['write_s'] = time.perf_counter() - start
+    summary['output'] = args.output
+
+    if args.prompt:
+        # 프롬프트 생성이 필요할 때만 AI 서비스 모듈을 로드 (Gemini SDK 임포트 비용)
+        from ai_service import create_engineer_prompt
+        start = time.perf_counter()
+        with open(args.prompt, 'w', encoding='utf-8') as f:
+            f.write(create_engineer_prompt(df, args.preference))
+        summary['timings']['prompt_s'] = time.perf_counter() - start
+        summary['prompt'] = args.prompt
+
+    summary_text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(summary_text)
+    print(summary_text)
+    return 0
+
+
+def command_migrate_sessions(args):
+    """
+    현재 디렉토리(앱 실행 디렉토리)의 이전 버전 pickle 세션 파일을 Arrow 스냅샷으로 옮깁니다.
+    pickle 파일은 임의 코드를 실행할 수 있으므로, 앱이 직접 만든 신뢰할 수 있는 파일일 때만 실행하세요.
+    """
+    session_ids = legacy_session_ids()
+    if args.dry_run:
+        print(json.dumps({'legacy_sessions': session_ids}, ensure_ascii=False, indent=2))
+        return 0
+    migrated = [session_id for session_id in session_ids if import_legacy_session(session_id)]
+    failed = sorted(set(session_ids) - set(migrated))
+    print(json.dumps({'migrated': migrated, 'skipped_or_failed': failed}, ensure_ascii=False, indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="autoscan", description="Auto Scan AI 헤드리스 배치 분석")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze = subparsers.add_parser('analyze', help="CSV 파일들을 분류·시세 평가하여 저장")
+    analyze.add_argument('inputs', nargs='+', help="입력 CSV 경로 또는 글롭 패턴")
+    analyze.add_argument('-o', '--output', required=True, help="결과 파일 경로 (.parquet 또는 .csv)")
+    analyze.add_argument('--workers', type=int, default=None, help="파일(또는 단일 파일의 Tier 분류)을 나누어 처리할 프로세스 수 (기본값: CPU 코어 수)")
+    analyze.add_argument('--chunksize', type=int, default=CSV_CHUNK_ROWS, help="CSV를 한 번에 읽을 행 수")
+    analyze.add_argument('--summary', help="요약 통계 JSON을 저장할 경로 (표준 출력에도 출력)")
+    analyze.add_argument('--prompt', help="AI 엔지니어 프롬프트를 저장할 경로 (선택)")
+    analyze.add_argument('--preference', default="밸런스", choices=["가성비 최우선", "밸런스", "안전 최우선"], help="프롬프트 분석 성향")
+    analyze.set_defaults(handler=command_analyze)
+
+    migrate = subparsers.add_parser('migrate-sessions', help="이전 버전의 pickle 세션 파일(temp_data_<id>.pkl)을 Arrow 스냅샷으로 변환")
+    migrate.add_argument('--dry-run', action='store_true', help="변환하지 않고 대상 세션 ID만 출력")
+    migrate.set_defaults(handler=command_migrate_sessions)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""
+Auto Scan AI 성능 벤치마크 스크립트
+
+주요 처리 단계의 소요 시간을 측정하고 결과를 JSON으로 출력합니다.
+- suite: Tier 키워드 어휘로 만든 합성 매물 데이터(1천~100만 행)로 전체 파이프라인의 단계별 시간을 측정
+- snapshot/prompt/valuation: sample_data.csv를 지정한 배수만큼 복제하여 개별 항목을 비교
+
+사용 예:
+    python benchmark.py suite --output bench.json
+    python benchmark.py suite --rows 1000 10000 --repeat 1
+    python benchmark.py snapshot --scale 1000
+    python benchmark.py prompt --scale 20
+    python benchmark.py valuation --scale 500
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from storage import load_data, coerce_listing_frame, write_columnar_snapshot, read_columnar_snapshot
+from domain_logic import (
+    categorize_car, categorize_frame, compute_row_signatures, filter_deleted_rows, CLASSIFICATION_CACHE,
+    UNCERTAINTY_KEYWORDS, TIER1_KEYWORDS, TIER2_KEYWORDS, TIER3_KEYWORDS,
+)
+from price_model import value_listings, PriceModelService, VALUATION_SEGMENTS
+
+SAMPLE_CSV_PATH = 'sample_data.csv'
+
+# suite 기본 측정 규모 (행 수)
+SUITE_ROWS = [1000, 10000, 100000, 1000000]
+
+# 행 단위로 느린 단계는 이 행 수까지만 잘라서 측정 (결과에 실제 측정 행 수를 함께 기록)
+CATEGORIZE_CAR_MAX_ROWS = 10000
+PROMPT_MAX_ROWS = 20000
+
+# --- 합성 매물 생성용 어휘 ---
+_MODEL_BASES = ['쏘나타', '아반떼', 'K5', 'K3', '그랜저', 'K8', '싼타페', '쏘렌토', '투싼', '스포티지',
+                '카니발', '팰리세이드', '모닝', '레이', '캐스퍼', 'G80', 'GV70', 'SM6', 'QM6', '티볼리']
+_ENGINES = ['1.6T', '2.0', '2.5', '2.5T', 'HEV', 'LPi', '디젤 2.2']
+_TRIMS = ['스마트', '모던', '프리미엄', '인스퍼레이션', '노블레스', '시그니처', '캘리그래피']
+_COLORS = ['흰색', '검정색', '쥐색', '밝은쥐색', '은색', '파란색', '진주색']
+# 실제 수리내역에 자주 나오는 Tier와 무관한 부품 (범퍼, 램프 등)
+_COSMETIC_PARTS = ['프런트범퍼커버', '리어범퍼커버', '헤드램프어셈블리', '라디에이터그릴', '사이드스텝몰딩',
+                   '전방감지센서', '사이드미러', '리어컴비네이션램프', '프런트범퍼 표면보수']
+_SIDES = ['', '(좌)', '(우)']
+_ACTIONS = ['(교환)', '(판금)', '(도장)', '(탈착)', '(용접)']
+_OPTION_NAMES = ['내비게이션', '파노라마 선루프', '헤드업 디스플레이', '드라이브 와이즈', '스마트 커넥트', '프리미엄 사운드']
+
+
+def load_scaled_sample(scale):
+    """sample_data.csv를 scale배 복제한 DataFrame을 반환합니다."""
+    df = load_data(SAMPLE_CSV_PATH)
+    return pd.concat([df] * scale, ignore_index=True)
+
+
+def _repair_text(rng):
+    """사고 1~3건, 건마다 부품 1~6개로 이루어진 실제 형식과 비슷한 수리내역 문자열 하나를 만듭니다."""
+    # 외판(Tier 3)과 일반 부품이 대부분이고 골격(Tier 1/2) 손상은 드물게 섞이도록 가중치 부여
+    pools = [_COSMETIC_PARTS, TIER3_KEYWORDS, TIER2_KEYWORDS, TIER1_KEYWORDS]
+    weights = [0.45, 0.35, 0.15, 0.05]
+    incidents = []
+    for number in range(1, rng.integers(1, 4) + 1):
+        parts = []
+        for _ in range(rng.integers(1, 7)):
+            pool = pools[rng.choice(len(pools), p=weights)]
+            parts.append(f"{pool[rng.integers(len(pool))]}{_SIDES[rng.integers(3)]}{_ACTIONS[rng.integers(5)]}")
+        incidents.append(f"{number}. " + ",".join(parts))
+    return "\n\n".join(incidents)
+
+
+def generate_listings(rows, seed=0):
+    """
+    CSV 업로드와 같은 형식(모든 값이 원본 문자열/숫자)의 합성 매물 DataFrame을 만듭니다.
+
+    - 차종 수는 행 수에 비례(약 50행당 1개)하여 큰 규모에서는 수천 개 세그먼트가 생김
+    - 수리내역은 Tier 판정 키워드 어휘로 만든 문자열 풀에서 뽑으므로 실제처럼 같은 문자열이 반복됨
+      (약 40%는 무사고, 일부는 '확인불가' 등 불확실성 문구)
+    - 가격은 연식/주행거리/골격 손상 여부에 잡음을 더해 만들어 시세 회귀가 의미 있는 값을 가짐
+    """
+    rng = np.random.default_rng(seed)
+    n_models = max(len(_MODEL_BASES), rows // 50)
+    model_names = np.array([f"{_MODEL_BASES[i % len(_MODEL_BASES)]} {i // len(_MODEL_BASES) + 1}세대" for i in range(n_models)], dtype=object)
+    model_codes = rng.integers(0, n_models, rows)
+
+    pool_size = max(10, min(rows // 5, 20000))
+    repair_pool = np.array([_repair_text(rng) for _ in range(pool_size)]
+                           + [f"세부사항 {UNCERTAINTY_KEYWORDS[i % len(UNCERTAINTY_KEYWORDS)]}" for i in range(5)], dtype=object)
+    repair_codes = rng.integers(0, len(repair_pool), rows)
+    no_accident = rng.random(rows) < 0.4
+    repairs = np.where(no_accident, '', repair_pool[repair_codes])
+    major = np.array([any(kw in text for kw in TIER1_KEYWORDS + TIER2_KEYWORDS) for text in repair_pool])[repair_codes] & ~no_accident
+
+    years = rng.integers(2015, 2025, rows)
+    months = rng.integers(1, 13, rows)
+    mileage = np.maximum(0, (2025 - years) * rng.normal(15000, 5000, rows)).astype('int64')
+    base_price = 1500 + (model_codes % 37) * 120
+    prices = np.maximum(100, base_price + (years - 2015) * 150 - mileage * 0.004 - major * 300 + rng.normal(0, 80, rows)).astype('int64')
+    damage = np.where(no_accident, 0, rng.integers(300000, 5000000, rows))
+
+    option_counts = rng.integers(0, 4, rows)
+    option_pool = ["\n\n".join(f"{_OPTION_NAMES[(i + j) % len(_OPTION_NAMES)]}\n\n{60 + 10 * j}만원" for j in range(count))
+                   for i in range(len(_OPTION_NAMES)) for count in range(4)]
+    options = np.array(option_pool, dtype=object)[rng.integers(0, len(_OPTION_NAMES), rows) * 4 + option_counts]
+
+    return pd.DataFrame({
+        '차량명': model_names[model_codes],
+        '엔진': np.array(_ENGINES, dtype=object)[rng.integers(0, len(_ENGINES), rows)],
+        '트림': np.array(_TRIMS, dtype=object)[rng.integers(0, len(_TRIMS), rows)],
+        '색상': np.array(_COLORS, dtype=object)[rng.integers(0, len(_COLORS), rows)],
+        '차량가격(만원)': prices,
+        '연식': years,
+        '최초 등록일': [f"{y}-{m:02d}-01" for y, m in zip(years.tolist(), months.tolist())],
+        '주행거리(km)': mileage,
+        '옵션': options,
+        '수리내역': repairs,
+        '내차피해액': damage,
+        '내차피해횟수': np.where(no_accident, 0, rng.integers(1, 4, rows)),
+        '상대차피해횟수': rng.integers(0, 3, rows),
+        '특수용도이력': np.where(rng.random(rows) < 0.03, 'O', 'X'),
+        '1인소유': np.where(rng.random(rows) < 0.5, 'O', 'X'),
+        '_source': 'csv',
+        '일반부품보증기간(개월)': 36,
+        '일반부품보증거리(km)': 60000,
+        '주요부품보증기간(개월)': 60,
+        '주요부품보증거리(km)': 100000,
+    })
+
+
+def best_time(fn, repeat=3):
+    """fn을 repeat회 실행하여 가장 짧은 소요 시간(초)을 반환합니다."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_session_snapshot(df, repeat=3):
+    """세션 스냅샷 형식별(pickle vs Arrow 컬럼 형식) 파일 크기와 저장/로드 시간을 비교합니다."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_path = os.path.join(tmp_dir, 'snapshot.pkl')
+        arrow_path = os.path.join(tmp_dir, 'snapshot.arrow')
+        data_to_save = {'df': df, 'deleted_rows': set(), 'timestamp': time.time()}
+
+        def save_pickle():
+            with open(pickle_path, 'wb') as f:
+                pickle.dump(data_to_save, f)
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as f:
+                pickle.load(f)
+
+        def save_arrow():
+            write_columnar_snapshot(arrow_path, df, {'deleted_rows': [], 'timestamp': time.time()})
+
+        results = {
+            'rows': len(df),
+            'pickle_save_s': best_time(save_pickle, repeat),
+            'pickle_load_s': best_time(load_pickle, repeat),
+            'pickle_size_bytes': os.path.getsize(pickle_path),
+            'arrow_save_s': best_time(save_arrow, repeat),
+            'arrow_load_s': best_time(lambda: read_columnar_snapshot(arrow_path), repeat),
+            'arrow_load_zero_copy_s': best_time(lambda: read_columnar_snapshot(arrow_path, writable=False), repeat),
+            'arrow_size_bytes': os.path.getsize(arrow_path),
+        }
+    return results
+
+
+def bench_prompt_encoding(df, repeat=3, count_tokens=False):
+    """
+    프롬프트 데이터 표 인코딩별(markdown vs compact) 프롬프트 글자 수, 추정 토큰 수, 생성 시간을 비교합니다.
+    count_tokens=True이면 Gemini count_tokens API로 실제 토큰 수도 측정합니다. (API 키 필요)
+    """
+    import ai_service
+
+    df = df.copy()
+    df[['Tier', '분석결과']] = categorize_frame(df)
+    results = {'rows': len(df)}
+    for encoding in ('markdown', 'compact'):
+        prompt = ai_service.create_engineer_prompt(df, "밸런스", encoding=encoding)
+        results[f'{encoding}_chars'] = len(prompt)
+        results[f'{encoding}_estimated_tokens'] = ai_service.estimate_tokens(prompt)
+        results[f'{encoding}_build_s'] = best_time(lambda: ai_service.create_engineer_prompt(df, "밸런스", encoding=encoding), repeat)
+        if count_tokens and ai_service.MODEL_CLIENTS.available():
+            model = ai_service.MODEL_CLIENTS.get(ai_service.MODEL_CANDIDATES[0])
+            results[f'{encoding}_tokens'] = model.count_tokens(prompt).total_tokens
+    results['estimated_token_ratio'] = results['compact_estimated_tokens'] / results['markdown_estimated_tokens']
+    return results
+
+
+def bench_valuation(df, repeat=3):
+    """전체 매물 일괄 시세 평가(세그먼트별 회귀)의 소요 시간과 평가된 매물 수를 측정합니다."""
+    segment_columns = [c for c in VALUATION_SEGMENTS if c in df.columns]
+    valuation = value_listings(df)
+    return {
+        'rows': len(df),
+        'segments': int(df.groupby(segment_columns, observed=True, dropna=False).ngroups),
+        'valued_rows': int(valuation['예측가격'].notna().sum()),
+        'value_listings_s': best_time(lambda: value_listings(df), repeat),
+    }
+
+
+def _git_commit():
+    """현재 커밋 해시 (git 저장소가 아니면 None) - 커밋 간 결과 비교용"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite_rows(rows, repeat=3, seed=0):
+    """
+    합성 매물 rows행으로 파이프라인 단계별 소요 시간(초, repeat회 중 최솟값)을 측정합니다.
+    행 단위 경로(categorize_car)와 프롬프트 생성은 각각 CATEGORIZE_CAR_MAX_ROWS, PROMPT_MAX_ROWS행까지만 측정합니다.
+    """
+    import ai_service
+
+    raw = generate_listings(rows, seed)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'listings.csv')
+        raw.to_csv(csv_path, index=False)
+        timings['load_data_s'] = best_time(lambda: load_data(csv_path), repeat)
+
+        loaded = load_data(csv_path)
+        timings['coerce_listing_frame_s'] = best_time(lambda: coerce_listing_frame(loaded), repeat)
+        df, _ = coerce_listing_frame(loaded)
+
+        # 행 단위 분류(categorize_car)는 분류 캐시를 비운 상태로 측정
+        sample = df.iloc[:CATEGORIZE_CAR_MAX_ROWS]
+
+        def categorize_rows():
+            CLASSIFICATION_CACHE.clear()
+            sample.apply(categorize_car, axis=1)
+
+        timings['categorize_car_s'] = best_time(categorize_rows, repeat)
+        timings['categorize_frame_s'] = best_time(lambda: categorize_frame(df, cache=None), repeat)
+        CLASSIFICATION_CACHE.clear()
+        df[['Tier', '분석결과']] = categorize_frame(df, cache=None)
+
+        # 삭제 이력(1%)에 있는 행을 시그니처 해시로 제외
+        deleted = set(compute_row_signatures(df.iloc[::100]).tolist())
+        timings['filter_deleted_rows_s'] = best_time(lambda: filter_deleted_rows(df, deleted), repeat)
+
+        prompt_df = df.iloc[:PROMPT_MAX_ROWS]
+        timings['create_engineer_prompt_s'] = best_time(lambda: ai_service.create_engineer_prompt(prompt_df, "밸런스"), repeat)
+
+        timings['value_listings_s'] = best_time(lambda: value_listings(df), repeat)
+        largest_model = df['차량명'].value_counts().index[0]
+        timings['price_model_fit_s'] = best_time(lambda: PriceModelService().fit(df, largest_model), repeat)
+
+        pickle_path = os.path.join(tmp_dir, 'session.pkl')
+        session = {'df': df, 'deleted_rows': deleted, 'timestamp': time.time()}
+
+        def save_pickle():
+            with open(pickle_path, 'wb') as f:
+                pickle.dump(session, f)
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as f:
+                pickle.load(f)
+
+        timings['pickle_save_s'] = best_time(save_pickle, repeat)
+        timings['pickle_load_s'] = best_time(load_pickle, repeat)
+
+    return {
+        'rows': rows,
+        'models': int(df['차량명'].nunique()),
+        'unique_repairs': int(df['수리내역'].nunique()),
+        'categorize_car_rows': len(sample),
+        'prompt_rows': len(prompt_df),
+        'timings': timings,
+    }
+
+
+def bench_suite(row_counts, repeat=3, seed=0):
+    """여러 규모의 suite 결과와 실행 환경(커밋, 라이브러리 버전)을 묶어 반환합니다."""
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': [bench_suite_rows(rows, repeat, seed) for rows in row_counts],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auto Scan AI 벤치마크")
+    parser.add_argument('target', choices=['suite', 'snapshot', 'prompt', 'valuation'], help="측정할 대상")
+    parser.add_argument('--scale', type=int, default=1000, help="sample_data.csv 복제 배수")
+    parser.add_argument('--repeat', type=int, default=3, help="반복 측정 횟수 (최솟값 사용)")
+    parser.add_argument('--count-tokens', action='store_true', help="(prompt) Gemini count_tokens API로 실제 토큰 수 측정")
+    parser.add_argument('--rows', type=int, nargs='+', default=SUITE_ROWS, help="(suite) 측정할 합성 데이터 행 수 목록")
+    parser.add_argument('--seed', type=int, default=0, help="(suite) 합성 데이터 난수 시드")
+    parser.add_argument('--output', help="결과 JSON을 저장할 경로 (표준 출력에도 출력)")
+    args = parser.parse_args()
+
+    if args.target == 'suite':
+        results = bench_suite(args.rows, args.repeat, args.seed)
+    else:
+        df = load_scaled_sample(args.scale)
+    if args.target == 'snapshot':
+        results = bench_session_snapshot(df, args.repeat)
+    elif args.target == 'prompt':
+        results = bench_prompt_encoding(df, args.repeat, args.count_tokens)
+    elif args.target == 'valuation':
+        results = bench_valuation(df, args.repeat)
+
+    results_text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(results_text)
+    print(results_text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,236 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 
-def parse_repair_history(repair_text, own_damage_amount=0):
+# --- Tier 분류 키워드 정의 (확장됨) ---
+
+# 불확실성 키워드 (미확정, 확인불가 등) - 최소 Tier 2 경고
+UNCERTAINTY_KEYWORDS = ["미확정", "확인불가", "확인 불가", "세부내역 없음", "정보 없음", "내역 없음"]
+
+# Tier 1: 주요 골격 (절대 구매 금지) - 차체 뼈대 손상
+# 주의: '플로어패널'은 '트렁크플로어'와 중복되므로 별도 로직으로 처리
+TIER1_KEYWORDS = [
+    '휠하우스', '휠 하우스',
+    '사이드멤버', '사이드 멤버',
+    '필러패널', '필러 패널', 'A필러', 'B필러', 'C필러', '센터필러',
+    '대쉬패널', '대쉬 패널', '데쉬패널', '데쉬 패널', '대시패널',
+    # 플로어패널은 별도 처리
+]
+
+# 플로어패널 별도 처리용 키워드 (트렁크/리어 수식어가 있으면 Tier 1에서 제외)
+FLOOR_PANEL_KEYWORDS = ['플로어패널', '플로어 패널']
+FLOOR_PANEL_EXCLUDE_KEYWORDS = ['트렁크', '리어']
+
+# Tier 2: 주요 골격 (경고) - 후방 골격 또는 볼트 체결이 아닌 용접 부위
+TIER2_KEYWORDS = [
+    '인사이드패널', '인사이드 패널',
+    '프론트패널', '프론트 패널',
+    '크로스멤버', '크로스 멤버',
+    '트렁크플로어', '트렁크 플로어',
+    '리어패널', '리어 패널', '백패널',
+    '패키지트레이', '패키지 트레이',
+    '루프패널', '루프 패널', '루프',
+    '쿼터패널', '쿼터 패널', '뒤휀다', '뒤펜더', '리어펜더', '리어휀다',
+    '사이드실패널', '사이드실 패널', '사이드실',
+    '쇽업소버', '쇼바', '댐퍼',
+    '로우암', '로워암', '컨트롤 암'
+]
+
+# Tier 3: 외판 단순 교환 (감가 매력) - 볼트 체결 부품
+TIER3_KEYWORDS = [
+    '후드', '본네트', '보닛',
+    '프론트휀더', '프론트 휀더', '앞휀다', '앞펜더', '프론트펜더',
+    '도어', '앞문', '뒷문',
+    '트렁크리드', '트렁크 리드', '트렁크',
+    '라디에이터서포터', '라디에이터 서포터', '라디에이터 서포트'
+]
+
+# 가격 회귀 분석의 '사고 여부' 변수로 쓰는 주요 골격 부위 (Tier 판정과 별개로, 시세에 영향을 주는 사고 이력)
+MAJOR_ACCIDENT_KEYWORDS = [
+    '휠하우스', '인사이드패널', '사이드멤버', '플로어패널', '대쉬패널', '필러',
+    '루프패널', '트렁크플로어', '백판넬', '리어패널', '프런트패널', '리어액슬',
+    '쿼터패널', '패널 앗세이'
+]
+
+
+def _build_trie_pattern(keywords):
     """
-    수리내역 텍스트를 분석하여 사고 등급(Tier)과 상세 사유를 반환합니다.
-    '미확정' 키워드 및 내차피해액에 따른 위험도를 반영합니다.
-    
-    Returns:
-        tier (int): 1 (Worst), 2 (Warning), 3 (Value), 0 (Clean)
-        reasons (list): 등급 판정 사유 리스트
+    키워드 목록을 접두사 트리(trie) 형태의 정규식으로 컴파일합니다.
+    단순 alternation('a|b|c')은 위치마다 모든 키워드를 차례로 시도하지만,
+    트리 형태는 첫 글자부터 분기하므로 텍스트를 한 번 훑는 비용으로 매칭됩니다.
+    긴 키워드를 우선 매칭하도록(greedy) 구성합니다.
     """
-    repair_text = str(repair_text) # 혹시 숫자가 들어올 경우 대비
-    
-    # 내차피해액 전처리
+    trie = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[''] = True  # 키워드 종료 표시
+
+    def to_regex(node):
+        is_end = '' in node
+        branches = [re.escape(ch) + to_regex(child) for ch, child in sorted(node.items()) if ch != '']
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if is_end:
+            # 종료 지점이면서 더 긴 키워드가 이어질 수 있는 경우: 긴 쪽을 우선 시도
+            return '(?:' + body + ')?'
+        return body
+
+    return to_regex(trie)
+
+
+class KeywordMatcher:
+    """
+    여러 키워드를 텍스트 한 번의 스캔으로 모두 찾아내는 매처입니다.
+
+    트리 정규식으로 각 시작 위치에서 가장 긴 키워드를 찾고, 다음 검색은 바로 다음 글자부터
+    이어가므로 겹치는 키워드(예: 'A필러패널' -> 'A필러', '필러패널')도 놓치지 않습니다.
+    같은 위치에서 시작하는 더 짧은 키워드(접두사 관계, 예: '루프패널' -> '루프')는
+    미리 계산해 둔 접두사 목록으로 함께 반환합니다. 따라서 `kw in text`를 키워드마다
+    반복한 것과 동일한 집합을 돌려줍니다.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        self._pattern = re.compile(_build_trie_pattern(self.keywords))
+        # 매칭된 (가장 긴) 키워드 -> 그 키워드의 접두사이기도 한 모든 키워드
+        self._prefix_closure = {
+            kw: frozenset(other for other in self.keywords if kw.startswith(other))
+            for kw in self.keywords
+        }
+
+    def find_all(self, text):
+        """text에 포함된 모든 키워드의 집합을 반환합니다."""
+        found = set()
+        search = self._pattern.search
+        match = search(text)
+        while match is not None:
+            found |= self._prefix_closure[match.group()]
+            match = search(text, match.start() + 1)
+        return found
+
+
+# 모든 Tier 판정 키워드를 하나의 매처로 컴파일 (모듈 임포트 시 1회)
+KEYWORD_MATCHER = KeywordMatcher(
+    UNCERTAINTY_KEYWORDS + TIER1_KEYWORDS + FLOOR_PANEL_KEYWORDS
+    + FLOOR_PANEL_EXCLUDE_KEYWORDS + TIER2_KEYWORDS + TIER3_KEYWORDS
+)
+
+
+def _compute_ruleset_version():
+    """키워드 규칙 전체의 해시. 키워드 목록이 바뀌면 값이 바뀌어 기존 분류 캐시를 무효화합니다."""
+    ruleset = [UNCERTAINTY_KEYWORDS, TIER1_KEYWORDS, FLOOR_PANEL_KEYWORDS,
+               FLOOR_PANEL_EXCLUDE_KEYWORDS, TIER2_KEYWORDS, TIER3_KEYWORDS]
+    payload = json.dumps(ruleset, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+RULESET_VERSION = _compute_ruleset_version()
+
+
+class ClassificationCache:
+    """
+    (수리내역, 내차피해액) -> (tier, reasons) 분류 결과를 보관하는 크기 제한 LRU 캐시입니다.
+    parse_repair_history는 두 입력값에 대한 순수 함수이므로 결과를 그대로 재사용할 수 있습니다.
+    프로세스 내 모든 Streamlit 세션(스레드)이 공유하므로 내부 상태는 Lock으로 보호합니다.
+    """
+
+    def __init__(self, maxsize=50000, ruleset_version=RULESET_VERSION):
+        self.maxsize = maxsize
+        self.ruleset_version = ruleset_version
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False  # 마지막 디스크 저장 이후 새 항목이 추가되었는지 여부
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """키 목록에 대한 결과 리스트를 반환합니다. (없는 키는 None)"""
+        results = []
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                results.append(value)
+        return results
+
+    def put_many(self, items):
+        """(키, 결과) 쌍들을 저장하고, 최대 크기를 넘으면 가장 오래 쓰이지 않은 항목부터 제거합니다."""
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                self.dirty = True
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def items(self):
+        """저장된 (키, 결과) 쌍의 스냅샷을 오래된 순서로 반환합니다."""
+        with self._lock:
+            return list(self._entries.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.dirty = False
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ruleset_version': self.ruleset_version,
+            }
+
+
+# 프로세스 전역 공유 분류 캐시
+CLASSIFICATION_CACHE = ClassificationCache()
+
+
+def _cache_key(repair_text, own_damage_amount):
+    """
+    분류 캐시 키. NumPy 스칼라는 파이썬 기본형으로 바꿔 디스크 저장(JSON)이 가능하도록 합니다.
+    결측값(NaN, None, pd.NA)은 None 하나로 통일합니다. (NaN은 자기 자신과 같지 않아 캐시에서 찾을 수 없으므로)
+    """
+    if pd.isna(own_damage_amount):
+        own_damage_amount = None
+    elif isinstance(own_damage_amount, np.generic):
+        own_damage_amount = own_damage_amount.item()
+    return (str(repair_text), own_damage_amount)
+
+
+def _parse_own_damage(own_damage_amount):
+    """내차피해액 값을 (정수 금액, 미확정 여부)로 변환합니다."""
     own_damage_val = 0
     is_undetermined = False
 
-    if isinstance(own_damage_amount, (int, float)):
+    if pd.isna(own_damage_amount):
+        pass # 결측은 0원으로 취급
+    elif isinstance(own_damage_amount, (int, float)):
         own_damage_val = int(own_damage_amount)
     else:
         s_val = str(own_damage_amount).strip()
@@ -26,14 +241,34 @@ def parse_repair_history(repair_text, own_damage_amount=0):
                 own_damage_val = int(s_val.replace(',', ''))
             except ValueError:
                 own_damage_val = 0
+    return own_damage_val, is_undetermined
+
+
+def parse_repair_history(repair_text, own_damage_amount=0):
+    """
+    수리내역 텍스트를 분석하여 사고 등급(Tier)과 상세 사유를 반환합니다.
+    '미확정' 키워드 및 내차피해액에 따른 위험도를 반영합니다.
+    
+    Returns:
+        tier (int): 1 (Worst), 2 (Warning), 3 (Value), 0 (Clean)
+        reasons (list): 등급 판정 사유 리스트
+    """
+    repair_text = str(repair_text) # 혹시 숫자가 들어올 경우 대비
+    if pd.isna(own_damage_amount):
+        own_damage_amount = 0 # 내차피해액 결측은 스키마 기본값(0)과 같이 취급
+    
+    # 내차피해액 전처리
+    own_damage_val, is_undetermined = _parse_own_damage(own_damage_amount)
 
     tier = 0
     reasons = []
+
+    # 수리내역 텍스트를 한 번만 스캔하여 포함된 모든 키워드를 수집
+    found = KEYWORD_MATCHER.find_all(repair_text)
     
     # 1. 불확실성 체크 (미확정, 확인불가 등)
-    uncertainty_keywords = ["미확정", "확인불가", "확인 불가", "세부내역 없음", "정보 없음", "내역 없음"]
-    for kw in uncertainty_keywords:
-        if kw in repair_text:
+    for kw in UNCERTAINTY_KEYWORDS:
+        if kw in found:
             tier = max(tier, 2) # 정보 불확실성은 최소 Tier 2 경고
             reasons.append(f"정보 불확실성 경고 ({kw})")
     
@@ -45,65 +280,28 @@ def parse_repair_history(repair_text, own_damage_amount=0):
         tier = max(tier, 2)
         reasons.append(f"내차피해액 {own_damage_val}원 발생 (수리내역 미상)")
 
-
-    # --- Tier 분류 키워드 정의 (확장됨) ---
-
-    # Tier 1: 주요 골격 (절대 구매 금지) - 차체 뼈대 손상
-    # 주의: '플로어패널'은 '트렁크플로어'와 중복되므로 별도 로직으로 처리
-    tier1_keywords = [
-        '휠하우스', '휠 하우스',
-        '사이드멤버', '사이드 멤버',
-        '필러패널', '필러 패널', 'A필러', 'B필러', 'C필러', '센터필러',
-        '대쉬패널', '대쉬 패널', '데쉬패널', '데쉬 패널', '대시패널',
-        # 플로어패널은 별도 처리
-    ]
-    
-    # Tier 2: 주요 골격 (경고) - 후방 골격 또는 볼트 체결이 아닌 용접 부위
-    tier2_keywords = [
-        '인사이드패널', '인사이드 패널',
-        '프론트패널', '프론트 패널',
-        '크로스멤버', '크로스 멤버',
-        '트렁크플로어', '트렁크 플로어',
-        '리어패널', '리어 패널', '백패널',
-        '패키지트레이', '패키지 트레이',
-        '루프패널', '루프 패널', '루프',
-        '쿼터패널', '쿼터 패널', '뒤휀다', '뒤펜더', '리어펜더', '리어휀다',
-        '사이드실패널', '사이드실 패널', '사이드실',
-        '쇽업소버', '쇼바', '댐퍼',
-        '로우암', '로워암', '컨트롤 암'
-    ]
-    
-    # Tier 3: 외판 단순 교환 (감가 매력) - 볼트 체결 부품
-    tier3_keywords = [
-        '후드', '본네트', '보닛',
-        '프론트휀더', '프론트 휀더', '앞휀다', '앞펜더', '프론트펜더',
-        '도어', '앞문', '뒷문',
-        '트렁크리드', '트렁크 리드', '트렁크',
-        '라디에이터서포터', '라디에이터 서포터', '라디에이터 서포트'
-    ]
-
     # --- 키워드 매칭 로직 ---
 
     # 1. Tier 1 Check (플로어패널 예외 처리 포함)
-    for keyword in tier1_keywords:
-        if keyword in repair_text:
+    for keyword in TIER1_KEYWORDS:
+        if keyword in found:
             tier = max(tier, 1)
             reasons.append(f"Tier 1 위험 부위 손상: {keyword}")
             
     # 플로어패널 별도 체크 (트렁크플로어 오인 방지)
-    if '플로어패널' in repair_text or '플로어 패널' in repair_text:
+    if any(kw in found for kw in FLOOR_PANEL_KEYWORDS):
         # "트렁크" 또는 "리어"라는 단어가 바로 앞에 붙어있지 않은지 확인하는 것은 정규식이 정확하지만,
         # 간단하게 해당 텍스트에 '트렁크플로어패널'이 있으면 Tier 2로 처리하고,
         # '플로어패널'만 단독으로 있거나 다른 수식어면 Tier 1으로 의심해야 함.
         # 여기서는 보수적으로: '트렁크플로어'가 있으면 Tier 2 로직에서 잡히므로,
         # '플로어패널'이 있고 '트렁크'가 없는 경우만 Tier 1으로 간주.
-        if '트렁크' not in repair_text and '리어' not in repair_text:
+        if not any(kw in found for kw in FLOOR_PANEL_EXCLUDE_KEYWORDS):
              tier = max(tier, 1)
              reasons.append("Tier 1 위험 부위 손상: 플로어패널")
 
     # 2. Tier 2 Check
-    for keyword in tier2_keywords:
-        if keyword in repair_text:
+    for keyword in TIER2_KEYWORDS:
+        if keyword in found:
             # Tier 1이 이미 확정된 경우(tier=1)는 굳이 등급을 2로 내리지 않음
             # 현재 등급이 0이거나 3일 경우 -> 2로 격상
             # 현재 등급이 2일 경우 -> 유지
@@ -112,8 +310,8 @@ def parse_repair_history(repair_text, own_damage_amount=0):
             reasons.append(f"Tier 2 경고 부위 손상: {keyword}")
 
     # 3. Tier 3 Check
-    for keyword in tier3_keywords:
-        if keyword in repair_text:
+    for keyword in TIER3_KEYWORDS:
+        if keyword in found:
             # 상위 등급(1, 2)이 없을 때만 Tier 3 설정
             if tier == 0:
                 tier = 3
@@ -150,17 +348,391 @@ def parse_repair_history(repair_text, own_damage_amount=0):
     return tier, ", ".join(final_reasons) if final_reasons else "무사고"
 
 
+def parse_repair_history_cached(repair_text, own_damage_amount=0, cache=CLASSIFICATION_CACHE):
+    """parse_repair_history의 결과를 공유 분류 캐시에 기억해 두었다가 재사용합니다."""
+    key = _cache_key(repair_text, own_damage_amount)
+    result = cache.get(key)
+    if result is None:
+        result = parse_repair_history(*key)
+        cache.put(key, result)
+    return result
+
+
 def categorize_car(row):
     # 내차피해액 컬럼도 parse_repair_history에 전달
-    tier, reasons = parse_repair_history(row['수리내역'], row['내차피해액'])
+    tier, reasons = parse_repair_history_cached(row['수리내역'], row['내차피해액'])
     return pd.Series([tier, reasons])
 
+def _join_reason_columns(parts):
+    """
+    사유 문자열 배열들을 행 단위로 ', '로 이어 붙입니다. (빈 문자열은 건너뜀)
+    parts: 길이가 같은 object 배열들의 리스트 (판정 순서대로)
+    """
+    acc = parts[0]
+    for part in parts[1:]:
+        has_acc = acc != ''
+        has_part = part != ''
+        joined = np.where(has_acc & has_part, acc + ', ' + part, acc)
+        acc = np.where(has_acc, joined, part)
+    return acc
+
+
+def _factorize_rows(packed):
+    """2차원 배열의 각 행을 고유 코드로 변환합니다. (코드 배열, 각 코드가 처음 나온 행 번호)"""
+    codes, _ = pd.factorize(pd.Series([row.tobytes() for row in packed], dtype=object))
+    first_rows = np.full(codes.max() + 1 if len(codes) else 0, -1)
+    first_rows[codes[::-1]] = np.arange(len(codes))[::-1]
+    return codes, first_rows
+
+
+def _keyword_reason_matrix(texts):
+    """
+    고유 수리내역 텍스트 배열에 대해 (텍스트 x 키워드) 포함 여부 행렬을 계산하고,
+    키워드 기반 판정 플래그와 사유 문자열을 반환합니다.
+    사유 문자열은 행렬의 고유한 행(키워드 조합)마다 한 번만 조립합니다.
+    """
+    # 텍스트마다 키워드 매처로 한 번만 스캔하여 포함 행렬을 구성
+    # (키워드별 str.contains는 키워드 수만큼 전체 컬럼을 반복해서 훑게 됨)
+    columns = {kw: i for i, kw in enumerate(KEYWORD_MATCHER.keywords)}
+    hit_rows, hit_cols = [], []
+    for row, text in enumerate(texts):
+        for kw in KEYWORD_MATCHER.find_all(text):
+            hit_rows.append(row)
+            hit_cols.append(columns[kw])
+    matrix = np.zeros((len(texts), len(columns)), dtype=bool)
+    matrix[hit_rows, hit_cols] = True
+
+    def any_of(keywords):
+        return matrix[:, [columns[kw] for kw in keywords]].any(axis=1)
+
+    floor = any_of(FLOOR_PANEL_KEYWORDS) & ~any_of(FLOOR_PANEL_EXCLUDE_KEYWORDS)
+
+    # 판정 순서대로 (boolean 컬럼, 사유) 목록 구성
+    uncertain_labels = [f"정보 불확실성 경고 ({kw})" for kw in UNCERTAINTY_KEYWORDS]
+    keyword_labels = (
+        [f"Tier 1 위험 부위 손상: {kw}" for kw in TIER1_KEYWORDS]
+        + ["Tier 1 위험 부위 손상: 플로어패널"]
+        + [f"Tier 2 경고 부위 손상: {kw}" for kw in TIER2_KEYWORDS]
+        + [f"Tier 3 단순 교환/수리: {kw}" for kw in TIER3_KEYWORDS]
+    )
+    reason_matrix = np.column_stack(
+        [matrix[:, [columns[kw] for kw in UNCERTAINTY_KEYWORDS + TIER1_KEYWORDS]], floor,
+         matrix[:, [columns[kw] for kw in TIER2_KEYWORDS + TIER3_KEYWORDS]]]
+    )
+    n_uncertain = len(UNCERTAINTY_KEYWORDS)
+    labels = np.array(uncertain_labels + keyword_labels, dtype=object)
+
+    # 같은 키워드 조합(행)은 사유 문자열도 같으므로 고유 조합별로 한 번만 조립
+    packed = np.packbits(reason_matrix, axis=1)
+    inverse, first_rows = _factorize_rows(packed)
+    patterns = reason_matrix[first_rows]
+    uncertain_reasons = np.array([", ".join(labels[:n_uncertain][p[:n_uncertain]]) for p in patterns], dtype=object)
+    keyword_reasons = np.array([", ".join(labels[n_uncertain:][p[n_uncertain:]]) for p in patterns], dtype=object)
+
+    return {
+        'uncertain': any_of(UNCERTAINTY_KEYWORDS),
+        'uncertain_reasons': uncertain_reasons[inverse],
+        'tier1': any_of(TIER1_KEYWORDS) | floor,
+        'tier2': any_of(TIER2_KEYWORDS),
+        'tier3': any_of(TIER3_KEYWORDS),
+        'keyword_reasons': keyword_reasons[inverse],
+        'blank': np.array([not text.strip() for text in texts], dtype=bool),
+    }
+
+
+# 병렬 분류(categorize_frame의 workers) 기본 프로세스 수. 0/1이면 단일 프로세스 (opt-in)
+CATEGORIZE_WORKERS = int(os.getenv("AUTOSCAN_CATEGORIZE_WORKERS", "0"))
+# 분류할 행이 이보다 적으면 프로세스 시작/직렬화 비용이 더 크므로 병렬 모드여도 단일 프로세스로 처리
+PARALLEL_CATEGORIZE_MIN_ROWS = int(os.getenv("AUTOSCAN_PARALLEL_MIN_ROWS", "100000"))
+
+
+def _categorize_frame_parallel(df, workers):
+    """
+    _categorize_frame_uncached를 연속된 행 구간별로 나누어 프로세스 풀에서 실행합니다.
+    분류는 행마다 독립적인 순수 계산이므로, 구간 순서대로 이어 붙이면 단일 프로세스 결과와 같습니다.
+    작업 프로세스에는 분류에 필요한 수리내역/내차피해액 컬럼만 전달하여 직렬화 비용을 줄입니다.
+    """
+    columns = df[['수리내역', '내차피해액']]
+    bounds = np.linspace(0, len(columns), workers + 1).astype(int)
+    parts = [columns.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    with ProcessPoolExecutor(max_workers=len(parts)) as executor:
+        results = list(executor.map(_categorize_frame_uncached, parts))
+    return pd.concat(results)
+
+
+def _categorize_uncached(df, workers):
+    """workers와 행 수에 따라 단일 프로세스 또는 병렬 분류를 선택합니다."""
+    if workers is None:
+        workers = CATEGORIZE_WORKERS
+    if workers > 1 and len(df) >= PARALLEL_CATEGORIZE_MIN_ROWS:
+        return _categorize_frame_parallel(df, workers)
+    return _categorize_frame_uncached(df)
+
+
+def categorize_frame(df, cache=CLASSIFICATION_CACHE, workers=None):
+    """
+    DataFrame 전체의 Tier와 분석결과를 벡터 연산으로 한 번에 계산합니다.
+    행마다 pd.Series를 만드는 `df.apply(categorize_car, axis=1)`와 결과가 동일합니다.
+    cache가 주어지면 고유 (수리내역, 내차피해액) 조합 단위로 분류 캐시를 먼저 조회하고,
+    캐시에 없는 조합만 계산한 뒤 캐시에 저장합니다. (cache=None이면 캐시 미사용)
+    workers가 2 이상이고 새로 분류할 행이 PARALLEL_CATEGORIZE_MIN_ROWS 이상이면 여러 프로세스로 나누어
+    분류합니다. (기본값: CATEGORIZE_WORKERS, 결과와 행 순서는 단일 프로세스와 동일)
+
+    Returns:
+        DataFrame: df와 같은 인덱스를 가진 ['Tier', '분석결과'] 컬럼
+    """
+    if cache is None or len(df) == 0:
+        return _categorize_uncached(df, workers)
+
+    keys = pd.Series([_cache_key(t, d) for t, d in zip(df['수리내역'], df['내차피해액'])], dtype=object)
+    codes, unique_keys = pd.factorize(keys)
+    results = cache.get_many(unique_keys)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        missing_df = pd.DataFrame({
+            '수리내역': [unique_keys[i][0] for i in missing],
+            '내차피해액': [unique_keys[i][1] for i in missing],
+        })
+        computed = _categorize_uncached(missing_df, workers)
+        new_items = []
+        for i, tier, reasons in zip(missing, computed['Tier'].tolist(), computed['분석결과'].tolist()):
+            results[i] = (tier, reasons)
+            new_items.append((unique_keys[i], results[i]))
+        cache.put_many(new_items)
+
+    tiers = np.array([result[0] for result in results], dtype='int64')
+    reasons = np.array([result[1] for result in results], dtype=object)
+    return pd.DataFrame({'Tier': tiers[codes], '분석결과': reasons[codes]}, index=df.index)
+
+
+def _categorize_frame_uncached(df):
+    """categorize_frame의 캐시를 거치지 않는 벡터 연산 본체입니다."""
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame({'Tier': pd.Series(dtype='int64'), '분석결과': pd.Series(dtype=object)}, index=df.index)
+
+    # 1. 수리내역: 중복 텍스트는 한 번만 검사하고 코드로 되돌려 펼침
+    codes, uniques = pd.factorize(df['수리내역'], use_na_sentinel=False)
+    texts = np.array([str(v) for v in uniques], dtype=object)
+    kw = {key: value[codes] for key, value in _keyword_reason_matrix(texts).items()}
+    blank = kw['blank']
+
+    # 2. 내차피해액: 숫자 컬럼은 그대로, 그 외(문자열 등)는 고유값 단위로 파싱
+    raw_damage = df['내차피해액']
+    if pd.api.types.is_numeric_dtype(raw_damage) and not pd.api.types.is_bool_dtype(raw_damage):
+        raw_values = raw_damage.fillna(0).to_numpy()
+        damage_val = raw_values.astype(np.int64)
+        undetermined = np.zeros(n, dtype=bool)
+        numeric_raw = raw_values
+    else:
+        d_codes, d_uniques = pd.factorize(raw_damage, use_na_sentinel=False)
+        parsed = [_parse_own_damage(v) for v in d_uniques]
+        damage_val = np.array([p[0] for p in parsed], dtype=np.int64)[d_codes]
+        undetermined = np.array([p[1] for p in parsed], dtype=bool)[d_codes]
+        # 문자열 피해액은 마지막 '기타 처리' 단계에서 금액 비교 대상이 아님
+        numeric_raw = np.array([v if pd.api.types.is_number(v) and not pd.isna(v) else 0 for v in d_uniques], dtype=float)[d_codes]
+
+    damage_reasons = np.where(
+        undetermined, "내차피해액 미확정 (불확실성으로 인한 잠재적 위험)",
+        np.where((damage_val > 0) & blank,
+                 np.char.add(np.char.add("내차피해액 ", damage_val.astype(str)), "원 발생 (수리내역 미상)"),
+                 '')
+    ).astype(object)
+
+    # 3. Tier 판정 (parse_repair_history와 동일한 순서/규칙)
+    tier = np.where(kw['uncertain'] | undetermined | ((damage_val > 0) & blank), 2, 0)
+    tier = np.where(kw['tier1'], np.maximum(tier, 1), tier)
+    tier = np.where(kw['tier2'] & (tier != 1), 2, tier)
+    tier = np.where(kw['tier3'] & (tier == 0), 3, tier)
+
+    # 4. 기타 처리
+    etc_repair = (tier == 0) & ~blank
+    no_accident = (tier == 0) & blank & (numeric_raw == 0)
+    unknown_damage = (tier == 0) & blank & (numeric_raw > 0)
+    tail_reasons = np.where(etc_repair, "기타 수리 내역 존재 (상세 확인 필요)",
+                            np.where(no_accident, "무사고", '')).astype(object)
+    if unknown_damage.any():
+        raw_list = raw_damage.to_numpy()
+        for i in np.flatnonzero(unknown_damage):
+            tail_reasons[i] = f"내차피해액 {raw_list[i]}원 발생 (수리내역 미상, 추가 확인 필요)"
+    tier = np.where(etc_repair, 3, np.where(unknown_damage, 2, tier))
+
+    reasons = _join_reason_columns([kw['uncertain_reasons'], damage_reasons, kw['keyword_reasons'], tail_reasons])
+    reasons = np.where(reasons == '', "무사고 (수리내역 및 피해액 없음)", reasons)
+
+    return pd.DataFrame({'Tier': tier.astype('int64'), '분석결과': reasons.astype(object)}, index=df.index)
+
+
+# 행 식별 시그니처에 사용할 주요 컬럼들
+SIGNATURE_COLUMNS = ['차량명', '차량가격(만원)', '주행거리(km)', '연식', '최초 등록일', '수리내역']
+
+# 분석 결과 추적용 내용 해시 컬럼 (시그니처 + 분류에 영향을 주는 내차피해액)
+CONTENT_HASH_COLUMNS = SIGNATURE_COLUMNS + ['내차피해액']
+
 def get_row_signature(row):
-    """행 데이터를 기반으로 고유 시그니처 생성 (중복 방지 및 식별용)"""
-    # 식별에 사용할 주요 컬럼들
-    cols = ['차량명', '차량가격(만원)', '주행거리(km)', '연식', '최초 등록일', '수리내역']
+    """
+    행 데이터를 기반으로 고유 시그니처 문자열 생성 (이전 버전의 삭제 이력 형식)
+    앱에서는 compute_row_signatures를 사용하며, 이 함수는 두 방식의 해시가 같은지 확인하는 기준 구현으로 남겨 둡니다. (test_logic.py)
+    """
     sig_parts = []
-    for c in cols:
+    for c in SIGNATURE_COLUMNS:
         val = row.get(c, '')
         sig_parts.append(str(val))
-    return "_".join(sig_parts)
\ No newline at end of file
+    return "_".join(sig_parts)
+
+def _hash_signature_strings(signatures):
+    """시그니처 문자열들을 64비트 해시(uint64 배열)로 변환합니다."""
+    return pd.util.hash_pandas_object(pd.Series(signatures, dtype=object), index=False).to_numpy()
+
+def compute_row_signatures(df):
+    """
+    모든 행의 시그니처를 한 번에 64비트 해시(uint64 배열)로 계산합니다.
+    get_row_signature 문자열의 해시와 같은 값이 되므로 기존 문자열 시그니처도 그대로 비교할 수 있습니다.
+    """
+    if len(df) == 0:
+        return np.empty(0, dtype='uint64')
+    joined = None
+    for c in SIGNATURE_COLUMNS:
+        if c not in df.columns:
+            part = pd.Series('', index=df.index, dtype=object)
+        elif pd.api.types.is_datetime64_any_dtype(df[c]):
+            part = df[c].dt.strftime('%Y-%m-%d').fillna('').astype(object) # 날짜 문자열로 저장하던 때와 같은 형식
+        elif pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c]):
+            part = df[c].astype(str).astype(object)
+        else:
+            part = df[c].astype(object).map(str) # str(None) == 'None' 등 문자열 시그니처와 동일하게 변환
+        joined = part if joined is None else joined + '_' + part
+    return _hash_signature_strings(joined.to_numpy())
+
+def normalize_signatures(signatures):
+    """
+    삭제 이력 시그니처를 정수 해시 집합으로 통일합니다.
+    이전 세션에 저장된 문자열 시그니처는 같은 방식으로 해시하여 이어서 사용합니다.
+    """
+    hashes = {int(s) for s in signatures if not isinstance(s, str)}
+    legacy = [s for s in signatures if isinstance(s, str)]
+    if legacy:
+        hashes.update(int(h) for h in _hash_signature_strings(legacy))
+    return hashes
+
+def filter_deleted_rows(df, deleted_signatures):
+    """삭제 이력에 있는 행을 시그니처 해시의 isin 마스크 한 번으로 제외합니다."""
+    if not deleted_signatures or len(df) == 0:
+        return df
+    deleted = np.fromiter(normalize_signatures(deleted_signatures), dtype='uint64')
+    return df[~np.isin(compute_row_signatures(df), deleted)]
+
+def compute_row_content_hashes(df):
+    """
+    각 행의 내용 해시(uint64 배열)를 한 번에 계산합니다.
+    시그니처 컬럼과 내차피해액이 같으면 같은 해시가 되므로, 행이 변경되었는지 판단하는 데 사용합니다.
+    """
+    cols = pd.DataFrame({c: df[c].astype(str) if c in df.columns else '' for c in CONTENT_HASH_COLUMNS}, index=df.index)
+    return pd.util.hash_pandas_object(cols, index=False).to_numpy()
+
+def analyze_incremental(df, previous=None, cache=CLASSIFICATION_CACHE):
+    """
+    이전 분석 이후 추가되거나 수정된 행만 다시 분류합니다.
+    이전 분석 결과(previous)의 행과 내용 해시가 같은 행은 그 결과를 그대로 사용하므로,
+    공유 분류 캐시(cache)에서 항목이 밀려나더라도 행 하나를 수정하면 그 행만 다시 분류합니다.
+
+    Args:
+        df: 분석할 매물 DataFrame
+        previous: 이전 분석 결과 DataFrame (Tier, 분석결과 컬럼 포함, 예: st.session_state.analyzed_df). 없으면 전체 분류
+        cache: 새로 분류하는 행에 사용할 분류 캐시
+
+    Returns:
+        analysis (DataFrame): df와 같은 인덱스를 가진 ['Tier', '분석결과'] 컬럼
+        reclassified (int): 이번에 새로 분류한 행 수
+    """
+    known = np.zeros(len(df), dtype=bool)
+    tiers = np.zeros(len(df), dtype='int64')
+    reasons = np.empty(len(df), dtype=object)
+    if previous is not None and len(previous) and len(df) and {'Tier', '분석결과'}.issubset(previous.columns):
+        previous_hashes = pd.Index(compute_row_content_hashes(previous))
+        first = ~previous_hashes.duplicated() # 같은 내용의 행은 결과도 같으므로 하나만 사용
+        positions = previous_hashes[first].get_indexer(compute_row_content_hashes(df))
+        known = positions >= 0
+        rows = np.flatnonzero(first)[positions[known]]
+        tiers[known] = previous['Tier'].to_numpy()[rows]
+        reasons[known] = previous['분석결과'].to_numpy()[rows]
+    if (~known).any():
+        classified = categorize_frame(df[~known], cache)
+        tiers[~known] = classified['Tier'].to_numpy()
+        reasons[~known] = classified['분석결과'].to_numpy()
+    return pd.DataFrame({'Tier': tiers, '분석결과': reasons}, index=df.index), int((~known).sum())
+
+
+# 보증 항목: (보증기간 컬럼, 보증거리 컬럼, 잔여기간 컬럼, 잔여거리 컬럼)
+WARRANTY_COLUMNS = [
+    ('일반부품보증기간(개월)', '일반부품보증거리(km)', '잔여일반보증(개월)', '잔여일반보증(km)'),
+    ('주요부품보증기간(개월)', '주요부품보증거리(km)', '잔여주요보증(개월)', '잔여주요보증(km)'),
+]
+
+def compute_warranty_frame(df, as_of=None):
+    """
+    최초 등록일 기준 경과 개월 수와 일반/주요부품의 잔여 보증 기간(개월)·거리(km)를 한 번에 계산합니다.
+
+    - 경과개월수 = (기준일 연도 - 등록 연도) * 12 + (기준일 월 - 등록 월)
+    - 잔여 기간/거리는 0 미만이면 0으로 처리
+    - 보증 만료 정책: 기간이나 거리 중 하나라도 만료(0)되면 둘 다 만료(0) 처리
+    - 등록일을 알 수 없으면 잔여 기간은 결측(<NA>)으로 두되, 거리가 만료되었으면 둘 다 0
+
+    Args:
+        df: 매물 DataFrame (최초 등록일, 주행거리(km), 보증 컬럼)
+        as_of: 기준일 (기본값: 현재 시각)
+
+    Returns:
+        DataFrame: df와 같은 인덱스의 ['경과개월수', '잔여일반보증(개월)', '잔여일반보증(km)', '잔여주요보증(개월)', '잔여주요보증(km)']
+                   (해당 보증 컬럼이 없는 항목은 제외, 개월 수 컬럼은 nullable 정수 Int64)
+    """
+    as_of = pd.Timestamp.now() if as_of is None else pd.Timestamp(as_of)
+    if '최초 등록일' in df.columns:
+        reg_date = pd.to_datetime(df['최초 등록일'], errors='coerce')
+        known = reg_date.notna().to_numpy()
+        months = ((as_of.year - reg_date.dt.year) * 12 + (as_of.month - reg_date.dt.month)).to_numpy(dtype='float64', na_value=np.nan)
+    else:
+        known = np.zeros(len(df), dtype=bool)
+        months = np.full(len(df), np.nan)
+
+    result = {'경과개월수': pd.array(np.where(known, months, 0).astype('int64'), dtype='Int64')}
+    result['경과개월수'][~known] = pd.NA
+    mileage = pd.to_numeric(df['주행거리(km)'], errors='coerce').fillna(0).to_numpy(dtype='int64') if '주행거리(km)' in df.columns else None
+
+    for period_col, distance_col, rem_period_col, rem_distance_col in WARRANTY_COLUMNS:
+        has_period = period_col in df.columns
+        has_distance = distance_col in df.columns and mileage is not None
+        if has_period:
+            period = pd.to_numeric(df[period_col], errors='coerce').fillna(0).to_numpy(dtype='int64')
+            rem_period = np.maximum(0, period - np.where(known, months, 0).astype('int64'))
+        if has_distance:
+            distance = pd.to_numeric(df[distance_col], errors='coerce').fillna(0).to_numpy(dtype='int64')
+            rem_distance = np.maximum(0, distance - mileage)
+        if has_period and has_distance:
+            # 둘 중 하나라도 만료되면 둘 다 만료 (등록일 미상이면 거리 만료 여부만 반영)
+            expired = (rem_distance <= 0) | (known & (rem_period <= 0))
+            rem_period = np.where(expired, 0, rem_period)
+            rem_distance = np.where(expired, 0, rem_distance)
+            unknown_period = ~known & ~expired
+        else:
+            unknown_period = ~known
+        if has_period:
+            result[rem_period_col] = pd.array(rem_period, dtype='Int64')
+            result[rem_period_col][unknown_period] = pd.NA
+        if has_distance:
+            result[rem_distance_col] = rem_distance
+
+    return pd.DataFrame(result, index=df.index)
+
+
+_MAJOR_ACCIDENT_PATTERN = re.compile(_build_trie_pattern(MAJOR_ACCIDENT_KEYWORDS))
+
+def major_accident_flags(repair_texts):
+    """
+    수리내역 Series에 주요 골격 키워드가 하나라도 있으면 1, 없으면 0인 int64 배열을 반환합니다.
+    같은 수리내역이 반복되는 경우가 많으므로 고유 텍스트만 한 번씩 검사합니다.
+    """
+    codes, uniques = pd.factorize(pd.Series(repair_texts).fillna('').astype(str))
+    flags = pd.Series(uniques).str.contains(_MAJOR_ACCIDENT_PATTERN, regex=True).to_numpy(dtype='int64')
+    return flags[codes] if len(codes) else np.zeros(0, dtype='int64')
@@ -0,0 +1,322 @@
+"""
+차종별 가격 회귀 모델 (연식, 주행거리, 사고 여부 -> 차량가격)
+
+정규방정식에 필요한 충분통계량(XᵀX, Xᵀy)만 차종별로 보관하므로, 매물이 추가/삭제되면 바뀐 행만
+더하고 빼서 계수를 갱신합니다. 적합 결과(계수와 통계량)는 (데이터 출처, 차종, 데이터 버전) 단위로 캐시되어,
+데이터가 그대로인 Streamlit rerun이나 차종 전환 시에는 다시 계산하지 않습니다.
+Streamlit에 의존하지 않으므로 배치 작업에서도 그대로 사용할 수 있습니다.
+"""
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+import pandas as pd
+from domain_logic import compute_row_content_hashes, major_accident_flags
+
+PRICE_FEATURES = ['연식', '주행거리(km)', 'Is_Major_Accident']
+PRICE_TARGET = '차량가격(만원)'
+
+# 차종별 회귀 분석에 필요한 최소 매물 수
+MIN_MODEL_ROWS = 10
+
+# 정규방정식의 수치 안정성을 위한 특성값 이동/배율 (행을 더하고 빼도 기준이 같아야 하므로 고정값 사용)
+_FEATURE_SHIFT = np.array([2000.0, 0.0, 0.0])
+_FEATURE_SCALE = np.array([1.0, 10000.0, 1.0])
+
+# 분산이 이 비율보다 작은 방향(예: 모든 매물이 무사고)은 계수를 0으로 둠 (sklearn LinearRegression과 동일한 결과)
+_PINV_RTOL = 1e-10
+
+
+def price_feature_matrix(df, accident_flags=None):
+    """매물 DataFrame에서 회귀 특성 행렬(n, 3)과 가격 벡터를 만듭니다. (사고 여부는 수리내역에서 계산)"""
+    if accident_flags is None:
+        accident_flags = major_accident_flags(df['수리내역'])
+    features = np.column_stack([
+        pd.to_numeric(df['연식'], errors='coerce').fillna(0).to_numpy(dtype='float64'),
+        pd.to_numeric(df['주행거리(km)'], errors='coerce').fillna(0).to_numpy(dtype='float64'),
+        np.asarray(accident_flags, dtype='float64'),
+    ])
+    prices = pd.to_numeric(df[PRICE_TARGET], errors='coerce').fillna(0).to_numpy(dtype='float64')
+    return features, prices
+
+
+def _augmented_rows(features, prices):
+    """행마다 [1, 정규화된 특성..., 가격] 벡터. 이 벡터들의 외적 합이 곧 충분통계량입니다."""
+    scaled = (features - _FEATURE_SHIFT) / _FEATURE_SCALE
+    return np.column_stack([np.ones(len(features)), scaled, prices])
+
+
+def sufficient_statistics(features, prices):
+    """
+    충분통계량 행렬 S = Σ v vᵀ (v = [1, x, y])를 반환합니다.
+    S[0, 0]은 행 수, S[0, 1:-1]은 Σx, S[1:-1, 1:-1]은 XᵀX, S[1:-1, -1]은 Xᵀy이며,
+    행이 추가/삭제되면 해당 행의 v vᵀ만 더하거나 빼면 됩니다.
+    """
+    rows = _augmented_rows(features, prices)
+    return rows.T @ rows
+
+
+def solve_price_model(stats, columns=None):
+    """
+    충분통계량으로 절편과 계수(원 단위)를 계산합니다. 평균을 뺀 정규방정식을 유사역행렬로 풀기 때문에
+    특성값이 한 가지뿐인 경우에도 오류 없이 해당 계수를 0으로 둡니다.
+
+    Args:
+        stats: sufficient_statistics 결과. 여러 모델을 한 번에 풀 때는 (..., m, m) 형태로 쌓아서 전달
+        columns: 일부 특성만 사용할 때 PRICE_FEATURES 기준 인덱스 목록 (예: [1] -> 주행거리만)
+
+    Returns:
+        (intercept, coef): 절편 (...), 계수 (..., k). 행이 없는 모델은 nan
+    """
+    stats = np.asarray(stats, dtype='float64')
+    shift, scale = _FEATURE_SHIFT, _FEATURE_SCALE
+    if columns is not None:
+        keep = [0] + [c + 1 for c in columns] + [stats.shape[-1] - 1]
+        stats = stats[..., keep, :][..., :, keep]
+        shift, scale = shift[columns], scale[columns]
+    k = stats.shape[-1] - 2
+
+    n = stats[..., 0, 0]
+    safe_n = np.where(n > 0, n, 1.0)
+    mean = stats[..., 0, 1:] / safe_n[..., None]
+    centered = stats[..., 1:, 1:] - safe_n[..., None, None] * mean[..., :, None] * mean[..., None, :]
+    beta = np.einsum(
+        '...ij,...j->...i',
+        np.linalg.pinv(centered[..., :k, :k], rtol=_PINV_RTOL, hermitian=True),
+        centered[..., :k, k],
+    )
+    coef = beta / scale
+    # 정규화된 특성 기준 절편을 원 단위로 환산: ȳ - x̄_scaled·β - shift·coef
+    intercept = mean[..., k] - np.einsum('...i,...i->...', mean[..., :k], beta) - np.einsum('...i,i->...', coef, shift)
+    empty = n <= 0
+    if np.any(empty):
+        intercept = np.where(empty, np.nan, intercept)
+        coef = np.where(empty[..., None], np.nan, coef)
+    return intercept, coef
+
+
+# 일괄 시세 평가의 세그먼트 계층 (세분화된 순서). 매물이 MIN_MODEL_ROWS개 미만인 세그먼트는 한 단계 위로 올라가 평가
+VALUATION_SEGMENTS = ['차량명', '엔진', '트림']
+
+
+def _grouped_statistics(rows, codes, n_groups):
+    """
+    그룹별 충분통계량 (n_groups, m, m)을 한 번에 계산합니다.
+    (n, m, m) 외적 배열을 만들지 않고, 대칭 행렬의 상삼각 성분마다 bincount 한 번씩만 수행합니다.
+    """
+    m = rows.shape[1]
+    stats = np.empty((n_groups, m, m))
+    for i in range(m):
+        for j in range(i, m):
+            stats[:, i, j] = stats[:, j, i] = np.bincount(codes, weights=rows[:, i] * rows[:, j], minlength=n_groups)
+    return stats
+
+
+def value_listings(df, segment_columns=None, min_rows=MIN_MODEL_ROWS):
+    """
+    전체 매물의 적정가(예측가격)와 가격차이(실제가 - 예측가)를 세그먼트별 회귀로 한 번에 계산합니다.
+
+    세그먼트 계층(예: 차량명/엔진/트림 -> 차량명/엔진 -> 차량명)의 각 단계마다 모든 세그먼트의 충분통계량을
+    bincount로 모으고, 쌓인 정규방정식을 한 번의 배치 유사역행렬로 풉니다. 각 매물은 매물 수가 min_rows 이상인
+    가장 세분화된 세그먼트의 모델로 평가하며, 차량명 단위로도 부족하면 결측(NaN)으로 둡니다.
+
+    Args:
+        df: 매물 DataFrame (차량명, 연식, 주행거리(km), 수리내역, 차량가격(만원))
+        segment_columns: 세그먼트 계층 컬럼 (기본값: VALUATION_SEGMENTS, df에 없는 컬럼은 제외)
+        min_rows: 세그먼트 모델을 사용할 최소 매물 수
+
+    Returns:
+        DataFrame: df와 같은 인덱스의 ['예측가격', '가격차이'] 컬럼
+    """
+    segment_columns = [c for c in (segment_columns or VALUATION_SEGMENTS) if c in df.columns]
+    predicted = np.full(len(df), np.nan)
+    if len(df) == 0 or not segment_columns:
+        return pd.DataFrame({'예측가격': predicted, '가격차이': predicted}, index=df.index)
+
+    features, prices = price_feature_matrix(df)
+    rows = _augmented_rows(features, prices)
+    for depth in range(len(segment_columns), 0, -1):
+        pending = np.isnan(predicted)
+        if not pending.any():
+            break
+        codes = df.groupby(segment_columns[:depth], sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        n_groups = int(codes.max()) + 1
+        stats = _grouped_statistics(rows, codes, n_groups)
+        usable = stats[:, 0, 0] >= min_rows
+        targets = pending & usable[codes]
+        if not targets.any():
+            continue
+        intercept, coef = solve_price_model(stats[usable])
+        group_model = np.cumsum(usable) - 1  # 세그먼트 번호 -> usable 세그먼트 중 순번
+        model = group_model[codes[targets]]
+        predicted[targets] = intercept[model] + np.einsum('ij,ij->i', features[targets], coef[model])
+
+    return pd.DataFrame({'예측가격': predicted, '가격차이': prices - predicted}, index=df.index)
+
+
+def _model_rows(model_df, hashes, vectors):
+    """
+    행마다 [1, 정규화된 특성..., 가격] 벡터를 반환합니다.
+    이전 적합에서 계산한 행(내용 해시 -> 벡터)은 재사용하고, 새로 들어온 행만 사고 여부를 판정합니다.
+    """
+    rows = np.empty((len(model_df), len(PRICE_FEATURES) + 2))
+    is_new = np.fromiter((h not in vectors for h in hashes.tolist()), dtype=bool, count=len(hashes))
+    if is_new.any():
+        new_features, new_prices = price_feature_matrix(model_df[is_new])
+        rows[is_new] = _augmented_rows(new_features, new_prices)
+    if (~is_new).any():
+        rows[~is_new] = [vectors[h] for h in hashes[~is_new].tolist()]
+    return rows
+
+
+def _data_version(hashes):
+    """행 내용 해시의 순서와 무관한 조합. 같은 매물 집합이면 행 순서가 바뀌어도 같은 버전이 됩니다."""
+    return f"{len(hashes)}-{int(np.sum(hashes, dtype='uint64')):016x}"
+
+
+class PriceModelService:
+    """
+    차종별 가격 회귀 모델을 적합하고 결과를 캐시하는 서비스입니다.
+
+    - 적합 결과: (데이터 출처, 차종, 데이터 버전) -> 계수/통계량 (LRU, 최대 maxsize개)
+    - 차종별 상태: (데이터 출처, 차종)마다 마지막으로 적합한 행들의 내용 해시와 충분통계량. 같은 차종을 다른 데이터로
+      다시 적합하면 추가/삭제된 행만 반영하고, 새로 들어온 행만 사고 여부를 판정합니다.
+
+    프로세스 내 모든 Streamlit 세션(스레드)이 공유하므로, 세션마다 데이터 출처(source, 세션 ID)를 나누어
+    서로의 증분 상태를 덮어쓰지 않도록 하고 내부 상태는 Lock으로 보호합니다.
+    매물 행이 담긴 frame은 캐시하지 않고 호출할 때마다 호출자의 df로 다시 만듭니다.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.incremental_updates = 0
+        self._fits = OrderedDict()
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fit(self, df, model_name, data_version=None, source=None):
+        """
+        df에서 model_name 차종의 가격 모델을 적합합니다. (캐시된 계수가 있으면 다시 계산하지 않음)
+
+        Args:
+            df: 매물 DataFrame (차량명, 연식, 주행거리(km), 수리내역, 차량가격(만원))
+            model_name: 차량명
+            data_version: 데이터 버전 식별자 (생략 시 해당 차종 행들의 내용 해시로 계산)
+            source: 데이터 출처 식별자 (예: 세션 ID). 캐시와 증분 상태를 출처별로 나누어 보관
+
+        Returns:
+            dict: model_name, data_version, rows, intercept, coefficients({특성: 계수}),
+                  clean_line(무사고 매물 기준 (절편, 주행거리 계수) 또는 None),
+                  frame(df의 해당 차종 행 + Is_Major_Accident, 예측가격, 가격차이 컬럼)
+        """
+        model_df = df[df['차량명'] == model_name]
+        hashes = compute_row_content_hashes(model_df)
+        if data_version is None:
+            data_version = _data_version(hashes)
+        key = (source, model_name, data_version)
+        state_key = (source, model_name)
+
+        with self._lock:
+            fitted = self._fits.get(key)
+            if fitted is not None:
+                self._fits.move_to_end(key)
+                self.hits += 1
+                state = self._states.get(state_key)
+        if fitted is not None:
+            rows = _model_rows(model_df, hashes, state['vectors'] if state else {})
+            return self._result(model_df, model_name, data_version, rows, fitted)
+
+        with self._lock:
+            self.misses += 1
+            state = self._states.pop(state_key, None)
+            vectors = state['vectors'] if state else {}
+            rows = _model_rows(model_df, hashes, vectors)
+
+            counts = Counter(hashes.tolist())
+            if state is None:
+                stats = rows.T @ rows
+                clean_rows = rows[rows[:, 3] == 0]
+                clean_stats = clean_rows.T @ clean_rows
+            else:
+                # 이전 적합 이후 늘어나거나 줄어든 행의 v vᵀ만 더하고 뺌
+                delta = Counter(counts)
+                delta.subtract(state['counts'])
+                changed = [(h, d) for h, d in delta.items() if d]
+                stats, clean_stats = state['stats'].copy(), state['clean_stats'].copy()
+                if changed:
+                    current = dict(zip(hashes.tolist(), rows))
+                    changed_rows = np.array([current[h] if h in current else vectors[h] for h, _ in changed])
+                    weights = np.array([d for _, d in changed], dtype='float64')
+                    stats += (changed_rows * weights[:, None]).T @ changed_rows
+                    clean = changed_rows[:, 3] == 0
+                    clean_stats += (changed_rows[clean] * weights[clean, None]).T @ changed_rows[clean]
+                self.incremental_updates += 1
+
+            self._states[state_key] = {
+                'counts': counts,
+                'vectors': dict(zip(hashes.tolist(), rows)),
+                'stats': stats,
+                'clean_stats': clean_stats,
+            }
+            while len(self._states) > self.maxsize:
+                self._states.popitem(last=False)
+
+        intercept, coef = solve_price_model(stats)
+        clean_line = None
+        if clean_stats[0, 0] > 1:
+            clean_intercept, clean_coef = solve_price_model(clean_stats, columns=[1])
+            clean_line = (float(clean_intercept), float(clean_coef[0]))
+
+        fitted = {'intercept': intercept, 'coef': coef, 'clean_line': clean_line}
+        with self._lock:
+            self._fits[key] = fitted
+            while len(self._fits) > self.maxsize:
+                self._fits.popitem(last=False)
+        return self._result(model_df, model_name, data_version, rows, fitted)
+
+    @staticmethod
+    def _result(model_df, model_name, data_version, rows, fitted):
+        """캐시된 계수와 호출자의 행으로 결과 사전(예측가격이 붙은 frame 포함)을 만듭니다."""
+        intercept, coef = fitted['intercept'], fitted['coef']
+        features = rows[:, 1:-1] * _FEATURE_SCALE + _FEATURE_SHIFT
+        predicted = intercept + features @ coef
+        frame = model_df.assign(
+            Is_Major_Accident=rows[:, 3].astype('int64'),
+            예측가격=predicted,
+            가격차이=rows[:, -1] - predicted,
+        )
+        return {
+            'model_name': model_name,
+            'data_version': data_version,
+            'rows': len(model_df),
+            'intercept': float(intercept) if len(model_df) else float('nan'),
+            'coefficients': dict(zip(PRICE_FEATURES, np.atleast_1d(coef).tolist())),
+            'clean_line': fitted['clean_line'],
+            'frame': frame,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._fits.clear()
+            self._states.clear()
+            self.hits = 0
+            self.misses = 0
+            self.incremental_updates = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'incremental_updates': self.incremental_updates,
+                'fits': len(self._fits),
+                'models': len(self._states),
+                'maxsize': self.maxsize,
+            }
+
+
+# 프로세스 전역 공유 가격 모델 서비스
+PRICE_MODELS = PriceModelService()
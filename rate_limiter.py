@@ -0,0 +1,170 @@
+"""
+모델별 요청 속도 제한기 (Token Bucket + 동시 실행 수 제한)
+
+여러 Streamlit 세션과 워커 프로세스가 같은 SQLite 파일을 공유하여, 프로세스가 여러 개여도
+모델별 분당 요청 수(RPM)와 동시 요청 수가 할당량을 넘지 않도록 요청을 대기열 순서대로 내보냅니다.
+DB를 사용할 수 없으면(읽기 전용 디렉토리 등) 제한 없이 통과시킵니다. (fail-open)
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (lease_id TEXT PRIMARY KEY, name TEXT NOT NULL, acquired REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS waiters (waiter_id TEXT PRIMARY KEY, name TEXT NOT NULL, enqueued REAL NOT NULL, heartbeat REAL NOT NULL);
+"""
+
+
+class RateLimiter:
+    """
+    SQLite 파일 기반의 프로세스 간 공유 속도 제한기.
+
+    - 토큰 버킷: 모델별로 분당 rate_per_minute개의 토큰이 채워지며(최대 burst개), 요청 1건마다 토큰 1개를 사용
+    - 동시 실행 제한: 모델별로 동시에 진행 중인 요청(lease)이 max_concurrency개를 넘지 않음
+    - 대기열: 먼저 기다리기 시작한 요청부터 순서대로 통과하며, 대기 중에는 on_wait(대기 순번)으로 순번을 알림
+
+    프로세스가 비정상 종료되어 반환되지 않은 lease는 lease_ttl초, 갱신이 끊긴 대기 기록은 waiter_ttl초 후 정리됩니다.
+    """
+
+    def __init__(self, db_path, lease_ttl=600, waiter_ttl=30, poll_seconds=0.25):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.waiter_ttl = waiter_ttl
+        self.poll_seconds = poll_seconds
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        # 연결은 스레드 간에 공유하지 않고 호출마다 새로 열고 닫음 (isolation_level=None: 트랜잭션을 직접 관리)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def acquire(self, name, rate_per_minute, burst=None, max_concurrency=None, cancel_event=None, on_wait=None):
+        """
+        name(모델명)으로 요청을 보낼 수 있을 때까지 기다린 뒤 lease ID를 반환합니다. (요청이 끝나면 release로 반환)
+        rate_per_minute가 0/None이면 속도 제한 없이 동시 실행 수만 제한합니다.
+        cancel_event가 설정되면 대기를 멈추고 None을 반환합니다.
+        """
+        if not rate_per_minute and not max_concurrency:
+            return ''
+        rate = (rate_per_minute or 0) / 60.0
+        burst = burst or max(1, int(rate_per_minute or 1) // 2)
+        waiter_id = uuid.uuid4().hex
+        enqueued = time.time()
+        position = None
+        lease_id = None
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                with closing(self._connect()) as conn:
+                    lease_id, new_position, wait_seconds = self._try_acquire(conn, name, waiter_id, enqueued, rate, burst, max_concurrency)
+                if lease_id is not None:
+                    if position and on_wait is not None:
+                        on_wait(0)
+                    return lease_id
+                if new_position != position and on_wait is not None:
+                    on_wait(new_position)
+                position = new_position
+                delay = min(max(wait_seconds, 0.05), self.poll_seconds)
+                if cancel_event is not None:
+                    cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+        except sqlite3.Error as e:
+            print(f"Error using rate limit database: {e}")
+            return ''
+        finally:
+            if lease_id is None:
+                self._leave_queue(waiter_id) # 취소/오류로 대기를 멈추면 대기 기록을 지워 뒤의 요청이 막히지 않도록 함
+
+    def _try_acquire(self, conn, name, waiter_id, enqueued, rate, burst, max_concurrency):
+        """한 번의 트랜잭션으로 대기 순번, 동시 실행 수, 토큰을 확인하여 (lease ID 또는 None, 대기 순번, 다시 확인할 때까지의 시간)을 반환합니다."""
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE") # 다른 프로세스와의 경쟁을 막기 위해 쓰기 잠금을 먼저 획득
+        try:
+            conn.execute("DELETE FROM leases WHERE acquired < ?", (now - self.lease_ttl,))
+            conn.execute("DELETE FROM waiters WHERE heartbeat < ?", (now - self.waiter_ttl,))
+            conn.execute(
+                "INSERT INTO waiters VALUES (?, ?, ?, ?) ON CONFLICT(waiter_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (waiter_id, name, enqueued, now),
+            )
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM waiters WHERE name = ? AND (enqueued < ? OR (enqueued = ? AND waiter_id < ?))",
+                (name, enqueued, enqueued, waiter_id),
+            ).fetchone()[0]
+            if ahead:
+                conn.execute("COMMIT")
+                return None, ahead + 1, self.poll_seconds
+
+            if max_concurrency:
+                active = conn.execute("SELECT COUNT(*) FROM leases WHERE name = ?", (name,)).fetchone()[0]
+                if active >= max_concurrency:
+                    conn.execute("COMMIT")
+                    return None, 1, self.poll_seconds
+
+            if rate > 0:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                if tokens < 1:
+                    conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (name, tokens, now))
+                    conn.execute("COMMIT")
+                    return None, 1, (1 - tokens) / rate
+                conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (name, tokens - 1, now))
+
+            lease_id = uuid.uuid4().hex
+            conn.execute("INSERT INTO leases VALUES (?, ?, ?)", (lease_id, name, now))
+            conn.execute("DELETE FROM waiters WHERE waiter_id = ?", (waiter_id,))
+            conn.execute("COMMIT")
+            return lease_id, 0, 0.0
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def _leave_queue(self, waiter_id):
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM waiters WHERE waiter_id = ?", (waiter_id,))
+        except sqlite3.Error as e:
+            print(f"Error using rate limit database: {e}")
+
+    def release(self, lease_id):
+        """acquire로 받은 lease를 반환하여 동시 실행 자리를 비웁니다."""
+        if not lease_id:
+            return
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+        except sqlite3.Error as e:
+            print(f"Error using rate limit database: {e}")
+
+    def drain(self, name):
+        """할당량 초과(429) 응답을 받았을 때 토큰을 비워, 다음 요청이 토큰이 다시 채워질 때까지 기다리도록 합니다."""
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, 0, ?)", (name, time.time()))
+        except sqlite3.Error as e:
+            print(f"Error using rate limit database: {e}")
+
+    def stats(self):
+        """모델별 현재 진행 중인 요청 수와 대기 중인 요청 수"""
+        stats = {}
+        try:
+            with closing(self._connect()) as conn:
+                for name, count in conn.execute("SELECT name, COUNT(*) FROM leases GROUP BY name"):
+                    stats.setdefault(name, {'active': 0, 'waiting': 0})['active'] = count
+                for name, count in conn.execute("SELECT name, COUNT(*) FROM waiters GROUP BY name"):
+                    stats.setdefault(name, {'active': 0, 'waiting': 0})['waiting'] = count
+        except sqlite3.Error as e:
+            print(f"Error using rate limit database: {e}")
+        return stats
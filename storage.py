@@ -1,75 +1,643 @@
-import pickle
 import os
+import json
+import pickle
 import time
 import glob
+import uuid
+import threading
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from domain_logic import categorize_frame, normalize_signatures
+
+# 분류 캐시(ClassificationCache) 디스크 저장 경로. 빈 문자열로 설정하면 디스크 저장을 사용하지 않습니다.
+CLASSIFICATION_CACHE_PATH = os.getenv("AUTOSCAN_CLASSIFICATION_CACHE", "classification_cache.json")
+
+# 분류 캐시 파일을 다시 쓰기까지의 최소 간격(초). 분석할 때마다 전체 JSON을 다시 쓰지 않도록 저장 횟수를 제한합니다.
+CLASSIFICATION_CACHE_SAVE_INTERVAL = int(os.getenv("AUTOSCAN_CLASSIFICATION_CACHE_SAVE_INTERVAL", "60"))
+
+# 이 프로세스에서 이미 디스크로부터 복원한 분류 캐시 파일 경로
+_restored_cache_paths = set()
+# 경로별 마지막 분류 캐시 저장 시각과, 같은 프로세스의 여러 세션이 동시에 저장하지 않도록 하는 잠금
+_cache_saved_at = {}
+_cache_save_lock = threading.Lock()
+
+# AI 리포트 캐시 디렉토리 (같은 서버의 모든 워커/세션이 공유). 빈 문자열로 설정하면 캐시를 사용하지 않습니다.
+REPORT_CACHE_DIR = os.getenv("AUTOSCAN_REPORT_CACHE_DIR", "report_cache")
+# 캐시된 리포트의 유효 시간(초)과 최대 보관 개수 (초과 시 오래된 항목부터 삭제)
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("AUTOSCAN_REPORT_CACHE_TTL", str(24 * 3600)))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("AUTOSCAN_REPORT_CACHE_MAX_ENTRIES", "200"))
+
+# CSV를 청크 단위로 읽을 때 한 번에 읽는 행 수
+CSV_CHUNK_ROWS = 50000
+
+# 저널에 쌓인 변경 기록이 이 개수를 넘으면 스냅샷으로 압축(compaction)합니다.
+JOURNAL_COMPACT_THRESHOLD = 200
+
+# 세션별 현재 스냅샷 세대(generation)와 그 이후 저널에 기록된 변경 개수
+_session_generations = {}
+_journal_counts = {}
+
+# 스냅샷에서 사전(dictionary) 인코딩할 문자열 컬럼 (고유값이 적고 반복이 많은 짧은 문자열)
+# 수리내역/옵션 같은 긴 자유 텍스트는 복원 시 디코딩 비용이 커서 일반 문자열로 저장합니다.
+DICTIONARY_COLUMNS = ['차량명', '엔진', '트림', '색상', '특수용도이력', '1인소유', '_source']
+
+# 매물 테이블 스키마: 컬럼명 -> 저장 타입
+# - 'str': 문자열, 'int16'/'int32'/'int64': 정수 (변환 실패 시 0), 'datetime': datetime64 (변환 실패 시 NaT)
+# - 'category': 범주형 (반복이 많은 짧은 문자열을 고유값 + 정수 코드로 보관)
+# - 'text': 결측치를 빈 문자열로 채운 범주형 (같은 수리내역 문자열을 매물마다 따로 두지 않고 한 번만 보관)
+# 같은 프로세스에서 여러 세션이 동시에 매물 테이블을 들고 있으므로 가능한 작은 타입을 사용합니다.
+LISTING_SCHEMA = {
+    '차량명': 'category',
+    '엔진': 'category',
+    '트림': 'category',
+    '색상': 'category',
+    '차량가격(만원)': 'int32',
+    '연식': 'int16',
+    '최초 등록일': 'datetime',
+    '주행거리(km)': 'int32',
+    '옵션': 'str',
+    '수리내역': 'text',
+    '특수용도이력': 'category',
+    '1인소유': 'category',
+    '내차피해액': 'int64',
+    '내차피해횟수': 'int16',
+    '상대차피해횟수': 'int16',
+    '일반부품보증기간(개월)': 'int16',
+    '일반부품보증거리(km)': 'int32',
+    '주요부품보증기간(개월)': 'int16',
+    '주요부품보증거리(km)': 'int32',
+    '_source': 'category'
+}
+
+# 컬럼이 없을 때 채울 기본값 (정의되지 않은 컬럼은 빈 문자열)
+LISTING_DEFAULTS = {
+    '옵션': '',
+    '특수용도이력': 'X',
+    '1인소유': 'O',
+    '내차피해액': 0,
+    '내차피해횟수': 0,
+    '상대차피해횟수': 0,
+    '수리내역': '',
+    '일반부품보증기간(개월)': 36,
+    '일반부품보증거리(km)': 60000,
+    '주요부품보증기간(개월)': 60,
+    '주요부품보증거리(km)': 100000,
+    '_source': 'manual'
+}
+
+def _compile_schema(schema, defaults):
+    """스키마를 (컬럼명, 타입, 기본값) 목록으로 한 번만 정리해 둡니다."""
+    return [(col, kind, defaults.get(col, '')) for col, kind in schema.items()]
+
+_COMPILED_LISTING_SCHEMA = _compile_schema(LISTING_SCHEMA, LISTING_DEFAULTS)
+
+def _is_blank(series):
+    """결측치이거나 빈 문자열인 값의 마스크 (변환 실패 건수에서 제외)"""
+    return series.isna() | (series.astype(str).str.strip() == '')
+
+def _coerce_column(series, kind):
+    """컬럼 하나를 스키마 타입으로 변환하고 (변환된 Series, 변환 실패 건수)를 반환합니다."""
+    if kind in ('int16', 'int32', 'int64'):
+        if pd.api.types.is_integer_dtype(series.dtype):
+            numeric, failed = series, 0
+        else:
+            numeric = pd.to_numeric(series, errors='coerce')
+            failed = int((numeric.isna() & ~_is_blank(series)).sum())
+            numeric = numeric.fillna(0)
+        # 타입 범위를 벗어나는 값은 변환 실패로 보고 0으로 대체 (정수 오버플로 방지)
+        limits = np.iinfo(kind)
+        out_of_range = (numeric < limits.min) | (numeric > limits.max)
+        if out_of_range.any():
+            failed += int(out_of_range.sum())
+            numeric = numeric.mask(out_of_range, 0)
+        return numeric.astype(kind), failed
+    if kind == 'datetime':
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            return series, 0
+        parsed = pd.to_datetime(series, errors='coerce')
+        failed = int((parsed.isna() & ~_is_blank(series)).sum())
+        return parsed, failed
+    if kind in ('category', 'text'):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            if kind == 'text' and series.isna().any():
+                series = series.cat.add_categories([''] if '' not in series.cat.categories else []).fillna('')
+            return series, 0
+        series = series.astype(str)
+        if kind == 'text':
+            series = series.fillna('')
+        return series.astype('category'), 0
+    if pd.api.types.is_string_dtype(series.dtype) and not pd.api.types.is_object_dtype(series.dtype):
+        return series, 0
+    return series.astype(str), 0
+
+def coerce_listing_frame(df):
+    """
+    매물 DataFrame을 LISTING_SCHEMA 타입으로 한 번에 변환합니다. (CSV 업로드, 샘플 로드, 세션 복원 공통)
+    없는 컬럼은 LISTING_DEFAULTS로 채우고, 스키마에 없는 컬럼은 그대로 둡니다.
+
+    Returns:
+        df (DataFrame): 변환된 새 DataFrame
+        failures (dict): {컬럼명: 변환하지 못해 기본값(0/NaT)으로 대체된 값의 개수} (실패가 있는 컬럼만)
+    """
+    coerced = {}
+    failures = {}
+    for col, kind, default in _COMPILED_LISTING_SCHEMA:
+        series = df[col] if col in df.columns else pd.Series(default, index=df.index, dtype=object)
+        coerced[col], failed = _coerce_column(series, kind)
+        if failed:
+            failures[col] = failed
+    ordered = list(df.columns) + [col for col in LISTING_SCHEMA if col not in df.columns]
+    out = pd.DataFrame({col: coerced[col] if col in coerced else df[col] for col in ordered}, index=df.index)
+    return out, failures
+
+def empty_listing_frame():
+    """스키마 타입을 갖춘 빈 매물 DataFrame을 반환합니다."""
+    return coerce_listing_frame(pd.DataFrame(columns=list(LISTING_SCHEMA.keys())))[0]
+
+def concat_listings(frames):
+    """
+    매물 DataFrame들을 합칩니다. 범주형 컬럼은 범주를 합집합으로 맞춘 뒤 합쳐 범주형을 유지합니다.
+    (범주가 다른 범주형 컬럼을 그대로 pd.concat하면 object 컬럼이 됨)
+    """
+    frames = [f for f in frames if not f.empty] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    category_columns = {col for f in frames for col in f.columns if isinstance(f[col].dtype, pd.CategoricalDtype)}
+    aligned = [f.copy(deep=False) for f in frames]
+    for col in category_columns:
+        for f in aligned:
+            if col in f.columns and not isinstance(f[col].dtype, pd.CategoricalDtype):
+                f[col] = f[col].astype(str).astype('category')
+        categories = pd.Index([])
+        for f in aligned:
+            if col in f.columns:
+                categories = categories.union(f[col].cat.categories, sort=False)
+        for f in aligned:
+            if col in f.columns:
+                f[col] = f[col].cat.set_categories(categories)
+    return pd.concat(aligned, ignore_index=True)
+
+def append_listing_rows(df, rows):
+    """매물 행(dict 목록)을 스키마 타입으로 변환하여 df 뒤에 추가한 새 DataFrame을 반환합니다."""
+    new_rows, _ = coerce_listing_frame(pd.DataFrame(rows))
+    return concat_listings([df, new_rows])
+
+def set_listing_values(df, index, values):
+    """
+    df의 한 행(index)에 values(dict)를 스키마 타입에 맞게 기록합니다. (df를 직접 수정)
+    범주형 컬럼에 새 값이 들어오면 범주를 추가하고, 날짜 문자열은 Timestamp로 변환합니다.
+    """
+    for col, val in values.items():
+        if col in df.columns:
+            dtype = df[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                if val not in dtype.categories:
+                    df[col] = df[col].cat.add_categories([val])
+            elif pd.api.types.is_datetime64_any_dtype(dtype):
+                val = pd.to_datetime(val, errors='coerce')
+        df.at[index, col] = val
+
+def memory_usage_report(df):
+    """
+    DataFrame이 차지하는 메모리(바이트)를 컬럼별로 집계합니다. (세션별 메모리 사용량 확인용)
+    문자열/범주형 컬럼은 실제 문자열 크기까지 포함(deep)하여 계산합니다.
+    """
+    if df is None:
+        return {'total_bytes': 0, 'rows': 0, 'columns': {}}
+    usage = df.memory_usage(index=True, deep=True)
+    return {
+        'total_bytes': int(usage.sum()),
+        'rows': len(df),
+        'columns': {str(col): int(size) for col, size in usage.items()},
+    }
+
+def _snapshot_filename(session_id):
+    return f"temp_data_{session_id}.arrow"
+
+def _journal_filename(session_id):
+    return f"temp_data_{session_id}.journal"
+
+def _legacy_session_filename(session_id):
+    return f"temp_data_{session_id}.pkl"
+
+def _json_default(value):
+    """저널 기록 시 JSON으로 바로 직렬화되지 않는 값(NumPy 스칼라, 날짜 등)을 변환합니다."""
+    if hasattr(value, 'item'):
+        return value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
 
 def save_session_data(session_id, df, deleted_rows):
-    """현재 세션의 데이터(DataFrame, 삭제 이력)를 서버의 임시 파일로 저장합니다."""
+    """
+    현재 세션의 데이터(DataFrame, 삭제 이력)를 스냅샷 파일로 저장하고 저널을 비웁니다. (compaction)
+    스냅샷마다 새 세대(generation) 값을 부여하므로, 저널을 비우기 전에 중단되더라도
+    이전 세대의 저널 기록은 복원 시 무시됩니다.
+    """
     try:
-        filename = f"temp_data_{session_id}.pkl"
-        data_to_save = {
-            'df': df,
-            'deleted_rows': deleted_rows,
+        filename = _snapshot_filename(session_id)
+        generation = uuid.uuid4().hex
+        metadata = {
+            'deleted_rows': sorted(deleted_rows, key=str),
+            'generation': generation,
             'timestamp': time.time()
         }
-        with open(filename, 'wb') as f:
-            pickle.dump(data_to_save, f)
+        write_columnar_snapshot(filename, df, metadata)
+        _session_generations[session_id] = generation
+        _journal_counts[session_id] = 0
+
+        journal_filename = _journal_filename(session_id)
+        if os.path.exists(journal_filename):
+            os.remove(journal_filename)
         # print(f"Session data saved: {filename}") # 디버깅용
     except Exception as e:
         print(f"Error saving session data: {e}")
 
+def append_session_journal(session_id, op, payload):
+    """
+    세션 변경 기록 1건(add/edit/delete)을 저널 파일 끝에 추가합니다.
+    DataFrame 전체를 다시 쓰지 않으므로 매물 수와 관계없이 저장 비용이 일정합니다.
+
+    Returns:
+        int: 현재 스냅샷 이후 저널에 쌓인 변경 기록 수 (실패 시 None)
+    """
+    try:
+        generation = _session_generations.get(session_id)
+        if generation is None:
+            # 이 프로세스에서 아직 세션을 읽거나 저장한 적이 없으면 스냅샷에서 세대를 확인
+            snapshot = _read_snapshot(session_id)
+            generation = snapshot.get('generation') if snapshot else None
+            _session_generations[session_id] = generation
+        record = {'gen': generation, 'op': op, 'ts': time.time(), **payload}
+        line = json.dumps(record, ensure_ascii=False, default=_json_default)
+        with open(_journal_filename(session_id), 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+        _journal_counts[session_id] = _journal_counts.get(session_id, 0) + 1
+        return _journal_counts[session_id]
+    except Exception as e:
+        print(f"Error appending session journal: {e}")
+        return None
+
+def record_session_change(session_id, op, df, deleted_rows, **payload):
+    """
+    세션 변경 사항을 저장합니다.
+    - 'bulk_load' (CSV 업로드, 샘플 로드 등 전체 교체): 새 스냅샷으로 저장
+    - 'add' / 'edit' / 'delete': 저널에 추가하고, 기록이 쌓이면 스냅샷으로 압축
+    """
+    if op == 'bulk_load':
+        save_session_data(session_id, df, deleted_rows)
+        return
+    count = append_session_journal(session_id, op, payload)
+    if count is None or count >= JOURNAL_COMPACT_THRESHOLD:
+        save_session_data(session_id, df, deleted_rows)
+
+def _read_snapshot(session_id):
+    filename = _snapshot_filename(session_id)
+    if not os.path.exists(filename):
+        return None
+    df, metadata = read_columnar_snapshot(filename)
+    return {'df': df, **metadata}
+
+def _to_arrow_column(series):
+    """
+    DataFrame 컬럼 하나를 Arrow 배열로 변환합니다.
+    - 숫자/날짜 컬럼: 고정 폭 배열 그대로
+    - DICTIONARY_COLUMNS 문자열 컬럼: 사전(dictionary) 인코딩 (고유 문자열 + 정수 코드)
+    - 범주형(category) 컬럼: 사전 인코딩 그대로
+    - 여러 타입이 섞인 object 컬럼: 문자열로 변환하여 저장
+    """
+    try:
+        array = pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = pa.array(series.astype(str), from_pandas=True)
+    if series.name in DICTIONARY_COLUMNS and (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+        array = array.dictionary_encode()
+    return array
+
+def write_columnar_snapshot(filename, df, metadata):
+    """
+    DataFrame을 Arrow IPC(Feather v2) 컬럼 형식으로 저장합니다. (pickle 대체)
+    압축하지 않은 IPC 파일이므로 읽을 때 메모리 매핑(memory-map)이 가능합니다.
+    metadata(dict)는 JSON으로 스키마 메타데이터에 함께 저장합니다.
+    """
+    arrays = [_to_arrow_column(df[col]) for col in df.columns]
+    # 원래 범주형(category)이 아니었던 컬럼은 읽을 때 원래 문자열 컬럼으로 되돌림
+    decode_columns = [str(col) for col, array in zip(df.columns, arrays)
+                      if pa.types.is_dictionary(array.type) and not isinstance(df[col].dtype, pd.CategoricalDtype)]
+    schema_metadata = {
+        'autoscan': json.dumps({**metadata, 'decode_columns': decode_columns}, ensure_ascii=False, default=_json_default)
+    }
+    table = pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns]).replace_schema_metadata(schema_metadata)
+
+    tmp_filename = f"{filename}.tmp"
+    with pa.OSFile(tmp_filename, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_filename, filename) # 저장 도중 중단되어도 기존 스냅샷이 깨지지 않도록 교체
+
+def read_columnar_snapshot(filename, writable=True):
+    """
+    write_columnar_snapshot으로 저장한 파일을 메모리 매핑으로 읽어 (DataFrame, metadata)를 반환합니다.
+    writable=False이면 숫자 컬럼을 복사하지 않고(zero-copy) 매핑된 버퍼를 그대로 사용하고,
+    사전 인코딩된 문자열 컬럼도 디코딩하지 않고 범주형(category)으로 반환합니다.
+    (읽기 전용 분석용. 이 경우 DataFrame 값을 직접 수정할 수 없습니다.)
+    """
+    with pa.memory_map(filename, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = json.loads(table.schema.metadata[b'autoscan'])
+    decode_columns = metadata.pop('decode_columns', [])
+    for col in decode_columns if writable else []:
+        i = table.schema.get_field_index(col)
+        table = table.set_column(i, col, table.column(i).cast(table.schema.field(i).type.value_type))
+    df = table.to_pandas(split_blocks=not writable)
+    return df, metadata
+
+def _read_journal(session_id, generation):
+    """현재 스냅샷 세대에 속한 저널 기록을 순서대로 읽습니다. (기록 도중 잘린 마지막 줄은 무시)"""
+    filename = _journal_filename(session_id)
+    records = []
+    if not os.path.exists(filename):
+        return records
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if record.get('gen') == generation:
+                records.append(record)
+    return records
+
+def _replay_journal(df, deleted_rows, records):
+    """저널 기록을 스냅샷 상태에 순서대로 다시 적용합니다."""
+    pending_rows = [] # 연속된 add 기록은 모아서 한 번에 concat
+    for record in records:
+        op = record['op']
+        if op == 'add':
+            pending_rows.append(record['row'])
+            continue
+        if pending_rows:
+            df = append_listing_rows(df, pending_rows)
+            pending_rows = []
+        if op == 'edit':
+            set_listing_values(df, record['index'], record['values'])
+        elif op == 'delete':
+            deleted_rows.update(record.get('signatures', []))
+            indices = [i for i in record['indices'] if i in df.index]
+            df = df.drop(indices).reset_index(drop=True)
+    if pending_rows:
+        df = append_listing_rows(df, pending_rows)
+    return df, deleted_rows
+
+def legacy_session_ids():
+    """현재 디렉토리에 남아 있는 이전 버전 pickle 세션 파일(temp_data_<id>.pkl)의 세션 ID 목록"""
+    return sorted(os.path.basename(f)[len("temp_data_"):-len(".pkl")] for f in glob.glob(_legacy_session_filename("*")))
+
+def import_legacy_session(session_id):
+    """
+    이전 버전의 pickle 세션 파일(temp_data_<id>.pkl)을 Arrow 스냅샷으로 옮기고 원본을 삭제합니다.
+    스냅샷이 이미 있으면 아무것도 하지 않습니다.
+    pickle 역직렬화는 임의 코드를 실행할 수 있으므로 세션 복원 시 자동으로 호출하지 않으며,
+    운영자가 파일을 확인한 뒤 `python -m autoscan migrate-sessions`로 직접 실행합니다.
+
+    Returns:
+        bool: 이전 세션을 옮겼는지 여부
+    """
+    legacy_filename = _legacy_session_filename(session_id)
+    if not os.path.exists(legacy_filename) or os.path.exists(_snapshot_filename(session_id)):
+        return False
+    try:
+        with open(legacy_filename, 'rb') as f:
+            data = pickle.load(f)
+        df = coerce_listing_frame(data['df'])[0]
+        deleted_rows = normalize_signatures(data.get('deleted_rows') or set())
+        save_session_data(session_id, df, deleted_rows)
+        if not os.path.exists(_snapshot_filename(session_id)):
+            return False
+        os.remove(legacy_filename)
+        print(f"Legacy session imported: {legacy_filename}")
+        return True
+    except Exception as e:
+        print(f"Error importing legacy session data: {e}")
+        return False
+
 def load_session_data(session_id):
-    """저장된 세션 데이터를 불러옵니다."""
-    filename = f"temp_data_{session_id}.pkl"
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'rb') as f:
-                data = pickle.load(f)
-            # print(f"Session data loaded: {filename}") # 디버깅용
-            return data
-        except Exception as e:
-            print(f"Error loading session data: {e}")
+    """저장된 세션 데이터를 불러옵니다. (스냅샷을 읽은 뒤 저널의 변경 기록을 재적용)"""
+    try:
+        snapshot = _read_snapshot(session_id)
+        generation = snapshot.get('generation') if snapshot else None
+        records = _read_journal(session_id, generation)
+        if snapshot is None and not records:
             return None
-    return None
+
+        df = coerce_listing_frame(snapshot['df'])[0] if snapshot else empty_listing_frame()
+        deleted_rows = set(snapshot['deleted_rows']) if snapshot else set()
+        df, deleted_rows = _replay_journal(df, deleted_rows, records)
+        deleted_rows = normalize_signatures(deleted_rows) # 이전 문자열 시그니처를 해시로 이전
+
+        _session_generations[session_id] = generation
+        _journal_counts[session_id] = len(records)
+        # print(f"Session data loaded: {session_id}") # 디버깅용
+        return {
+            'df': df,
+            'deleted_rows': deleted_rows,
+            'timestamp': records[-1]['ts'] if records else snapshot['timestamp']
+        }
+    except Exception as e:
+        print(f"Error loading session data: {e}")
+        return None
 
 def clear_session_data(session_id):
-    """저장된 세션 파일을 삭제합니다."""
-    filename = f"temp_data_{session_id}.pkl"
-    if os.path.exists(filename):
-        try:
-            os.remove(filename)
-            # print(f"Session data cleared: {filename}") # 디버깅용
-        except Exception as e:
-            print(f"Error clearing session data: {e}")
+    """저장된 세션 파일(스냅샷, 저널, 이전 버전의 pickle 파일)을 삭제합니다."""
+    _session_generations.pop(session_id, None)
+    _journal_counts.pop(session_id, None)
+    for filename in (_snapshot_filename(session_id), _journal_filename(session_id), _legacy_session_filename(session_id)):
+        if os.path.exists(filename):
+            try:
+                os.remove(filename)
+                # print(f"Session data cleared: {filename}") # 디버깅용
+            except Exception as e:
+                print(f"Error clearing session data: {e}")
 
 def cleanup_old_sessions(max_age_seconds=3600):
-    """오래된(예: 1시간 이상 지난) 세션 파일을 정리합니다."""
+    """오래된(예: 1시간 이상 지난) 세션 파일을 정리합니다. (스냅샷과 저널 중 최근 수정 시각 기준)"""
     try:
         now = time.time()
-        for filename in glob.glob("temp_data_*.pkl"):
-            if os.path.getmtime(filename) < now - max_age_seconds:
-                os.remove(filename)
-                print(f"Old session file removed: {filename}")
+        session_files = {}
+        for filename in glob.glob("temp_data_*"):
+            session_key = os.path.splitext(filename)[0]
+            session_files.setdefault(session_key, []).append(filename)
+        for filenames in session_files.values():
+            if max(os.path.getmtime(f) for f in filenames) < now - max_age_seconds:
+                for filename in filenames:
+                    os.remove(filename)
+                    print(f"Old session file removed: {filename}")
     except Exception as e:
         print(f"Error cleaning up old sessions: {e}")
 
+def save_classification_cache(cache, path=CLASSIFICATION_CACHE_PATH, min_interval=CLASSIFICATION_CACHE_SAVE_INTERVAL):
+    """
+    분류 캐시를 JSON 파일로 저장합니다. (서버 재시작 후에도 캐시를 이어서 사용하기 위함)
+    마지막 저장 이후 새 항목이 없거나, 마지막 저장 후 min_interval초가 지나지 않았으면 저장을 건너뜁니다.
+    (건너뛴 변경 사항은 dirty 표시가 남아 다음 저장 때 함께 기록됨)
+    다른 세션이 이미 저장 중이면 기다리지 않고 건너뛰며, 임시 파일은 저장마다 고유한 이름을 사용하므로
+    여러 워커 프로세스가 동시에 저장해도 서로의 임시 파일을 덮어쓰지 않습니다.
+    """
+    if not path or not cache.dirty:
+        return
+    if not _cache_save_lock.acquire(blocking=False):
+        return
+    try:
+        if time.time() - _cache_saved_at.get(path, 0) < min_interval:
+            return
+        cache.dirty = False # 스냅샷을 뜬 뒤에 추가된 항목은 다음 저장 대상으로 남도록 먼저 해제
+        data_to_save = {
+            'ruleset_version': cache.ruleset_version,
+            'entries': [[text, damage, tier, reasons] for (text, damage), (tier, reasons) in cache.items()],
+        }
+        tmp_filename = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump(data_to_save, f, ensure_ascii=False)
+            os.replace(tmp_filename, path) # 저장 도중 중단되어도 기존 파일이 깨지지 않도록 교체
+        except Exception:
+            cache.dirty = True
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        _cache_saved_at[path] = time.time()
+    except Exception as e:
+        print(f"Error saving classification cache: {e}")
+    finally:
+        _cache_save_lock.release()
+
+def load_classification_cache(cache, path=CLASSIFICATION_CACHE_PATH):
+    """
+    저장된 분류 캐시를 불러옵니다. 프로세스당 경로별로 최초 1회만 읽으며,
+    키워드 규칙(ruleset_version)이 바뀐 캐시 파일은 무시합니다.
+    """
+    if not path or path in _restored_cache_paths:
+        return
+    _restored_cache_paths.add(path)
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('ruleset_version') != cache.ruleset_version:
+            print(f"Classification cache ignored (ruleset changed): {path}")
+            return
+        cache.put_many(((text, damage), (tier, reasons)) for text, damage, tier, reasons in data['entries'])
+        cache.dirty = False
+    except Exception as e:
+        print(f"Error loading classification cache: {e}")
+
+def _report_cache_filename(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.json")
+
+def load_cached_report(key, cache_dir=None, ttl_seconds=REPORT_CACHE_TTL_SECONDS):
+    """
+    키(내용 해시)에 해당하는 캐시된 AI 리포트 항목(dict)을 반환합니다.
+    없거나 유효 시간이 지난 항목은 None을 반환합니다. (만료된 파일은 삭제)
+    cache_dir를 지정하지 않으면 REPORT_CACHE_DIR을 사용합니다.
+    """
+    cache_dir = REPORT_CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir:
+        return None
+    filename = _report_cache_filename(cache_dir, key)
+    try:
+        if not os.path.exists(filename):
+            return None
+        if os.path.getmtime(filename) < time.time() - ttl_seconds:
+            os.remove(filename)
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading cached report: {e}")
+        return None
+
+def save_cached_report(key, entry, cache_dir=None, max_entries=REPORT_CACHE_MAX_ENTRIES):
+    """AI 리포트 항목(dict)을 캐시 디렉토리에 저장하고, 최대 개수를 넘으면 오래된 항목부터 삭제합니다."""
+    cache_dir = REPORT_CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        filename = _report_cache_filename(cache_dir, key)
+        tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump({**entry, 'created': time.time()}, f, ensure_ascii=False)
+        os.replace(tmp_filename, filename) # 다른 워커가 읽는 도중에도 깨진 파일이 보이지 않도록 교체
+
+        cached_files = glob.glob(os.path.join(cache_dir, "*.json"))
+        if len(cached_files) > max_entries:
+            cached_files.sort(key=os.path.getmtime)
+            for old_file in cached_files[:len(cached_files) - max_entries]:
+                os.remove(old_file)
+    except Exception as e:
+        print(f"Error saving cached report: {e}")
+
+def iter_data_chunks(file_path, chunksize=CSV_CHUNK_ROWS):
+    """
+    CSV 파일을 chunksize 행씩 읽으면서, load_data와 같은 전처리를 마친 DataFrame 조각을 순서대로 반환합니다.
+    파일 전체를 한 번에 메모리에 올리지 않으므로 대용량 파일도 일정한 메모리로 읽을 수 있습니다.
+    """
+    # Streamlit uploaded_file_manager.UploadedFile 객체는 BytesIO처럼 동작 (재업로드 시 처음부터 다시 읽기)
+    if hasattr(file_path, 'seek'):
+        file_path.seek(0)
+    with pd.read_csv(file_path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            # 수리내역 결측치는 빈 문자열로 처리
+            chunk['수리내역'] = chunk['수리내역'].fillna('')
+            # '옵션' 컬럼이 없는 경우 빈 문자열로 초기화
+            if '옵션' not in chunk.columns:
+                chunk['옵션'] = ''
+            yield chunk
+
+def stream_csv_files(file_paths, chunk_transform=None, chunksize=CSV_CHUNK_ROWS, categorize=False):
+    """
+    여러 CSV 파일을 청크 단위로 읽어 하나의 DataFrame으로 합칩니다.
+    각 청크에 chunk_transform(타입 변환, 삭제 이력 필터링 등)을 먼저 적용한 뒤 결과 조각만 보관하므로,
+    파일 전체를 읽고 합친 다음 변환하는 방식보다 최대 메모리 사용량이 작습니다.
+
+    Args:
+        file_paths: CSV 경로 또는 파일 객체 목록
+        chunk_transform: DataFrame 조각을 받아 변환/필터링된 조각을 반환하는 함수 (선택)
+        chunksize: 한 번에 읽을 행 수
+        categorize: True이면 청크마다 Tier/분석결과 컬럼도 함께 계산
+
+    Returns:
+        DataFrame (읽은 데이터가 없으면 None)
+    """
+    parts = []
+    for file_path in file_paths:
+        file_parts = []
+        try:
+            for chunk in iter_data_chunks(file_path, chunksize):
+                if chunk_transform is not None:
+                    chunk = chunk_transform(chunk)
+                if categorize and not chunk.empty:
+                    chunk[['Tier', '분석결과']] = categorize_frame(chunk)
+                if not chunk.empty:
+                    file_parts.append(chunk)
+        except Exception as e:
+            print(f"Error loading data: {e}")
+            continue # 읽다가 실패한 파일은 통째로 제외
+        parts.extend(file_parts)
+    if not parts:
+        return None
+    return concat_listings(parts)
+
 def load_data(file_path):
     """
     CSV 파일을 로드하고 필요한 전처리를 수행합니다.
     """
     try:
-        # Streamlit uploaded_file_manager.UploadedFile 객체는 StringIO처럼 동작
-        if isinstance(file_path, str):
-            df = pd.read_csv(file_path)
-        else: # BytesIO 또는 유사 객체
-            df = pd.read_csv(file_path)
-        # 수리내역 결측치는 빈 문자열로 처리
-        df['수리내역'] = df['수리내역'].fillna('')
-        # '옵션' 컬럼이 없는 경우 빈 문자열로 초기화
-        if '옵션' not in df.columns:
-            df['옵션'] = ''
-        return df
+        return pd.concat(iter_data_chunks(file_path), ignore_index=True)
     except Exception as e:
         print(f"Error loading data: {e}")
         return None
@@ -1,6 +1,14 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
 import pandas as pd
 from storage import load_data
-from domain_logic import categorize_car
+from domain_logic import categorize_car, categorize_frame, analyze_incremental, ClassificationCache, get_row_signature, compute_row_signatures, normalize_signatures
+from price_model import PriceModelService, value_listings
 
 # 테스트할 CSV 파일 경로
 CSV_FILE_PATH = 'sample_data.csv'
@@ -14,8 +22,17 @@ def run_logic_test():
         return
 
     print("데이터 로드 성공. 수리내역 분석 중...")
-    # categorize_car 함수는 Series를 반환하므로, apply와 함께 사용하여 DataFrame에 새 컬럼을 추가합니다.
-    df[['사고등급', '사고원인']] = df.apply(categorize_car, axis=1)
+    # categorize_frame은 전체 DataFrame을 한 번에 분석하여 [Tier, 분석결과] 컬럼을 반환합니다.
+    df[['사고등급', '사고원인']] = categorize_frame(df)
+
+    # 벡터화 경로(categorize_frame)와 행 단위 경로(categorize_car)의 결과가 동일한지 확인
+    per_row = df.apply(categorize_car, axis=1)
+    mismatched = (per_row[0].values != df['사고등급'].values) | (per_row[1].values != df['사고원인'].values)
+    if mismatched.any():
+        print(f"❌ 벡터화 분석 결과 불일치: {mismatched.sum()}건")
+        print(df.loc[mismatched, ['수리내역', '사고등급', '사고원인']].to_markdown(index=False))
+    else:
+        print("✅ 벡터화 분석 결과가 행 단위 분석 결과와 일치합니다.")
 
     print("\n상위 5개 차량의 분석 결과:")
     print(df[['수리내역', '사고등급', '사고원인']].head().to_markdown(index=False))
@@ -51,6 +68,210 @@ def run_logic_test():
     else:
         print("Tier 0 차량 없음.")
 
+    # 내차피해액 결측(NaN/None) 행도 분류 캐시에서 같은 키로 재사용되고, 행 단위 경로와 같은 결과인지 확인
+    missing_damage = pd.DataFrame({'수리내역': ['', '', '프런트펜더(교환)'], '내차피해액': pd.Series([np.nan, None, np.nan], dtype=object)})
+    cache = ClassificationCache()
+    first = categorize_frame(missing_damage, cache)
+    second = categorize_frame(missing_damage, cache)
+    per_row = missing_damage.apply(categorize_car, axis=1)
+    ok = cache.stats()['size'] == 2 and cache.stats()['hits'] == 2 and first.equals(second) and (per_row[1].values == first['분석결과'].values).all()
+    print(f"{'✅' if ok else '❌'} 내차피해액 결측 행도 분류 캐시에서 재사용")
+
+
+class StubGenerativeModel:
+    """
+    genai.GenerativeModel 대신 사용하는 테스트용 모델 (API 호출 없이 호출 횟수만 기록)
+    stream=True이면 리포트를 여러 조각으로 나누어 차례로 돌려주는 가짜 스트리밍 응답을 반환하고,
+    generation_config(구조화 출력)가 주어지면 매물 0~2번을 고른 JSON 응답을 반환합니다.
+    """
+    calls = 0
+    delay = 0 # 응답 지연(초), 동시 요청 테스트용
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, generation_config=None):
+        StubGenerativeModel.calls += 1
+        time.sleep(StubGenerativeModel.delay)
+        if generation_config is not None:
+            picks = [{"id": i, "reason": f"테스트 이유 {i}"} for i in range(3)]
+            return SimpleNamespace(text=json.dumps({"top": picks, "worst": picks[::-1], "summary": f"테스트 총평 {StubGenerativeModel.calls}"}, ensure_ascii=False))
+        text = f"# 테스트 리포트 {StubGenerativeModel.calls}\n\n## 🏆 Top 3 추천\n\n## ⚠️ Worst 3 비추천\n"
+        if not stream:
+            return SimpleNamespace(text=text)
+        return (SimpleNamespace(text=line) for line in text.splitlines(keepends=True))
+
+def run_report_cache_test():
+    """같은 데이터로 리포트를 두 번 요청하면 두 번째는 캐시에서 반환되는지 확인합니다."""
+    import ai_service
+    import storage
+    from rate_limiter import RateLimiter
+
+    print("\nAI 리포트 캐시 테스트 (Stub 모델 사용)...")
+    df = load_data(CSV_FILE_PATH)
+    df[['Tier', '분석결과']] = categorize_frame(df)
+
+    original = (ai_service.MODEL_CLIENTS, ai_service.MODEL_RATE_LIMITS, ai_service.RATE_LIMITER, storage.REPORT_CACHE_DIR)
+    ai_service.MODEL_CLIENTS = ai_service.ModelClientRegistry(api_key='test-key', model_factory=StubGenerativeModel)
+    ai_service.MODEL_RATE_LIMITS = {} # 속도 제한은 run_rate_limit_test에서 따로 확인
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            storage.REPORT_CACHE_DIR = cache_dir
+            ai_service.RATE_LIMITER = RateLimiter(os.path.join(cache_dir, 'rate_limit.db'))
+            first = ai_service.generate_engineer_report(df, "밸런스")
+            second = ai_service.generate_engineer_report(df, "밸런스")
+            other_preference = ai_service.generate_engineer_report(df, "안전 최우선")
+            bypassed = ai_service.generate_engineer_report(df, "밸런스", use_cache=False)
+            partials = []
+            streamed = ai_service.generate_engineer_report(df, "밸런스", use_cache=False, on_partial=partials.append) # 기본 출력 모드(markdown)는 스트리밍
+            structured = ai_service.generate_engineer_report(df, "밸런스", use_cache=False, structured=True)
+    finally:
+        ai_service.MODEL_CLIENTS, ai_service.MODEL_RATE_LIMITS, ai_service.RATE_LIMITER, storage.REPORT_CACHE_DIR = original
+
+    checks = [
+        (not first[2] and StubGenerativeModel.calls >= 1, "첫 요청은 모델 호출"),
+        (second[2] and second[0] == first[0], "같은 요청은 캐시에서 반환"),
+        (not other_preference[2], "분석 성향이 다르면 새로 생성"),
+        (not bypassed[2] and bypassed[0] != first[0], "캐시 무시 옵션은 새로 생성"),
+        (len(partials) > 1 and partials[-1] == streamed[0], "스트리밍 부분 응답이 최종 리포트로 이어짐"),
+        ("# 🛠️ 엔지니어의 픽" in structured[0] and "[1번]" in structured[0], "구조화(JSON) 응답을 매물 데이터로 리포트 렌더링"),
+    ]
+    # Tier 1 매물이 Top 3에 들어오면 추천 목록에서 제외되는지 확인
+    tier1_id = int(df.index[df['Tier'] == 1][0])
+    other_id = int(df.index[df['Tier'] != 1][0])
+    rendered = ai_service.render_structured_report({'top': [(tier1_id, "테스트"), (other_id, "테스트")], 'worst': [], 'summary': ""}, df)
+    top_section = rendered.split("# 🚨")[0]
+    checks.append((f"[{tier1_id}번]" not in top_section and f"[{other_id}번]" in top_section, "Tier 1 매물은 Top 3에서 제외"))
+    for ok, label in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+
+def run_rate_limit_test():
+    """요청 한도 대기열과 동일 요청 병합(coalescing)을 확인합니다."""
+    import ai_service
+    from rate_limiter import RateLimiter
+
+    print("\n요청 한도/동일 요청 병합 테스트 (Stub 모델 사용)...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        limiter = RateLimiter(os.path.join(tmp_dir, 'rate_limit.db'))
+        # 분당 60회(초당 1개) 토큰 버킷, 동시 1건: 두 번째 요청은 첫 요청이 끝나고 토큰이 채워질 때까지 대기
+        first_lease = limiter.acquire('stub-model', 60, burst=1, max_concurrency=1)
+        positions = []
+        waited = {}
+
+        def second_request():
+            start = time.perf_counter()
+            limiter.release(limiter.acquire('stub-model', 60, burst=1, max_concurrency=1, on_wait=positions.append))
+            waited['seconds'] = time.perf_counter() - start
+
+        waiter = threading.Thread(target=second_request)
+        waiter.start()
+        time.sleep(0.3)
+        limiter.release(first_lease)
+        waiter.join()
+
+        original = (ai_service.MODEL_CLIENTS, ai_service.RATE_LIMITER, ai_service.MODEL_MAX_CONCURRENCY)
+        ai_service.MODEL_CLIENTS = ai_service.ModelClientRegistry(api_key='test-key', model_factory=StubGenerativeModel)
+        ai_service.RATE_LIMITER = limiter
+        ai_service.MODEL_MAX_CONCURRENCY = 1
+        StubGenerativeModel.delay = 0.5
+        try:
+            calls_before = StubGenerativeModel.calls
+            results = []
+            # 첫 후보 모델의 동시 실행 슬롯을 잠시 점유하여 leader가 대기열에서 기다리게 하고, 합류한 요청도 순번을 전달받는지 확인
+            busy_lease = limiter.acquire(ai_service.MODEL_CANDIDATES[0], 0, max_concurrency=1)
+            threading.Timer(0.3, limiter.release, args=(busy_lease,)).start()
+            queue_updates = [[] for _ in range(3)]
+            requests = [threading.Thread(target=lambda updates=updates: results.append(ai_service._generate_with_fallback("동일 프롬프트", use_cache=False, on_queue=updates.append))) for updates in queue_updates]
+            for request in requests:
+                request.start()
+            for request in requests:
+                request.join()
+        finally:
+            ai_service.MODEL_CLIENTS, ai_service.RATE_LIMITER, ai_service.MODEL_MAX_CONCURRENCY = original
+            StubGenerativeModel.delay = 0
+
+    checks = [
+        (positions[:1] == [1] and positions[-1:] == [0] and waited['seconds'] >= 0.9, "한도가 차면 대기열 순번을 알리고 토큰이 채워진 뒤 통과"),
+        (StubGenerativeModel.calls - calls_before == 1 and len({r[0] for r in results}) == 1, "동시에 들어온 동일 요청은 한 번만 호출"),
+        (all(updates[:1] == [1] and updates[-1:] == [0] for updates in queue_updates), "진행 중인 요청에 합류한 요청도 대기 순번을 전달받음"),
+    ]
+    for ok, label in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+
+
+def run_price_model_test():
+    """매물 추가/삭제 후의 증분 갱신 결과가 처음부터 다시 적합한 결과와 같은지 확인합니다."""
+    df = load_data(CSV_FILE_PATH)
+    model_name = df['차량명'].value_counts().index[0]
+    model_rows = df.index[df['차량명'] == model_name]
+    # 2행 삭제 + 1행 중복 추가
+    changed_df = pd.concat([df.drop(model_rows[:2]), df.loc[model_rows[[3]]]])
+
+    service = PriceModelService()
+    first = service.fit(df, model_name)
+    incremental = service.fit(changed_df, model_name)
+    full = PriceModelService().fit(changed_df, model_name)
+
+    checks = [
+        (service.fit(df, model_name)['coefficients'] == first['coefficients'] and service.stats()['hits'] == 1, "같은 데이터 버전의 가격 모델은 캐시에서 재사용"),
+        (service.stats()['incremental_updates'] == 1
+         and np.allclose(list(incremental['coefficients'].values()), list(full['coefficients'].values()))
+         and np.allclose(incremental['frame']['예측가격'], full['frame']['예측가격']),
+         "행 추가/삭제 시 증분 갱신한 계수가 전체 재적합 결과와 일치"),
+        (np.allclose(value_listings(df, ['차량명'], min_rows=1).loc[first['frame'].index, '예측가격'], first['frame']['예측가격']),
+         "일괄 시세 평가의 예측가격이 차종별 모델과 일치"),
+        (service.fit(df.assign(색상='테스트'), model_name)['frame']['색상'].eq('테스트').all()
+         and service.stats()['hits'] == 2,
+         "캐시된 계수를 사용할 때도 결과 행은 호출한 df로 구성"),
+        (service.fit(df, model_name, source='other') is not None and service.stats()['models'] == 2 and service.stats()['hits'] == 2,
+         "데이터 출처(세션)별로 캐시와 증분 상태를 분리"),
+    ]
+    for ok, label in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+
+
+def run_incremental_test():
+    """행 하나를 수정하면 공유 분류 캐시와 관계없이 그 행만 다시 분류하는지 확인합니다."""
+    print("\n증분 재분석 테스트...")
+    df = load_data(CSV_FILE_PATH)
+    analysis, _ = analyze_incremental(df, cache=ClassificationCache())
+    previous = df.assign(Tier=analysis['Tier'], 분석결과=analysis['분석결과'])
+
+    edited = df.drop(df.index[:2]) # 2행 삭제 + 1행 수정
+    edited.loc[edited.index[0], '수리내역'] = "휠하우스 판금"
+    empty_cache = ClassificationCache() # 다른 세션 때문에 공유 캐시가 비워진 상황
+    incremental, reclassified = analyze_incremental(edited, previous, cache=empty_cache)
+    full = categorize_frame(edited, ClassificationCache())
+
+    checks = [
+        (reclassified == 1 and empty_cache.stats()['size'] == 1, "수정된 행만 다시 분류 (캐시가 비어 있어도)"),
+        (incremental['Tier'].tolist() == full['Tier'].tolist() and incremental['분석결과'].tolist() == full['분석결과'].tolist(),
+         "증분 재분석 결과가 전체 분류 결과와 일치"),
+    ]
+    for ok, label in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+
+
+def run_signature_test():
+    """이전 버전에서 저장한 문자열 시그니처(get_row_signature)가 벡터화 해시(compute_row_signatures)와 같은 값이 되는지 확인합니다."""
+    print("\n행 시그니처 호환성 테스트...")
+    # 이전 버전의 CSV 업로드와 같은 방식으로 변환한 행에서 문자열 시그니처 생성
+    legacy_df = pd.read_csv(CSV_FILE_PATH)
+    legacy_df['수리내역'] = legacy_df['수리내역'].fillna('')
+    legacy_df['최초 등록일'] = pd.to_datetime(legacy_df['최초 등록일'], errors='coerce').dt.strftime('%Y-%m-%d').fillna('')
+    for col in ['차량가격(만원)', '주행거리(km)', '연식']:
+        legacy_df[col] = pd.to_numeric(legacy_df[col], errors='coerce').fillna(0).astype(int)
+    legacy_signatures = [get_row_signature(row) for _, row in legacy_df.iterrows()]
+
+    hashes = compute_row_signatures(load_data(CSV_FILE_PATH))
+    ok = sorted(normalize_signatures(legacy_signatures)) == sorted(set(hashes.tolist()))
+    print(f"{'✅' if ok else '❌'} 이전 문자열 시그니처의 해시가 벡터화 시그니처와 일치")
+
 
 if __name__ == "__main__":
     run_logic_test()
+    run_report_cache_test()
+    run_rate_limit_test()
+    run_price_model_test()
+    run_incremental_test()
+    run_signature_test()
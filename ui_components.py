@@ -3,12 +3,15 @@ import pandas as pd
 import os
 import numpy as np
 import altair as alt
-from sklearn.linear_model import LinearRegression
-from storage import load_data, clear_session_data
-from ai_service import generate_engineer_report, create_engineer_prompt
-from domain_logic import get_row_signature
+from storage import load_data, clear_session_data, coerce_listing_frame, empty_listing_frame, set_listing_values, memory_usage_report
+from ai_service import create_engineer_prompt, submit_report_job, get_report_job, cancel_report_job, MODEL_HEALTH, RATE_LIMITER
+from domain_logic import compute_row_signatures, compute_warranty_frame, CLASSIFICATION_CACHE
+from price_model import PRICE_MODELS, MIN_MODEL_ROWS
 
-def render_sidebar(load_csv_file_callback, DEFAULT_COLUMNS, DEFAULT_DATA, auto_save):
+# 백그라운드 AI 리포트 작업 상태(스트리밍 부분 응답 포함)를 확인하는 주기(초)
+REPORT_POLL_SECONDS = 1
+
+def render_sidebar(load_csv_file_callback, auto_save):
     with st.sidebar:
         st.header("데이터 관리")
         
@@ -20,10 +23,11 @@ def render_sidebar(load_csv_file_callback, DEFAULT_COLUMNS, DEFAULT_DATA, auto_s
         
         # CSV 내보내기
         if not st.session_state.df.empty:
-            csv = st.session_state.df.to_csv(index=False).encode('utf-8-sig')
+            # CSV 문자열은 매 rerun마다 만들지 않고, 사용자가 버튼을 눌렀을 때만 생성
+            export_df = st.session_state.df
             st.download_button(
                 label="현재 데이터 CSV로 내보내기",
-                data=csv,
+                data=lambda: export_df.to_csv(index=False).encode('utf-8-sig'),
                 file_name="used_car_data.csv",
                 mime="text/csv",
             )
@@ -41,23 +45,13 @@ def render_sidebar(load_csv_file_callback, DEFAULT_COLUMNS, DEFAULT_DATA, auto_s
                     st.session_state.show_sample_warning = False
                     loaded_df = load_data("sample_data.csv")
                     if loaded_df is not None:
-                        loaded_df = loaded_df.loc[:, ~loaded_df.columns.str.contains('^Unnamed')]
+                        loaded_df = loaded_df.loc[:, ~loaded_df.columns.str.contains('^Unnamed')].copy()
                         loaded_df['_source'] = 'manual' # 샘플 데이터는 수기(manual) 취급
-                        
-                        for col in DEFAULT_COLUMNS.keys():
-                            if col not in loaded_df.columns:
-                                loaded_df[col] = DEFAULT_DATA.get(col, '')
-                            try:
-                                if col == '최초 등록일':
-                                    loaded_df[col] = pd.to_datetime(loaded_df[col], errors='coerce').dt.strftime('%Y-%m-%d')
-                                    loaded_df[col] = loaded_df[col].fillna('')
-                                elif DEFAULT_COLUMNS[col] == int: # DEFAULT_COLUMNS에서 int로 정의된 경우 처리
-                                    loaded_df[col] = pd.to_numeric(loaded_df[col], errors='coerce').fillna(0).astype(int)
-                                else:
-                                    loaded_df[col] = loaded_df[col].astype(DEFAULT_COLUMNS[col])
-                            except Exception as e:
-                                st.warning(f"경고: '{col}' 컬럼의 데이터 타입 변환 중 오류가 발생했습니다. 원인: {e} - 일부 데이터가 유실될 수 있습니다.")
-                        
+
+                        loaded_df, failures = coerce_listing_frame(loaded_df)
+                        for col, count in failures.items():
+                            st.warning(f"경고: '{col}' 컬럼의 값 {count:,}건을 변환하지 못해 기본값으로 대체했습니다. 원본 데이터를 확인해주세요.")
+
                         st.session_state.df = loaded_df
                         st.session_state.analyzed_df = None
                         st.session_state.form_expanded = False
@@ -98,7 +92,8 @@ def render_sidebar(load_csv_file_callback, DEFAULT_COLUMNS, DEFAULT_DATA, auto_s
             st.divider()
 
         if st.button("초기화 (모든 데이터 삭제)"):
-            st.session_state.df = pd.DataFrame(columns=DEFAULT_COLUMNS.keys())
+            st.session_state.df = empty_listing_frame()
+            cancel_report_generation() # 진행 중인 리포트 작업 취소
             st.session_state.analyzed_df = None
             st.session_state.ai_report = None
             st.session_state.ai_model_used = None
@@ -120,6 +115,39 @@ def render_sidebar(load_csv_file_callback, DEFAULT_COLUMNS, DEFAULT_DATA, auto_s
             - **Tier 3 (추천)**: 휀더, 도어 등 단순 외판 교환.
             """)
 
+        # 디버그 모드에서만 분류 캐시 상태 표시
+        if st.query_params.get("debug") == "true":
+            cache_stats = CLASSIFICATION_CACHE.stats()
+            st.caption(
+                f"🗂️ 분류 캐시: {cache_stats['size']:,}/{cache_stats['maxsize']:,}건 | "
+                f"hit {cache_stats['hits']:,} / miss {cache_stats['misses']:,} ({cache_stats['hit_rate']:.0%}) | "
+                f"ruleset {cache_stats['ruleset_version']}"
+            )
+            price_stats = PRICE_MODELS.stats()
+            st.caption(
+                f"📈 가격 모델 캐시: {price_stats['fits']:,}건 (차종 {price_stats['models']:,}) | "
+                f"hit {price_stats['hits']:,} / miss {price_stats['misses']:,} | 증분 갱신 {price_stats['incremental_updates']:,}회"
+            )
+            listing_memory = memory_usage_report(st.session_state.df)
+            analyzed_df = st.session_state.analyzed_df
+            # 분석 결과는 매물 컬럼을 공유하므로 추가된 분석 컬럼만 집계
+            analysis_memory = memory_usage_report(analyzed_df[['Tier', '분석결과']] if analyzed_df is not None else None)
+            st.caption(
+                f"💾 세션 메모리: 매물 {listing_memory['total_bytes'] / 1024 / 1024:.2f}MB ({listing_memory['rows']:,}건) | "
+                f"분석 컬럼 {analysis_memory['total_bytes'] / 1024 / 1024:.2f}MB"
+            )
+            # 모델별 응답 시간/오류 통계 (서킷이 열린 모델은 잠시 후보에서 제외됨)
+            rate_limit_stats = RATE_LIMITER.stats()
+            for model_name, health in MODEL_HEALTH.stats().items():
+                latency = f"{health['avg_latency']:.1f}s" if health['avg_latency'] is not None else "-"
+                first_chunk = f"{health['avg_first_chunk']:.1f}s" if health['avg_first_chunk'] is not None else "-"
+                queue = rate_limit_stats.get(model_name, {'active': 0, 'waiting': 0})
+                st.caption(
+                    f"{'⛔' if health['open'] else '🤖'} {model_name}: "
+                    f"성공 {health['successes']} / 실패 {health['failures']} | 평균 응답 {latency} (첫 응답 {first_chunk}) | "
+                    f"진행 {queue['active']} / 대기 {queue['waiting']}"
+                )
+
 def render_add_car_form(add_car_callback):
     with st.expander("➕ 신규 매물 직접 추가하기 (Form 입력)", expanded=st.session_state.form_expanded):
         st.info("아래 양식을 작성하여 리스트에 매물을 추가하세요.")
@@ -254,29 +282,32 @@ def render_edit_car_form(auto_save):
 
                 if st.form_submit_button("수정 내용 저장"):
                     # 데이터 업데이트
-                    st.session_state.df.at[selected_idx, '차량명'] = edit_name
-                    st.session_state.df.at[selected_idx, '엔진'] = edit_engine
-                    st.session_state.df.at[selected_idx, '트림'] = edit_trim
-                    st.session_state.df.at[selected_idx, '색상'] = edit_color
-                    st.session_state.df.at[selected_idx, '차량가격(만원)'] = edit_price
-                    st.session_state.df.at[selected_idx, '연식'] = edit_year
-                    st.session_state.df.at[selected_idx, '주행거리(km)'] = edit_km
-                    st.session_state.df.at[selected_idx, '최초 등록일'] = str(edit_reg_date)
-                    st.session_state.df.at[selected_idx, '특수용도이력'] = edit_special
-                    st.session_state.df.at[selected_idx, '1인소유'] = edit_one_owner
-                    st.session_state.df.at[selected_idx, '내차피해횟수'] = edit_my_damage_cnt
-                    st.session_state.df.at[selected_idx, '상대차피해횟수'] = edit_other_damage_cnt
-                    st.session_state.df.at[selected_idx, '내차피해액'] = edit_my_damage_amt
-                    st.session_state.df.at[selected_idx, '일반부품보증기간(개월)'] = edit_war_gen_mon
-                    st.session_state.df.at[selected_idx, '일반부품보증거리(km)'] = edit_war_gen_km
-                    st.session_state.df.at[selected_idx, '주요부품보증기간(개월)'] = edit_war_maj_mon
-                    st.session_state.df.at[selected_idx, '주요부품보증거리(km)'] = edit_war_maj_km
-                    st.session_state.df.at[selected_idx, '수리내역'] = edit_repair
-                    st.session_state.df.at[selected_idx, '옵션'] = edit_option
-                    st.session_state.df.at[selected_idx, '_source'] = 'manual' # 수정되면 수기 데이터로 간주
+                    edited_values = {
+                        '차량명': edit_name,
+                        '엔진': edit_engine,
+                        '트림': edit_trim,
+                        '색상': edit_color,
+                        '차량가격(만원)': edit_price,
+                        '연식': edit_year,
+                        '주행거리(km)': edit_km,
+                        '최초 등록일': str(edit_reg_date),
+                        '특수용도이력': edit_special,
+                        '1인소유': edit_one_owner,
+                        '내차피해횟수': edit_my_damage_cnt,
+                        '상대차피해횟수': edit_other_damage_cnt,
+                        '내차피해액': edit_my_damage_amt,
+                        '일반부품보증기간(개월)': edit_war_gen_mon,
+                        '일반부품보증거리(km)': edit_war_gen_km,
+                        '주요부품보증기간(개월)': edit_war_maj_mon,
+                        '주요부품보증거리(km)': edit_war_maj_km,
+                        '수리내역': edit_repair,
+                        '옵션': edit_option,
+                        '_source': 'manual' # 수정되면 수기 데이터로 간주
+                    }
+                    set_listing_values(st.session_state.df, selected_idx, edited_values)
 
                     st.session_state.analyzed_df = None # 데이터 변경 시 분석 결과 초기화
-                    auto_save()
+                    auto_save('edit', index=selected_idx, values=edited_values)
                     st.success(f"'{edit_name}' 정보가 수정되었습니다.")
                     st.rerun()
 
@@ -296,16 +327,17 @@ def render_delete_car_form(auto_save):
                     indices_to_drop = [int(opt.split(" :")[0]) for opt in selected_to_delete]
                     
                     # 삭제되는 행들 중 CSV 출신인 경우 시그니처 저장
-                    for idx in indices_to_drop:
-                        if idx < len(st.session_state.df):
-                            row = st.session_state.df.iloc[idx]
-                            if row.get('_source') == 'csv':
-                                sig = get_row_signature(row)
-                                st.session_state.deleted_csv_rows.add(sig)
+                    dropped_rows = st.session_state.df.iloc[[idx for idx in indices_to_drop if idx < len(st.session_state.df)]]
+                    if '_source' in dropped_rows.columns:
+                        dropped_rows = dropped_rows[dropped_rows['_source'] == 'csv']
+                    else:
+                        dropped_rows = dropped_rows.iloc[0:0]
+                    deleted_signatures = [int(h) for h in compute_row_signatures(dropped_rows)]
+                    st.session_state.deleted_csv_rows.update(deleted_signatures)
 
                     st.session_state.df = st.session_state.df.drop(indices_to_drop).reset_index(drop=True)
                     
-                    auto_save() # 자동 저장
+                    auto_save('delete', indices=indices_to_drop, signatures=deleted_signatures) # 자동 저장
                     
                     st.success("선택한 차량이 삭제되었습니다.")
                     st.rerun()
@@ -321,7 +353,8 @@ def render_delete_car_form(auto_save):
             col_conf_1, col_conf_2 = st.columns(2)
             with col_conf_1:
                 if st.button("✅ 예, 모두 삭제합니다", use_container_width=True):
-                    st.session_state.df = pd.DataFrame(columns=DEFAULT_COLUMNS.keys())
+                    st.session_state.df = empty_listing_frame()
+                    cancel_report_generation() # 진행 중인 리포트 작업 취소
                     st.session_state.analyzed_df = None
                     st.session_state.ai_report = None
                     st.session_state.ai_model_used = None
@@ -339,11 +372,70 @@ def render_delete_car_form(auto_save):
                     st.session_state.confirm_delete_all = False
                     st.rerun()
 
+def collect_report_job():
+    """
+    백그라운드 리포트 작업이 끝났으면 결과를 세션 상태로 옮기고 True를 반환합니다.
+    (취소되었거나 기록이 사라진 작업은 작업 ID만 정리)
+    """
+    job_id = st.session_state.get('report_job_id')
+    if not job_id:
+        return False
+    job = get_report_job(job_id)
+    if job is not None and job['status'] in ('pending', 'running'):
+        return False
+    st.session_state.report_job_id = None
+    if job is not None and job['status'] == 'done':
+        st.session_state.ai_report, st.session_state.ai_model_used, st.session_state.ai_report_from_cache = job['result']
+        return True
+    return False
+
+def cancel_report_generation():
+    """진행 중인 리포트 작업을 취소합니다."""
+    job_id = st.session_state.get('report_job_id')
+    if job_id:
+        cancel_report_job(job_id)
+    st.session_state.report_job_id = None
+    st.session_state.generating_report = False
+
+def _report_job_status():
+    """리포트 작업 진행 상태 표시 (완료되면 전체 화면을 다시 그려 리포트를 표시)"""
+    job_id = st.session_state.get('report_job_id')
+    job = get_report_job(job_id) if job_id else None
+    if job is None or job['status'] not in ('pending', 'running'):
+        collect_report_job()
+        st.rerun()
+        return
+    if job['status'] == 'pending':
+        status_text = "대기열에서 순서를 기다리는 중"
+    elif job['queue_position']:
+        # 모델별 요청 한도가 차서 다른 요청이 끝나기를 기다리는 중
+        status_text = f"AI 요청 대기열({job['queue_position']}번째)에서 순서를 기다리는 중"
+    else:
+        status_text = "보고서를 작성 중"
+    st.info(f"⏳ 엔지니어가 매물을 꼼꼼히 살펴보고 {status_text}입니다... ({job['elapsed']:.0f}초 경과) 그동안 다른 탭을 둘러보셔도 됩니다.")
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        st.button("⏹️ 생성 취소", on_click=cancel_report_generation)
+    if not hasattr(st, 'fragment'):
+        with col2:
+            st.button("상태 새로고침")
+    if job['partial']:
+        # 스트리밍으로 지금까지 받은 리포트를 먼저 보여줌 (완료되면 전체 리포트로 교체)
+        st.markdown(job['partial'] + " ▌")
+
+# 작업 상태는 부분 실행(fragment)으로 주기적으로 확인 (지원하지 않는 Streamlit 버전에서는 새로고침 버튼 사용)
+render_report_job_status = st.fragment(run_every=REPORT_POLL_SECONDS)(_report_job_status) if hasattr(st, 'fragment') else _report_job_status
+
 def render_analysis_results(start_generation, reset_generation):
     st.divider()
     st.header("📊 분석 결과")
     
     df = st.session_state.analyzed_df
+
+    # 다른 탭을 보는 동안 끝난 리포트 작업의 결과를 가져옴
+    collect_report_job()
+    if st.session_state.get('report_job_id') and st.session_state.menu_index != 1:
+        st.caption("⏳ AI 리포트를 백그라운드에서 생성 중입니다. 완료되면 'AI 엔지니어 리포트' 탭에서 확인할 수 있습니다.")
     
     # 1. 전체 리스트
     if st.session_state.menu_index == 0:
@@ -368,30 +460,40 @@ def render_analysis_results(start_generation, reset_generation):
             st.session_state.copied_prompt_text = None
 
         def copy_prompt():
-            st.session_state.copied_prompt_text = create_engineer_prompt(df, st.session_state.user_preference)
+            # 복사한 프롬프트는 사람이 다른 AI 채팅에 붙여 넣는 용도이므로, 앱 설정과 관계없이 마크다운 표와 마크다운 리포트 형식을 사용
+            st.session_state.copied_prompt_text = create_engineer_prompt(df, st.session_state.user_preference, structured=False, encoding='markdown')
             st.toast("프롬프트가 생성되었습니다! 아래의 'Show Prompt'를 확인하세요.")
 
         if st.session_state.generating_report:
-            with st.spinner("엔지니어가 매물을 꼼꼼히 살펴보고 보고서를 작성 중입니다..."):
-                report_text, model_name = generate_engineer_report(df, st.session_state.user_preference)
-                
-                st.session_state.ai_report = report_text
-                st.session_state.ai_model_used = model_name
-                st.session_state.generating_report = False
-                st.rerun()
-        
+            # 리포트는 백그라운드 작업으로 생성 (스크립트 스레드를 막지 않으므로 다른 탭을 계속 볼 수 있음)
+            use_cache = not st.session_state.get('bypass_report_cache', False)
+            st.session_state.report_job_id = submit_report_job(df, st.session_state.user_preference, use_cache=use_cache)
+            st.session_state.bypass_report_cache = False
+            st.session_state.generating_report = False
+
+        if st.session_state.get('report_job_id'):
+            render_report_job_status()
+
         elif st.session_state.ai_report:
             if st.session_state.ai_model_used:
                 st.caption(f"💡 AI 분석 모델: **{st.session_state.ai_model_used}**")
+            if st.session_state.get('ai_report_from_cache'):
+                st.caption("⚡ 같은 데이터와 분석 성향으로 이전에 생성된 리포트를 캐시에서 불러왔습니다. 새 리포트가 필요하면 '새로 생성'을 눌러주세요.")
             
             st.markdown(st.session_state.ai_report)
             st.divider()
             
-            col1, col2, col3 = st.columns([2, 1.5, 6.5])
+            def regenerate_without_cache():
+                st.session_state.bypass_report_cache = True
+                reset_generation()
+
+            col1, col2, col3, col4 = st.columns([2, 2.5, 1.5, 4])
             with col1:
                 st.button("🔄 리포트 다시 생성", on_click=reset_generation)
+            with col2:
+                st.button("🆕 새로 생성 (캐시 무시)", on_click=regenerate_without_cache, help="캐시된 리포트를 사용하지 않고 Gemini에 새로 요청합니다.")
             if st.query_params.get("debug") == "true":
-                with col2:
+                with col3:
                     st.button("프롬프트 보기", on_click=copy_prompt, help="Gemini에 전송되는 프롬프트 내용을 확인합니다.")
             
         else:
@@ -416,7 +518,11 @@ def render_analysis_results(start_generation, reset_generation):
         if recommendations.empty:
             st.warning("Tier 3 (단순 교환 무사고급) 매물이 없습니다.")
         else:
-            st.dataframe(recommendations[['차량명', '차량가격(만원)', '주행거리(km)', '연식', '수리내역', '특수용도이력', '분석결과']])
+            # 잔여 보증(만료 정책 반영)을 함께 표시
+            recommendations = recommendations.join(compute_warranty_frame(recommendations).drop(columns=['경과개월수']))
+            display_cols = ['차량명', '차량가격(만원)', '주행거리(km)', '연식', '수리내역', '특수용도이력', '분석결과',
+                            '잔여일반보증(개월)', '잔여일반보증(km)', '잔여주요보증(개월)', '잔여주요보증(km)']
+            st.dataframe(recommendations[[c for c in display_cols if c in recommendations.columns]])
 
     # 4. Rule-Based 경고
     elif st.session_state.menu_index == 3:
@@ -437,44 +543,33 @@ def render_analysis_results(start_generation, reset_generation):
         st.subheader("📈 심층 가격 분석 (다변량 회귀)")
         st.info("연식, 주행거리, 사고 여부가 가격에 미치는 영향을 분석하여 '진짜 가성비'를 찾습니다.")
 
+        # 0. 전체 매물 시세 평가 (분석 시 세그먼트별 회귀로 계산된 예측가격/가격차이)
+        if '가격차이' in df.columns:
+            valued = df[df['가격차이'].notna()]
+            m1, m2, m3 = st.columns(3)
+            m1.metric("🌐 시세 평가 매물", f"{len(valued):,} / {len(df):,}대")
+            m2.metric("💎 저평가 (50만원 이상)", f"{(valued['가격차이'] < -50).sum():,}대")
+            m3.metric("⚠️ 고평가 (50만원 이상)", f"{(valued['가격차이'] > 50).sum():,}대")
+            if len(valued) < len(df):
+                st.caption(f"같은 차량명의 매물이 {MIN_MODEL_ROWS}개 미만인 차종은 시세를 평가하지 않습니다. (엔진/트림별 매물이 부족하면 차량명 단위 모델로 평가)")
+            st.divider()
+
         # 1. 차종 선택
         unique_models = df['차량명'].unique()
         selected_model = st.selectbox("분석할 차종을 선택하세요", unique_models)
 
-        # 데이터 필터링
-        model_df = df[df['차량명'] == selected_model].copy()
+        # 가격 모델은 (세션, 차종, 데이터 버전)별로 캐시되므로 rerun이나 차종 전환 시 다시 적합하지 않음
+        price_fit = PRICE_MODELS.fit(df, selected_model, source=st.session_state.session_id)
+        model_df = price_fit['frame']
 
         # 최소 샘플 확인
-        if len(model_df) < 10:
-            st.error(f"데이터 부족: '{selected_model}'의 매물이 {len(model_df)}개뿐입니다. 정밀 분석을 위해 최소 10개 이상의 데이터가 필요합니다.")
+        if len(model_df) < MIN_MODEL_ROWS:
+            st.error(f"데이터 부족: '{selected_model}'의 매물이 {len(model_df)}개뿐입니다. 정밀 분석을 위해 최소 {MIN_MODEL_ROWS}개 이상의 데이터가 필요합니다.")
         else:
-            # 2. 데이터 전처리 (사고 여부 변수 생성)
-            major_accident_keywords = [
-                '휠하우스', '인사이드패널', '사이드멤버', '플로어패널', '대쉬패널', '필러', 
-                '루프패널', '트렁크플로어', '백판넬', '리어패널', '프런트패널', '리어액슬', 
-                '쿼터패널', '패널 앗세이'
-            ]
-            
-            def check_major_accident(repair_history):
-                for keyword in major_accident_keywords:
-                    if keyword in str(repair_history):
-                        return 1
-                return 0
-
-            model_df['Is_Major_Accident'] = model_df['수리내역'].apply(check_major_accident)
-            
-            # 회귀 분석 준비
-            X = model_df[['연식', '주행거리(km)', 'Is_Major_Accident']]
-            y = model_df['차량가격(만원)']
-            
-            # 3. 다중 회귀분석 수행
-            reg = LinearRegression()
-            reg.fit(X, y)
-            
             # 계수 추출
-            coef_year = reg.coef_[0]
-            coef_mileage = reg.coef_[1]
-            coef_accident = reg.coef_[2]
+            coef_year = price_fit['coefficients']['연식']
+            coef_mileage = price_fit['coefficients']['주행거리(km)']
+            coef_accident = price_fit['coefficients']['Is_Major_Accident']
             
             # 4. 시장 가치 지표 출력
             m1, m2, m3 = st.columns(3)
@@ -483,10 +578,6 @@ def render_analysis_results(start_generation, reset_generation):
             m3.metric("💥 사고의 감가", f"{coef_accident:.1f}만원", delta_color="inverse")
             
             # 5. 시각화 (Altair)
-            # 적정가 예측
-            model_df['예측가격'] = reg.predict(X)
-            model_df['가격차이'] = model_df['차량가격(만원)'] - model_df['예측가격']
-            
             # 차트 생성
             chart = alt.Chart(model_df).mark_point(filled=True, size=100).encode(
                 x=alt.X('주행거리(km)', title='주행거리 (km)'),
@@ -496,12 +587,9 @@ def render_analysis_results(start_generation, reset_generation):
                 tooltip=['차량명', '차량가격(만원)', '연식', '주행거리(km)', '수리내역', '가격차이']
             ).interactive()
             
-            # 적정가 추세선 (무사고 기준)
-            clean_df = model_df[model_df['Is_Major_Accident'] == 0]
-            if len(clean_df) > 1:
-                # Simple regression for the line: Price ~ Mileage
-                reg_clean = LinearRegression()
-                reg_clean.fit(clean_df[['주행거리(km)']], clean_df['차량가격(만원)'])
+            # 적정가 추세선 (무사고 기준: 가격 ~ 주행거리)
+            if price_fit['clean_line'] is not None:
+                clean_intercept, clean_slope = price_fit['clean_line']
                 
                 # Line data generation
                 x_min = model_df['주행거리(km)'].min()
@@ -509,7 +597,7 @@ def render_analysis_results(start_generation, reset_generation):
                 # 구간을 잘게 쪼개서 툴팁이 선 위 어디서든 잘 뜨게 함
                 x_range = np.linspace(x_min, x_max, 20)
                 line_data = pd.DataFrame({'주행거리(km)': x_range})
-                line_data['차량가격(만원)'] = reg_clean.predict(line_data[['주행거리(km)']])
+                line_data['차량가격(만원)'] = clean_intercept + clean_slope * x_range
                 line_data['정보'] = "무사고 기준 적정 시세"
                 
                 line_chart = alt.Chart(line_data).mark_line(color='red', strokeDash=[5, 5], size=3).encode(